@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Benchmark media pipeline variants offline.
+
+Each variant encodes a live test source into payloaders linked to fakesinks,
+in its own process. Frames per second, encode time per frame, CPU usage and
+peak RSS are measured and printed as JSON. Results can be compared to a
+previous run to catch regressions.
+
+Usage: python benchmarks/bench_pipeline.py --output results.json
+       python benchmarks/bench_pipeline.py --compare results.json
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+#: Pipeline variants, as MediaPipeline arguments
+VARIANTS: Dict[str, dict] = {
+    "vp8-720p": {},
+    "vp8-720p-low-cpu": {"encoder_preset": "low-cpu"},
+    "vp8-720p-quality": {"encoder_preset": "quality"},
+    "vp8-360p": {"input_uri": "test:?width=640&height=360"},
+    "vp8-1080p": {"input_uri": "test:?width=1920&height=1080"},
+    "vp8-720p-no-audio": {"input_uri": "test:?audio=0", "kinds": ("video",)},
+    "vp8-720p-3-layers": {"temporal_layers": 3},
+    "vp9-720p": {"codec": "vp9"},
+    "h264-720p": {"codec": "h264"},
+}
+
+#: Video encoder stages, from its sink pad to its source pad, excluding the
+#: time spent waiting in the queue before it
+ENCODER_STAGES = [
+    ("video", "encoder-input", None, "venc", "sink"),
+    ("video", "encoder-output", "encoder-input", "venc", "src"),
+]
+
+#: Metrics where a higher value is a regression
+HIGHER_IS_WORSE = ["encode_ms_per_frame", "cpu_percent", "max_rss_mb"]
+
+
+def cpu_time() -> float:
+    """Get CPU time used by this process, in seconds.
+
+    :return: user and system time
+    :rtype: float
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_variant(name: str, duration: float, warmup: float) -> dict:
+    """Run one variant in this process.
+
+    :param name: variant name
+    :type name: str
+    :param duration: measurement duration in seconds
+    :type duration: float
+    :param warmup: time before measuring in seconds
+    :type warmup: float
+    :return: results
+    :rtype: dict
+    """
+    import gi
+
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst
+
+    from galene_stream.latency import LatencyTracer
+    from galene_stream.webrtc import MediaPipeline
+
+    kwargs = {"input_uri": "test:", "bitrate": 1048576, **VARIANTS[name]}
+    tracer = LatencyTracer()
+    media = MediaPipeline(latency_tracer=tracer, **kwargs)
+
+    # Payload encoded streams to fakesinks instead of WebRTC
+    payloaders = {"v": media.video_codec.payloader, "a": "rtpopuspay pt=96"}
+    output = Gst.parse_bin_from_description(
+        " ".join(
+            f"queue name={k}queue ! {payloaders[k]} ! fakesink sync=false"
+            for k in media.prefixes
+        ),
+        False,
+    )
+    for kind in media.prefixes:
+        queue = output.get_by_name(f"{kind}queue")
+        output.add_pad(Gst.GhostPad.new(f"{kind}sink", queue.get_static_pad("sink")))
+    event_loop = asyncio.get_event_loop()
+    media.add_output(output)
+    media.trace_latency(media.pipe, ENCODER_STAGES)
+    event_loop.run_until_complete(asyncio.sleep(warmup))
+
+    stage = ("video", "encoder-output")
+    frames, cpu, start = media.frames["video"], cpu_time(), time.monotonic()
+    encoded = tracer.histograms.get(stage)
+    encode_sum, encode_count = (encoded.sum, encoded.count) if encoded else (0, 0)
+    event_loop.run_until_complete(asyncio.sleep(duration))
+    elapsed = time.monotonic() - start
+    frames = media.frames["video"] - frames
+    cpu = cpu_time() - cpu
+    encoded = tracer.histograms.get(stage)
+    if encoded and encoded.count > encode_count:
+        encode_time = (encoded.sum - encode_sum) / (encoded.count - encode_count)
+    else:
+        encode_time = None
+    media.close()
+
+    return {
+        "variant": name,
+        "frames_per_second": frames / elapsed,
+        "encode_ms_per_frame": encode_time * 1000 if encode_time else None,
+        "cpu_percent": 100 * cpu / elapsed,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_all(variants: List[str], duration: float, warmup: float) -> List[dict]:
+    """Run variants, each in a new process.
+
+    :param variants: variant names
+    :type variants: list of str
+    :param duration: measurement duration in seconds
+    :type duration: float
+    :param warmup: time before measuring in seconds
+    :type warmup: float
+    :return: results of each variant
+    :rtype: list of dict
+    """
+    results = []
+    for name in variants:
+        cmd = [sys.executable, __file__, "--run", name]
+        cmd += ["--duration", str(duration), "--warmup", str(warmup)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{name} failed:\n{proc.stderr}", file=sys.stderr)
+            results.append({"variant": name, "error": proc.stderr.strip()})
+            continue
+        result = json.loads(proc.stdout.splitlines()[-1])
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> bool:
+    """Report regressions compared to a previous run.
+
+    :param results: current results
+    :type results: list of dict
+    :param baseline: previous results
+    :type baseline: list of dict
+    :param threshold: relative change considered as a regression
+    :type threshold: float
+    :return: True if no regression was found
+    :rtype: bool
+    """
+    previous = {r["variant"]: r for r in baseline}
+    ok = True
+    for result in results:
+        old = previous.get(result["variant"], {})
+        for metric, value in result.items():
+            if not isinstance(value, float) or not old.get(metric):
+                continue
+            change = (value - old[metric]) / old[metric]
+            if metric not in HIGHER_IS_WORSE:
+                change = -change
+            if change > threshold:
+                ok = False
+                print(
+                    f"Regression of {result['variant']} {metric}: "
+                    f"{old[metric]:.2f} -> {value:.2f}",
+                    file=sys.stderr,
+                )
+    return ok
+
+
+def main() -> None:
+    """Parse options and run benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS))
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="previous JSON results to compare to")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--run", choices=list(VARIANTS), help=argparse.SUPPRESS)
+    opt = parser.parse_args()
+
+    if opt.run:
+        print(json.dumps(run_variant(opt.run, opt.duration, opt.warmup)))
+        return
+
+    results = run_all(opt.variants or list(VARIANTS), opt.duration, opt.warmup)
+    text = json.dumps(results, indent=2)
+    if opt.output:
+        with open(opt.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if opt.compare:
+        with open(opt.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, opt.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Micro-benchmark of signaling message decoding.
+
+Compares decoding every message with json.loads, as done before the dispatch
+table, to the dispatcher pre-filter with each available JSON codec, on traffic
+of a busy group where most messages are ignored. Dispatch is also timed with
+handlers replying to pings, with sends stubbed so that network time is not
+counted.
+
+Usage: python benchmarks/bench_protocol.py [--number N]
+"""
+
+import argparse
+import asyncio
+import json
+import timeit
+
+from galene_stream.protocol import CODECS, Dispatcher
+
+#: Traffic of a busy group, as encoded by Galène
+MESSAGES = [
+    json.dumps(m, separators=(",", ":"))
+    for m in 10
+    * [
+        {
+            "type": "user",
+            "kind": "add",
+            "id": "8c1b5f1e",
+            "username": "participant",
+            "permissions": ["present", "message"],
+            "data": {"raisehand": False},
+        },
+        {
+            "type": "chathistory",
+            "source": "8c1b5f1e",
+            "username": "participant",
+            "time": 1700000000000,
+            "kind": "",
+            "value": "Hello everyone, " * 10,
+        },
+        {
+            "type": "chat",
+            "source": "8c1b5f1e",
+            "username": "participant",
+            "time": 1700000000000,
+            "value": "Can you hear me?",
+        },
+        {"type": "close", "id": "8c1b5f1e"},
+    ]
+    + [{"type": "ping"}]
+]
+
+
+def decode_all(dispatcher: Dispatcher) -> None:
+    """Decode all messages with the dispatcher.
+
+    :param dispatcher: dispatcher to benchmark
+    :type dispatcher: Dispatcher
+    """
+    for raw in MESSAGES:
+        dispatcher.decode(raw)
+
+
+async def dispatch_all(dispatcher: Dispatcher, number: int) -> None:
+    """Dispatch all messages with the dispatcher, many times.
+
+    :param dispatcher: dispatcher to benchmark
+    :type dispatcher: Dispatcher
+    :param number: number of times messages are dispatched
+    :type number: int
+    """
+    for _ in range(number):
+        for raw in MESSAGES:
+            await dispatcher.dispatch(raw)
+
+
+def create_dispatcher(codec) -> Dispatcher:
+    """Create a dispatcher with handlers as registered by GaleneClient.
+
+    Handlers encode their reply, but sending it is stubbed.
+
+    :param codec: JSON codec
+    :type codec: JSONCodec
+    :return: dispatcher
+    :rtype: Dispatcher
+    """
+
+    async def send(message: dict) -> None:
+        """Encode message without sending it."""
+        codec.dumps(message)
+
+    async def on_ping(message: dict) -> None:
+        """Answer pong."""
+        await send({"type": "pong"})
+
+    async def on_chat(message: dict) -> None:
+        """Ignore chat messages which are not commands."""
+        if message.get("value") == "!webrtc":
+            await send({"type": "chat", "value": ""})
+
+    dispatcher = Dispatcher(codec)
+    dispatcher.register("ping", on_ping)
+    dispatcher.register("chat", on_chat)
+    dispatcher.ignore("user", "close", "chathistory")
+    return dispatcher
+
+
+def main() -> None:
+    """Run benchmark and print time per message."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=2000)
+    number = parser.parse_args().number
+    count = number * len(MESSAGES)
+
+    baseline = timeit.timeit(
+        lambda: [json.loads(raw) for raw in MESSAGES], number=number
+    )
+    print(f"json.loads every message: {baseline / count * 1e6:.2f} us/message")
+    for name, codec in CODECS.items():
+        dispatcher = create_dispatcher(codec)
+        elapsed = timeit.timeit(lambda: decode_all(dispatcher), number=number)
+        print(
+            f"dispatcher with {name}: {elapsed / count * 1e6:.2f} us/message "
+            f"({baseline / elapsed:.1f}x)"
+        )
+        elapsed = timeit.timeit(
+            lambda: asyncio.run(dispatch_all(dispatcher, number)), number=1
+        )
+        print(
+            f"dispatch and handle with {name}, sends stubbed: "
+            f"{elapsed / count * 1e6:.2f} us/message"
+        )
+
+
+if __name__ == "__main__":
+    main()
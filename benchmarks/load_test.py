@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Load test many gateways against a local fake Galène server.
+
+Each gateway encodes its own live test source and streams it to a loopback
+WebRTC peer. Reports setup time of each stream, CPU usage per stream and
+signaling messages per second. The fake server and its peers run in another
+process, so that CPU usage only counts gateways.
+
+Usage: python benchmarks/load_test.py --streams 8 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import statistics
+import time
+from typing import Dict, List, Optional
+
+from galene_stream.fake_server import FakeGalene
+from galene_stream.galene import GaleneClient
+from galene_stream.webrtc import MediaPipeline
+
+
+def cpu_time() -> float:
+    """Get CPU time used by this process, in seconds.
+
+    :return: user and system time
+    :rtype: float
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def serve(conn) -> None:
+    """Run fake server, sending its URL then its message count on request.
+
+    :param conn: pipe to the load test process
+    :type conn: multiprocessing.connection.Connection
+    """
+
+    async def run() -> None:
+        """Serve until asked to stop."""
+        server = FakeGalene(ping_interval=1.0)
+        await server.start()
+        conn.send(server.url)
+        event_loop = asyncio.get_event_loop()
+        while await event_loop.run_in_executor(None, conn.recv) != "stop":
+            conn.send(server.messages_received + server.messages_sent)
+        await server.close()
+
+    asyncio.run(run())
+
+
+async def request(conn, command: str):
+    """Send a command to the fake server process and wait for its reply.
+
+    :param conn: pipe to the fake server process
+    :type conn: multiprocessing.connection.Connection
+    :param command: command
+    :type command: str
+    :return: reply
+    """
+    conn.send(command)
+    return await asyncio.get_event_loop().run_in_executor(None, conn.recv)
+
+
+async def wait_connected(client: GaleneClient, start: float) -> Optional[float]:
+    """Wait until ICE is connected.
+
+    :param client: Galène client
+    :type client: GaleneClient
+    :param start: start time
+    :type start: float
+    :return: setup time in seconds, or None on timeout
+    :rtype: float, optional
+    """
+    while time.monotonic() - start < 30:
+        webrtc = client.webrtc.webrtc
+        if webrtc is not None:
+            state = webrtc.get_property("ice-connection-state").value_nick
+            if state in ["connected", "completed"]:
+                return time.monotonic() - start
+        await asyncio.sleep(0.01)
+    return None
+
+
+async def run(opt: argparse.Namespace) -> Dict[str, object]:
+    """Run load test.
+
+    :param opt: program options
+    :type opt: argparse.Namespace
+    :return: results
+    :rtype: dict
+    """
+    event_loop = asyncio.get_event_loop()
+    conn, server_conn = multiprocessing.Pipe()
+    server = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(server_conn,), daemon=True
+    )
+    server.start()
+    url = await event_loop.run_in_executor(None, conn.recv)
+
+    clients: List[GaleneClient] = []
+    for i in range(opt.streams):
+        media = MediaPipeline(
+            "test:", opt.bitrate, opt.codec, opt.encoder_preset, opt.encoder_threads
+        )
+        clients.append(GaleneClient("test:", url, opt.bitrate, f"load{i}", media=media))
+
+    start = time.monotonic()
+    cpu_start = cpu_time()
+    tasks = [asyncio.ensure_future(c.run(event_loop)) for c in clients]
+    setup_times = await asyncio.gather(*(wait_connected(c, start) for c in clients))
+
+    # Measure steady state, once all streams sent their first frames
+    cpu_steady = cpu_time()
+    frames = sum(c.webrtc.media.frames["video"] for c in clients)
+    messages = await request(conn, "stats")
+    steady = time.monotonic()
+    await asyncio.sleep(opt.duration)
+    cpu_used = cpu_time() - cpu_steady
+    frames = sum(c.webrtc.media.frames["video"] for c in clients) - frames
+    messages = await request(conn, "stats") - messages
+    elapsed = time.monotonic() - steady
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for client in clients:
+        await client.close()
+    conn.send("stop")
+    server.join()
+
+    connected = [t for t in setup_times if t is not None]
+    return {
+        "streams": opt.streams,
+        "connected": len(connected),
+        "setup_seconds_mean": statistics.mean(connected) if connected else None,
+        "setup_seconds_max": max(connected) if connected else None,
+        "setup_cpu_seconds": cpu_steady - cpu_start,
+        "cpu_percent_per_stream": 100 * cpu_used / elapsed / opt.streams,
+        "messages_per_second": messages / elapsed,
+        "frames_per_second": frames / elapsed / opt.streams,
+    }
+
+
+def main() -> None:
+    """Parse options, run load test and print results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--bitrate", type=int, default=1048576)
+    parser.add_argument("--codec", default="vp8")
+    parser.add_argument("--encoder-preset")
+    parser.add_argument("--encoder-threads", type=int)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    parser.add_argument("--debug", action="store_true")
+    opt = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if opt.debug else logging.WARNING)
+
+    results = asyncio.get_event_loop().run_until_complete(run(opt))
+    if opt.json:
+        print(json.dumps(results))
+        return
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.3f}"
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
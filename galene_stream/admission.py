@@ -0,0 +1,298 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Admission control and load shedding when the host is overloaded.
+
+The host is overloaded when its CPU usage is above a threshold, or when
+encoders do not keep up with their input. Depending on the policy, new bridges
+are refused, or the lowest priority streams have their video bitrate lowered
+or their video dropped, so that a few streams degrade rather than all.
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from galene_stream.metrics import Sample
+
+if TYPE_CHECKING:
+    from galene_stream.webrtc import MediaPipeline
+
+log = logging.getLogger(__name__)
+
+#: Policies applied when host is overloaded
+ADMISSION_POLICIES = ["refuse", "lower-bitrate", "drop-video"]
+
+
+def read_cpu_times(path: str = "/proc/stat") -> Optional[Tuple[int, int]]:
+    """Read time spent by host CPUs since boot.
+
+    :param path: kernel statistics file
+    :type path: str, optional
+    :return: busy and total time in clock ticks, or None if unavailable
+    :rtype: tuple, optional
+    """
+    try:
+        with open(path) as f:
+            fields = [int(v) for v in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # Guest time is already counted in user and nice time
+    total = sum(fields[:8])
+    idle = sum(fields[3:5])  # idle and iowait
+    return total - idle, total
+
+
+class CPUMonitor:
+    """Measure host CPU usage between two samples."""
+
+    def __init__(self, path: str = "/proc/stat") -> None:
+        """Init CPUMonitor.
+
+        :param path: kernel statistics file
+        :type path: str, optional
+        """
+        self.path = path
+        self.previous = read_cpu_times(path)
+
+    def sample(self) -> Optional[float]:
+        """Get CPU usage since previous sample.
+
+        :return: busy fraction of all CPUs, from 0 to 1, or None if unknown
+        :rtype: float, optional
+        """
+        current = read_cpu_times(self.path)
+        previous, self.previous = self.previous, current
+        if current is None or previous is None or current[1] <= previous[1]:
+            return None
+        return (current[0] - previous[0]) / (current[1] - previous[1])
+
+
+class StreamLoad:
+    """Encoding throughput and shedding state of one media pipeline."""
+
+    def __init__(self, name: str, media: "MediaPipeline", priority: int) -> None:
+        """Init StreamLoad.
+
+        :param name: bridge name, used in logs
+        :type name: str
+        :param media: media pipeline
+        :type media: MediaPipeline
+        :param priority: streams with lower priority are degraded first
+        :type priority: int
+        """
+        self.name = name
+        self.media = media
+        self.priority = priority
+        self.bitrate_limit: Optional[int] = None
+        self.video_dropped = False
+        self.last = self.counters()
+
+    def counters(self) -> Tuple[int, int, int]:
+        """Get video frames entering and leaving encoders, and dropped buffers.
+
+        :return: input frames, encoded frames and dropped buffers
+        :rtype: tuple
+        """
+        return (
+            self.media.input_frames,
+            self.media.frames.get("video", 0),
+            sum(self.media.dropped.values()),
+        )
+
+    def keeps_up(self, min_ratio: float) -> bool:
+        """Check encoders kept up with input since previous check.
+
+        :param min_ratio: minimum ratio of encoded frames to input frames
+        :type min_ratio: float
+        :return: False if buffers were dropped or too few frames encoded
+        :rtype: bool
+        """
+        current, last = self.counters(), self.last
+        self.last = current
+        if self.video_dropped:
+            return True  # video is not encoded on purpose
+        inputs, encoded, dropped = (c - p for c, p in zip(current, last))
+        if dropped > 0:
+            return False
+        return inputs == 0 or encoded >= min_ratio * inputs
+
+    @property
+    def shed(self) -> bool:
+        """Whether this stream was degraded to shed load.
+
+        :return: True if degraded
+        :rtype: bool
+        """
+        return self.video_dropped or self.bitrate_limit is not None
+
+
+class AdmissionController:
+    """Refuse bridges or degrade low priority streams on overload."""
+
+    #: Time between two load checks, in seconds
+    interval = 2.0
+    #: Streams are restored once CPU usage is this much below maximum
+    recover_margin = 0.15
+    #: Minimum ratio of encoded frames to input frames
+    min_encode_ratio = 0.9
+    #: Video bitrate is never lowered below this value, in bit/s
+    min_bitrate = 131072
+
+    def __init__(
+        self,
+        policy: str,
+        max_cpu: float = 0.9,
+        monitor: Optional[CPUMonitor] = None,
+    ) -> None:
+        """Init AdmissionController.
+
+        :param policy: policy applied on overload, one of
+            :data:`ADMISSION_POLICIES`
+        :type policy: str
+        :param max_cpu: host CPU usage above which host is overloaded,
+            from 0 to 1
+        :type max_cpu: float, optional
+        :param monitor: host CPU monitor
+        :type monitor: CPUMonitor, optional
+        """
+        self.policy = policy
+        self.max_cpu = max_cpu
+        self.monitor = monitor or CPUMonitor()
+        self.streams: Dict[int, StreamLoad] = {}
+        self.cpu: Optional[float] = None
+        self.overloaded = False
+        self.refused: Set[str] = set()
+        self.shed_steps = 0
+
+    def add(self, name: str, media: "MediaPipeline", priority: int = 0) -> None:
+        """Watch a media pipeline.
+
+        :param name: bridge name, used in logs
+        :type name: str
+        :param media: media pipeline
+        :type media: MediaPipeline
+        :param priority: streams with lower priority are degraded first
+        :type priority: int, optional
+        """
+        self.streams[id(media)] = StreamLoad(name, media, priority)
+
+    def check(self) -> bool:
+        """Measure load since previous check.
+
+        :return: True if host is overloaded
+        :rtype: bool
+        """
+        self.cpu = self.monitor.sample()
+        lagging = [
+            s.name
+            for s in list(self.streams.values())
+            if not s.keeps_up(self.min_encode_ratio)
+        ]
+        overloaded = bool(lagging) or (self.cpu is not None and self.cpu > self.max_cpu)
+        if overloaded and not self.overloaded:
+            cpu = f"{self.cpu:.0%}" if self.cpu is not None else "unknown"
+            log.warning(
+                f"Host is overloaded, CPU usage {cpu}, "
+                f"encoders lagging: {', '.join(lagging) or 'none'}"
+            )
+        self.overloaded = overloaded
+        return overloaded
+
+    def admit(self, name: str) -> bool:
+        """Check whether a new bridge may start.
+
+        :param name: bridge name, used in logs
+        :type name: str
+        :return: False if host is overloaded and policy refuses bridges
+        :rtype: bool
+        """
+        if self.policy != "refuse" or not self.overloaded:
+            return True
+        if name not in self.refused:
+            log.error(f"Host is overloaded, not starting bridge {name} yet")
+            self.refused.add(name)
+        return False
+
+    def shed(self) -> None:
+        """Degrade the lowest priority stream that can still be degraded."""
+        candidates = [s for s in self.streams.values() if s.media.pipe is not None]
+        if self.policy == "drop-video":
+            candidates = [
+                s
+                for s in candidates
+                if not s.video_dropped and "video" in s.media.kinds
+            ]
+        elif self.policy == "lower-bitrate":
+            # Bitrate of each temporal layer cannot be changed while playing,
+            # and passthrough video has no encoder
+            candidates = [
+                s
+                for s in candidates
+                if (s.bitrate_limit or s.media.max_bitrate) > self.min_bitrate
+                and "video" in s.media.kinds
+                and s.media.temporal_layers == 1
+                and s.media.video_codec.bitrate_property[0]
+            ]
+        else:
+            return
+        if not candidates:
+            return
+        stream = min(candidates, key=lambda s: s.priority)
+        self.shed_steps += 1
+        if self.policy == "drop-video":
+            log.warning(f"Dropping video of {stream.name} to shed load")
+            stream.video_dropped = True
+            stream.media.set_video_enabled(False)
+        else:
+            limit = (stream.bitrate_limit or stream.media.max_bitrate) // 2
+            stream.bitrate_limit = max(self.min_bitrate, limit)
+            log.warning(
+                f"Lowering video bitrate of {stream.name} to "
+                f"{stream.bitrate_limit} bit/s to shed load"
+            )
+            stream.media.limit_bitrate(stream.bitrate_limit)
+
+    def restore(self) -> None:
+        """Restore the highest priority degraded stream by one step."""
+        shed = [s for s in self.streams.values() if s.shed]
+        if not shed:
+            return
+        stream = max(shed, key=lambda s: s.priority)
+        if stream.video_dropped:
+            log.info(f"Restoring video of {stream.name}")
+            stream.video_dropped = False
+            stream.media.set_video_enabled(True)
+            return
+        assert stream.bitrate_limit is not None
+        limit: Optional[int] = stream.bitrate_limit * 2
+        if limit >= stream.media.max_bitrate:
+            limit = None
+        log.info(f"Raising video bitrate limit of {stream.name} to {limit}")
+        stream.bitrate_limit = limit
+        stream.media.limit_bitrate(limit)
+
+    async def run(self) -> None:
+        """Check load periodically, shedding or restoring streams."""
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.check():
+                self.shed()
+            elif self.cpu is None or self.cpu < self.max_cpu - self.recover_margin:
+                self.restore()
+
+    def get_metrics(self) -> List[Sample]:
+        """Get admission control metrics.
+
+        :return: metrics samples
+        :rtype: list
+        """
+        samples: List[Sample] = [
+            ("galene_stream_overloaded", {}, int(self.overloaded)),
+            ("galene_stream_refused_bridges_total", {}, len(self.refused)),
+            ("galene_stream_shed_steps_total", {}, self.shed_steps),
+        ]
+        if self.cpu is not None:
+            samples.append(("galene_stream_host_cpu_usage", {}, self.cpu))
+        return samples
@@ -0,0 +1,73 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Adaptive bitrate driven by RTCP feedback.
+"""
+
+import logging
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+
+class BitrateController:
+    """Loss and delay based bitrate controller.
+
+    Bitrate is decreased multiplicatively when receivers report losses or when
+    round-trip time grows, and increased slowly when the link looks clean.
+    """
+
+    #: Loss fraction above which bitrate is decreased
+    high_loss = 0.1
+    #: Loss fraction under which bitrate is increased
+    low_loss = 0.02
+    #: Round-trip time growth, relative to minimum, considered as congestion
+    rtt_growth = 2.0
+    #: Bitrate increase factor when link is clean
+    increase = 1.05
+
+    def __init__(self, bitrate: int, min_bitrate: int, max_bitrate: int) -> None:
+        """Init BitrateController.
+
+        :param bitrate: initial bitrate in bit/s
+        :type bitrate: int
+        :param min_bitrate: minimum bitrate in bit/s
+        :type min_bitrate: int
+        :param max_bitrate: maximum bitrate in bit/s
+        :type max_bitrate: int
+        """
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.bitrate = max(min_bitrate, min(max_bitrate, bitrate))
+        self.min_rtt: Optional[float] = None
+
+    def update(self, loss: float, rtt: Optional[float] = None) -> int:
+        """Update bitrate from latest receiver feedback.
+
+        :param loss: fraction of packets lost since last report, from 0 to 1
+        :type loss: float
+        :param rtt: round-trip time in seconds, if known
+        :type rtt: float, optional
+        :return: new bitrate in bit/s
+        :rtype: int
+        """
+        congested = False
+        if rtt is not None and rtt > 0:
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+            congested = rtt > self.rtt_growth * self.min_rtt
+
+        if loss > self.high_loss:
+            bitrate = self.bitrate * (1 - loss / 2)
+        elif congested:
+            bitrate = self.bitrate * 0.85
+        elif loss < self.low_loss:
+            bitrate = self.bitrate * self.increase
+        else:
+            bitrate = self.bitrate
+
+        bitrate = int(max(self.min_bitrate, min(self.max_bitrate, bitrate)))
+        if bitrate != self.bitrate:
+            log.debug(f"Adapting bitrate to {bitrate} bit/s (loss={loss:.2f})")
+        self.bitrate = bitrate
+        return bitrate
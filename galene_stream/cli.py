@@ -8,9 +8,181 @@ Main command-line script for Galène stream gateway.
 import argparse
 import asyncio
 import logging
+import os
 import sys
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-from galene_stream.galene import GaleneClient
+from galene_stream.admission import ADMISSION_POLICIES, AdmissionController
+from galene_stream.bitrate import BitrateController
+from galene_stream.codecs import (
+    ENCODER_PRESETS,
+    OPUS_FRAME_SIZES,
+    OVERLOAD_POLICIES,
+    TEMPORAL_LAYERS,
+    VIDEO_CODECS,
+    opus_desc,
+)
+from galene_stream.config import load_bridges
+from galene_stream.gateway import collect_metrics, run_bridges
+from galene_stream.ingest import INGEST_PROFILES
+from galene_stream.latency import LatencyTracer
+from galene_stream.metrics import MetricsExporter, Sample
+from galene_stream.profiler import Profiler
+from galene_stream.protocol import CODECS
+
+if TYPE_CHECKING:
+    from galene_stream.galene import GaleneClient
+
+log = logging.getLogger(__name__)
+
+
+def create_admission(opt: argparse.Namespace) -> Optional[AdmissionController]:
+    """Create admission controller from program options, if enabled.
+
+    :param opt: program options
+    :type opt: argparse.Namespace
+    :return: admission controller, or None if disabled
+    :rtype: AdmissionController, optional
+    """
+    if not opt.admission_policy:
+        return None
+    return AdmissionController(opt.admission_policy, opt.max_cpu / 100)
+
+
+def create_clients(
+    name: str,
+    opt: argparse.Namespace,
+    admission: Optional[AdmissionController] = None,
+) -> Dict[str, "GaleneClient"]:
+    """Create Galène clients of one bridge from program options.
+
+    When many outputs are given, input is decoded and encoded once and the
+    encoded streams are sent to each output. When many inputs are given, they
+    are all published over one connection to each output.
+
+    :param name: bridge name
+    :type name: str
+    :param opt: program options
+    :type opt: argparse.Namespace
+    :param admission: admission controller watching load of this bridge
+    :type admission: AdmissionController, optional
+    :return: Galène clients indexed by name
+    :rtype: dict
+    """
+    # GStreamer is only loaded once options are parsed, so that --help is fast
+    start = time.monotonic()
+    from galene_stream.galene import GaleneClient
+    from galene_stream.webrtc import MediaPipeline
+
+    kinds = ("video", "audio")
+    if opt.audio_only:
+        kinds = ("audio",)
+    elif opt.video_only:
+        kinds = ("video",)
+    audio_encoder = opus_desc(
+        opt.opus_bitrate,
+        opt.opus_frame_size,
+        opt.opus_complexity,
+        opt.opus_dtx,
+        opt.opus_fec,
+    )
+    medias = {}
+    for i, input_uri in enumerate(opt.input):
+        record = opt.record
+        if record and len(opt.input) > 1:
+            record = os.path.join(record, f"input{i}")
+        bitrate_controller = None
+        if opt.adaptive_bitrate:
+            bitrate_controller = BitrateController(
+                opt.bitrate, opt.min_bitrate, opt.max_bitrate or opt.bitrate
+            )
+        medias[input_uri] = MediaPipeline(
+            input_uri,
+            opt.bitrate,
+            opt.codec,
+            opt.encoder_preset,
+            opt.encoder_threads,
+            opt.keyframe_interval,
+            bitrate_controller,
+            opt.temporal_layers,
+            LatencyTracer() if opt.latency_probes or opt.profile else None,
+            opt.width,
+            opt.height,
+            opt.framerate,
+            opt.overload_policy,
+            record,
+            opt.record_segment,
+            opt.record_max_files,
+            kinds,
+            audio_encoder,
+            Profiler() if opt.profile else None,
+            opt.ingest_profile,
+        )
+        if admission is not None:
+            stream_name = name if len(opt.input) == 1 else f"{name} {input_uri}"
+            admission.add(stream_name, medias[input_uri], opt.priority)
+    clients = {}
+    for output in opt.output:
+        client_name = name if len(opt.output) == 1 else f"{name} to {output}"
+        first, *others = opt.input
+        client = GaleneClient(
+            first,
+            output,
+            opt.bitrate,
+            opt.username,
+            opt.password,
+            opt.insecure,
+            medias[first],
+            opt.reconnect,
+            opt.json_codec,
+            opt.preroll,
+            Profiler() if opt.profile else None,
+        )
+        for input_uri in others:
+            client.add_stream(input_uri, opt.bitrate, medias[input_uri])
+        clients[client_name] = client
+    elapsed = (time.monotonic() - start) * 1000
+    log.debug(f"Bridge {name} created in {elapsed:.0f}ms")
+    return clients
+
+
+def start_metrics(
+    opt: argparse.Namespace,
+    clients: Dict[str, "GaleneClient"],
+    event_loop: asyncio.AbstractEventLoop,
+    admission: Optional[AdmissionController] = None,
+) -> Optional[MetricsExporter]:
+    """Start metrics endpoint if enabled.
+
+    :param opt: program options
+    :type opt: argparse.Namespace
+    :param clients: Galène clients indexed by name
+    :type clients: dict
+    :param event_loop: asyncio event loop
+    :type event_loop: EventLoop
+    :param admission: admission controller, exporting host load
+    :type admission: AdmissionController, optional
+    :return: metrics exporter, or None if disabled
+    :rtype: MetricsExporter, optional
+    """
+    if not opt.metrics_port:
+        return None
+
+    def collect() -> List[Sample]:
+        """Collect metrics of all bridges and of admission control.
+
+        :return: metrics samples
+        :rtype: list
+        """
+        samples = collect_metrics(clients)
+        if admission is not None:
+            samples += admission.get_metrics()
+        return samples
+
+    exporter = MetricsExporter(collect)
+    event_loop.run_until_complete(exporter.start(opt.metrics_host, opt.metrics_port))
+    return exporter
 
 
 def start(opt: argparse.Namespace):
@@ -19,29 +191,133 @@ def start(opt: argparse.Namespace):
     :param opt: program options
     :type opt: argparse.Namespace
     """
-    client = GaleneClient(
-        opt.input,
-        opt.output,
-        opt.bitrate,
-        opt.username,
-        opt.password,
-        opt.insecure,
-    )
+    if len(opt.output) > 1:
+        start_gateway({"stream": opt}, opt)
+        return
+    admission = create_admission(opt)
+    clients = create_clients("stream", opt, admission)
+    client = clients["stream"]
 
     # Connect and run main even loop
     event_loop = asyncio.get_event_loop()
-    event_loop.run_until_complete(client.connect())
+    exporter = start_metrics(opt, clients, event_loop, admission)
+    watch = asyncio.ensure_future(admission.run()) if admission else None
     try:
-        event_loop.run_until_complete(client.loop(event_loop))
+        event_loop.run_until_complete(client.run(event_loop))
         event_loop.run_until_complete(client.close())
     except KeyboardInterrupt:
         event_loop.run_until_complete(client.close())
         sys.exit(1)
+    finally:
+        if watch is not None:
+            watch.cancel()
+        if exporter is not None:
+            event_loop.run_until_complete(exporter.close())
 
 
-def main():
-    """Entrypoint."""
-    # Arguments parser
+def available_cpus() -> int:
+    """Get number of CPU cores this process may run on.
+
+    :return: number of CPU cores, restricted by CPU affinity if supported
+    :rtype: int
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def create_gateway(
+    bridges: Dict[str, argparse.Namespace],
+    admission: Optional[AdmissionController] = None,
+) -> Dict[str, "GaleneClient"]:
+    """Init Galène clients of all bridges.
+
+    Bridges which fail to be created are logged and skipped.
+
+    :param bridges: options of each bridge, indexed by bridge name
+    :type bridges: dict
+    :param admission: admission controller watching load of bridges
+    :type admission: AdmissionController, optional
+    :return: Galène clients indexed by name
+    :rtype: dict
+    """
+    # Share CPU cores between encoders, so that they do not oversubscribe host
+    encoders = sum(len(opt.input) for opt in bridges.values())
+    threads = max(1, available_cpus() // encoders)
+    for opt in bridges.values():
+        if opt.encoder_threads is None:
+            opt.encoder_threads = threads
+
+    clients = {}
+    for name, opt in bridges.items():
+        try:
+            clients.update(create_clients(name, opt, admission))
+        except Exception:
+            log.exception(f"Failed to create bridge {name}")
+    return clients
+
+
+def start_gateway(bridges: Dict[str, argparse.Namespace], opt: argparse.Namespace):
+    """Init Galène clients of all bridges and run them in one event loop.
+
+    :param bridges: options of each bridge, indexed by bridge name
+    :type bridges: dict
+    :param opt: program options, for options shared by all bridges
+    :type opt: argparse.Namespace
+    """
+    admission = create_admission(opt)
+    clients = create_gateway(bridges, admission)
+    event_loop = asyncio.get_event_loop()
+    exporter = start_metrics(opt, clients, event_loop, admission)
+    try:
+        event_loop.run_until_complete(run_bridges(clients, admission))
+    except KeyboardInterrupt:
+        for client in clients.values():
+            event_loop.run_until_complete(client.close())
+        sys.exit(1)
+    finally:
+        if exporter is not None:
+            event_loop.run_until_complete(exporter.close())
+
+
+def set_record_dirs(bridges: Dict[str, argparse.Namespace]) -> None:
+    """Record each bridge in its own subdirectory, when there are many.
+
+    :param bridges: options of each bridge, indexed by bridge name
+    :type bridges: dict
+    """
+    if len(bridges) < 2:
+        return
+    for name, opt in bridges.items():
+        if opt.record:
+            opt.record = os.path.join(opt.record, name)
+
+
+def check_options(parser: argparse.ArgumentParser, opt: argparse.Namespace):
+    """Check options of one bridge.
+
+    :param parser: command-line parser, used to report errors
+    :type parser: argparse.ArgumentParser
+    :param opt: program options
+    :type opt: argparse.Namespace
+    """
+    missing = [o for o in ["input", "output", "username"] if not getattr(opt, o)]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+    # Breaking change in Galene-stream 0.1.7: output is no longer a WebSocket URI
+    if any(output.startswith("ws") for output in opt.output):
+        raise ValueError(
+            "Output must be a group URL of the form https://galene.example.org/group/public/"
+        )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Get command-line arguments parser.
+
+    :return: arguments parser
+    :rtype: argparse.ArgumentParser
+    """
     parser = argparse.ArgumentParser(
         prog="galene-stream",
         description="Galène stream gateway.",
@@ -52,31 +328,211 @@ def main():
         default=False,
         help="debug mode: show debug messages",
     )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help=(
+            "configuration file describing many bridges to run in one process, "
+            "other options are used as defaults for all bridges"
+        ),
+    )
     parser.add_argument(
         "-i",
         "--input",
-        required=True,
+        nargs="+",
         help=(
             'URI to use as GStreamer "uridecodebin" module input, '
-            'e.g. "rtmp://localhost:1935/live/test"'
+            'e.g. "rtmp://localhost:1935/live/test", or local source such as '
+            '"shm:///tmp/video", "unixfd:///tmp/video" or "fd://3", '
+            "many inputs can be given to publish them over one connection"
         ),
     )
     parser.add_argument(
         "-o",
         "--output",
-        required=True,
-        help="Group URL, of the form https://galene.example.org/group/public/",
+        nargs="+",
+        help=(
+            "Group URL, of the form https://galene.example.org/group/public/, "
+            "many groups can be given to encode input once for all of them"
+        ),
     )
     parser.add_argument(
         "-b",
         "--bitrate",
+        type=int,
         default=1048576,
-        help="VP8 encoder bitrate in bit/s, you should adapt this to your network, default to 1048576",
+        help="Video encoder bitrate in bit/s, you should adapt this to your network, default to 1048576",
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        help="Scale video to this width, keeping aspect ratio if height is unset",
+    )
+    parser.add_argument(
+        "--height",
+        type=int,
+        help="Scale video to this height, keeping aspect ratio if width is unset",
+    )
+    parser.add_argument(
+        "--framerate",
+        type=int,
+        help="Maximum video framerate, extra input frames are dropped",
+    )
+    parser.add_argument(
+        "--overload-policy",
+        choices=OVERLOAD_POLICIES,
+        default="drop",
+        help=(
+            "When encoders cannot keep up, drop oldest frames, block input, "
+            "or degrade framerate, default to drop"
+        ),
+    )
+    parser.add_argument(
+        "--ingest-profile",
+        choices=INGEST_PROFILES.keys(),
+        default="default",
+        help=(
+            "Buffering of network inputs, low-latency disables download "
+            "buffering, lowers SRT and RTSP latency and drops stale frames to "
+            "catch up, default to default"
+        ),
+    )
+    media = parser.add_mutually_exclusive_group()
+    media.add_argument(
+        "--audio-only",
+        action="store_true",
+        help="Only publish audio, video is neither decoded nor encoded",
+    )
+    media.add_argument(
+        "--video-only",
+        action="store_true",
+        help="Only publish video, audio is neither decoded nor encoded",
+    )
+    parser.add_argument(
+        "--opus-bitrate",
+        type=int,
+        help="Opus encoder bitrate in bit/s, default to encoder default",
+    )
+    parser.add_argument(
+        "--opus-frame-size",
+        choices=OPUS_FRAME_SIZES,
+        help=(
+            "Opus frame duration in milliseconds, shorter frames lower latency "
+            "but add packet overhead, default to 20"
+        ),
+    )
+    parser.add_argument(
+        "--opus-complexity",
+        type=int,
+        choices=range(11),
+        metavar="{0..10}",
+        help="Opus encoder complexity, lower values use less CPU, default to 10",
+    )
+    parser.add_argument(
+        "--opus-dtx",
+        action="store_true",
+        help="Stop sending audio packets during silence",
+    )
+    parser.add_argument(
+        "--opus-fec",
+        action="store_true",
+        help="Add Opus inband forward error correction, to recover from losses",
+    )
+    parser.add_argument(
+        "--admission-policy",
+        choices=ADMISSION_POLICIES,
+        help=(
+            "When host CPU or encoders are overloaded, refuse to start more "
+            "bridges, lower video bitrate or drop video of lowest priority "
+            "streams, disabled by default"
+        ),
+    )
+    parser.add_argument(
+        "--max-cpu",
+        type=float,
+        default=90,
+        help="Host CPU usage in percent above which host is overloaded, default to 90",
+    )
+    parser.add_argument(
+        "--priority",
+        type=int,
+        default=0,
+        help="Bridge priority, lower priority streams are degraded first, default to 0",
+    )
+    parser.add_argument(
+        "--adaptive-bitrate",
+        action="store_true",
+        help="Adapt video bitrate to losses and round-trip time reported by Galène",
+    )
+    parser.add_argument(
+        "--min-bitrate",
+        type=int,
+        default=131072,
+        help="Minimum adaptive video bitrate in bit/s, default to 131072",
+    )
+    parser.add_argument(
+        "--max-bitrate",
+        type=int,
+        help="Maximum adaptive video bitrate in bit/s, default to bitrate",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=VIDEO_CODECS.keys(),
+        default="vp8",
+        help=(
+            "Video codec, default to vp8, "
+            "h264-passthrough sends H.264 input without decoding it, "
+            "it must use a profile supported by WebRTC clients"
+        ),
+    )
+    parser.add_argument(
+        "--temporal-layers",
+        type=int,
+        choices=[1] + list(TEMPORAL_LAYERS),
+        default=1,
+        help=(
+            "Number of VP8 temporal layers, so that Galène can forward a lower "
+            "framerate to constrained receivers, default to 1"
+        ),
+    )
+    parser.add_argument(
+        "--encoder-preset",
+        choices=ENCODER_PRESETS,
+        help="Video encoder preset, default to encoder defaults",
+    )
+    parser.add_argument(
+        "--encoder-threads",
+        type=int,
+        help=(
+            "Number of video encoder threads, default to encoder defaults, "
+            "or to a share of CPU cores when running many bridges"
+        ),
+    )
+    parser.add_argument(
+        "--keyframe-interval",
+        type=int,
+        help="Maximum distance between video keyframes in frames",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="Also record encoded streams in this directory, without re-encoding",
+    )
+    parser.add_argument(
+        "--record-segment",
+        type=int,
+        default=600,
+        help="Duration of recorded segments in seconds, default to 600",
+    )
+    parser.add_argument(
+        "--record-max-files",
+        type=int,
+        default=0,
+        help="Number of recorded segments to keep, default to keep all",
     )
     parser.add_argument(
         "-u",
         "--username",
-        required=True,
         help="Group username",
     )
     parser.add_argument(
@@ -84,28 +540,98 @@ def main():
         "--password",
         help="Group password",
     )
+    parser.add_argument(
+        "--reconnect",
+        action="store_true",
+        help=(
+            "Reconnect with exponential backoff when connection is lost, "
+            "keeping input decoding and encoding running"
+        ),
+    )
+    parser.add_argument(
+        "--preroll",
+        action="store_true",
+        help=(
+            "Start decoding and encoding input while joining the group, "
+            "to reduce time to first frame"
+        ),
+    )
     parser.add_argument(
         "--insecure",
         action="store_true",
         help="Don't check server certificate",
     )
-    options = parser.parse_args()
+    parser.add_argument(
+        "--json-codec",
+        choices=list(CODECS),
+        help="JSON library for signaling messages, default to the fastest",
+    )
+    parser.add_argument(
+        "--latency-probes",
+        action="store_true",
+        help=(
+            "Measure latency added by each pipeline stage, "
+            "reported in metrics, chat statistics and logs"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Measure processing time of each pipeline element and signaling "
+            "handler, implies --latency-probes, reported at shutdown, in "
+            "metrics and using !profile chat command"
+        ),
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics on this port, disabled by default",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default="127.0.0.1",
+        help="Address to serve Prometheus metrics on, default to 127.0.0.1",
+    )
+    return parser
+
 
-    # Configure logging
-    level = logging.DEBUG if options.debug else logging.INFO
+def setup_logging(debug: bool = False, prefix: str = "") -> None:
+    """Configure colored logging.
+
+    :param debug: show debug messages
+    :type debug: bool, optional
+    :param prefix: text added before each message, e.g. worker name
+    :type prefix: str, optional
+    """
+    level = logging.DEBUG if debug else logging.INFO
     logging.addLevelName(logging.INFO, "\033[1;36mINFO\033[1;0m")
     logging.addLevelName(logging.WARNING, "\033[1;33mWARNING\033[1;0m")
     logging.addLevelName(logging.ERROR, "\033[1;91mERROR\033[1;0m")
     logging.addLevelName(logging.DEBUG, "\033[1;30mDEBUG")
     logging.basicConfig(
         level=level,
-        format="\033[90m%(asctime)s\033[1;0m [%(name)s] %(levelname)s %(message)s\033[1;0m",
+        format=(
+            f"\033[90m%(asctime)s\033[1;0m {prefix}[%(name)s] %(levelname)s "
+            "%(message)s\033[1;0m"
+        ),
     )
 
-    # Breaking change in Galene-stream 0.1.7: output is no longer a WebSocket URI
-    if options.output.startswith("ws"):
-        raise ValueError(
-            "Output must be a group URL of the form https://galene.example.org/group/public/"
-        )
 
-    start(options)
+def main():
+    """Entrypoint."""
+    parser = get_parser()
+    options = parser.parse_args()
+    setup_logging(options.debug)
+
+    if options.config:
+        # Command-line options are defaults for bridges in configuration file
+        parser.set_defaults(**{k: v for k, v in vars(options).items() if v})
+        bridges = load_bridges(options.config, parser)
+        for bridge_options in bridges.values():
+            check_options(parser, bridge_options)
+        set_record_dirs(bridges)
+        start_gateway(bridges, options)
+    else:
+        check_options(parser, options)
+        start(options)
@@ -0,0 +1,321 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Video codecs supported by the gateway.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class VideoCodec(NamedTuple):
+    """Description of a video codec path in the GStreamer pipeline."""
+
+    #: Encoding name in SDP
+    name: str
+    #: Description of the encoder element, or parser when input is not decoded
+    encoder: str
+    #: Description of the RTP payloader elements
+    payloader: str
+    #: GStreamer plugins needed by this codec
+    plugins: List[str]
+    #: Whether input video is decoded, else it must already use this codec
+    decode: bool = True
+    #: Caps forced at encoder output
+    caps: str = ""
+    #: Encoder properties of each preset
+    presets: Dict[str, str] = {}
+    #: Encoder properties setting the number of threads
+    threads: str = ""
+    #: Encoder properties setting the maximum distance between keyframes
+    keyframe: str = ""
+    #: Encoder property setting bitrate while playing, and its unit in bit/s
+    bitrate_property: Tuple[str, int] = ("", 1)
+    #: Whether encoder and payloader support temporal scalability
+    temporal_layers: bool = False
+    #: Muxer element and file extension used to record encoded video
+    container: Tuple[str, str] = ("webmmux", "webm")
+
+
+VIDEO_CODECS: Dict[str, VideoCodec] = {
+    "vp8": VideoCodec(
+        name="VP8",
+        encoder="vp8enc name=venc deadline=1 target-bitrate={bitrate}",
+        payloader="rtpvp8pay pt=97",
+        plugins=["vpx"],
+        presets={
+            "low-latency": "cpu-used=4 lag-in-frames=0 keyframe-max-dist=60",
+            "low-cpu": "cpu-used=16 lag-in-frames=0 keyframe-max-dist=120",
+            "quality": "deadline=33000 cpu-used=2 lag-in-frames=0",
+        },
+        threads="threads={threads} token-partitions={partitions}",
+        keyframe="keyframe-max-dist={interval}",
+        bitrate_property=("target-bitrate", 1),
+        temporal_layers=True,
+    ),
+    "vp9": VideoCodec(
+        name="VP9",
+        encoder="vp9enc name=venc deadline=1 cpu-used=8 target-bitrate={bitrate}",
+        payloader="rtpvp9pay pt=98",
+        plugins=["vpx"],
+        presets={
+            "low-latency": "cpu-used=7 lag-in-frames=0 keyframe-max-dist=60",
+            "low-cpu": "cpu-used=8 lag-in-frames=0 keyframe-max-dist=120",
+            "quality": "deadline=33000 cpu-used=5 lag-in-frames=0",
+        },
+        threads="threads={threads}",
+        keyframe="keyframe-max-dist={interval}",
+        bitrate_property=("target-bitrate", 1),
+    ),
+    "h264": VideoCodec(
+        name="H264",
+        encoder=(
+            "x264enc name=venc tune=zerolatency speed-preset=ultrafast "
+            "bitrate={kbitrate}"
+        ),
+        payloader="rtph264pay pt=102 config-interval=-1 aggregate-mode=zero-latency",
+        plugins=["x264"],
+        caps="video/x-h264,profile=constrained-baseline",
+        presets={
+            "low-latency": "speed-preset=superfast key-int-max=60",
+            "low-cpu": "speed-preset=ultrafast key-int-max=120",
+            "quality": "speed-preset=faster key-int-max=120",
+        },
+        threads="threads={threads}",
+        keyframe="key-int-max={interval}",
+        bitrate_property=("bitrate", 1000),
+        container=("matroskamux", "mkv"),
+    ),
+    "h264-passthrough": VideoCodec(
+        name="H264",
+        encoder="h264parse config-interval=-1",
+        payloader="rtph264pay pt=102 config-interval=-1 aggregate-mode=zero-latency",
+        plugins=["videoparsersbad"],
+        decode=False,
+        container=("matroskamux", "mkv"),
+    ),
+}
+
+#: Encoder presets, available for all codecs that encode video
+ENCODER_PRESETS = ["low-latency", "low-cpu", "quality"]
+
+# Temporal layers of each frame in a period, share of bitrate up to each
+# layer, and reference flags of each frame.
+# The base layer only references and updates last frame buffer, the middle
+# layer updates golden frame buffer, and the top layer is never referenced,
+# so that the SFU can drop upper layers and keep a decodable stream.
+_BASE_LAYER_FLAGS = "no-ref-golden+no-ref-alt+no-upd-golden+no-upd-alt"
+_DROPPABLE_FLAGS = "no-ref-alt+no-upd-last+no-upd-golden+no-upd-alt+no-upd-entropy"
+TEMPORAL_LAYERS = {
+    2: ([0, 1], [0.6, 1.0], [_BASE_LAYER_FLAGS, _DROPPABLE_FLAGS]),
+    3: (
+        [0, 2, 1, 2],
+        [0.4, 0.6, 1.0],
+        [
+            _BASE_LAYER_FLAGS,
+            _DROPPABLE_FLAGS,
+            "no-ref-golden+no-ref-alt+no-upd-last+no-upd-alt",
+            _DROPPABLE_FLAGS,
+        ],
+    ),
+}
+
+
+def temporal_layers_desc(layers: int, bitrate: int) -> str:
+    """Get VPX encoder properties enabling temporal scalability.
+
+    :param layers: number of temporal layers, one of :data:`TEMPORAL_LAYERS`
+        keys
+    :type layers: int
+    :param bitrate: total bitrate in bit/s
+    :type bitrate: int
+    :return: encoder properties
+    :rtype: str
+    """
+    layer_ids, shares, flags = TEMPORAL_LAYERS[layers]
+    decimators = [2 ** (layers - 1 - i) for i in range(layers)]
+    bitrates = [int(bitrate * share) for share in shares]
+    return (
+        f"error-resilient=default temporal-scalability-number-layers={layers} "
+        f"temporal-scalability-periodicity={len(layer_ids)} "
+        f'temporal-scalability-layer-id="<{",".join(map(str, layer_ids))}>" '
+        f'temporal-scalability-rate-decimator="<{",".join(map(str, decimators))}>" '
+        f'temporal-scalability-target-bitrate="<{",".join(map(str, bitrates))}>" '
+        f'temporal-scalability-layer-flags="<{",".join(flags)}>"'
+    )
+
+
+def encoder_desc(
+    codec: VideoCodec,
+    bitrate: int,
+    preset: Optional[str] = None,
+    threads: Optional[int] = None,
+    keyframe_interval: Optional[int] = None,
+    layers: int = 1,
+) -> str:
+    """Get description of the video encoder elements.
+
+    Later properties override earlier ones, so explicit threads and keyframe
+    interval override the preset.
+
+    :param codec: video codec
+    :type codec: VideoCodec
+    :param bitrate: encoder bitrate in bit/s
+    :type bitrate: int
+    :param preset: encoder preset, one of :data:`ENCODER_PRESETS`
+    :type preset: str, optional
+    :param threads: number of encoder threads
+    :type threads: int, optional
+    :param keyframe_interval: maximum distance between keyframes in frames
+    :type keyframe_interval: int, optional
+    :param layers: number of temporal layers, if supported by codec
+    :type layers: int, optional
+    :return: GStreamer pipeline description
+    :rtype: str
+    """
+    desc = codec.encoder.format(bitrate=bitrate, kbitrate=bitrate // 1000)
+    if preset and preset in codec.presets:
+        desc += " " + codec.presets[preset]
+    if threads and codec.threads:
+        # VP8 can encode up to 8 token partitions in parallel
+        partitions = min(3, threads.bit_length() - 1)
+        desc += " " + codec.threads.format(threads=threads, partitions=partitions)
+    if keyframe_interval and codec.keyframe:
+        desc += " " + codec.keyframe.format(interval=keyframe_interval)
+    if layers > 1 and codec.temporal_layers:
+        desc += " " + temporal_layers_desc(layers, bitrate)
+    if codec.caps:
+        desc += f" ! {codec.caps}"
+    return desc
+
+
+def preprocess_desc(
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    framerate: Optional[int] = None,
+) -> str:
+    """Get description of the elements scaling and rate limiting raw video.
+
+    Frames are dropped first and scaled next, so that later color conversion
+    and encoding only process frames at the output size and rate.
+
+    :param width: output width in pixels, if None it follows aspect ratio
+    :type width: int, optional
+    :param height: output height in pixels, if None it follows aspect ratio
+    :type height: int, optional
+    :param framerate: maximum output framerate
+    :type framerate: int, optional
+    :return: GStreamer pipeline description, empty or ending with a link
+    :rtype: str
+    """
+    desc = ""
+    if framerate:
+        desc += f"videorate name=vrate drop-only=true max-rate={framerate} ! "
+    if width or height:
+        caps = "video/x-raw"
+        if width:
+            caps += f",width={width}"
+        if height:
+            caps += f",height={height}"
+        desc += f"videoscale name=vscale ! {caps} ! "
+    return desc
+
+
+#: Opus frame sizes in milliseconds
+OPUS_FRAME_SIZES = ["2.5", "5", "10", "20", "40", "60"]
+
+
+def opus_desc(
+    bitrate: Optional[int] = None,
+    frame_size: Optional[str] = None,
+    complexity: Optional[int] = None,
+    dtx: bool = False,
+    fec: bool = False,
+) -> Tuple[str, str]:
+    """Get description of the Opus encoder and payloader elements.
+
+    :param bitrate: encoder bitrate in bit/s, if None encoder default is used
+    :type bitrate: int, optional
+    :param frame_size: frame duration in milliseconds, one of
+        :data:`OPUS_FRAME_SIZES`
+    :type frame_size: str, optional
+    :param complexity: encoder complexity, from 0 to 10
+    :type complexity: int, optional
+    :param dtx: stop sending packets during silence
+    :type dtx: bool, optional
+    :param fec: add inband forward error correction
+    :type fec: bool, optional
+    :return: GStreamer description of encoder and payloader
+    :rtype: tuple
+    """
+    encoder = "opusenc name=aenc"
+    payloader = "rtpopuspay pt=96"
+    if bitrate:
+        encoder += f" bitrate={bitrate}"
+    if frame_size:
+        encoder += f" frame-size={frame_size}"
+    if complexity is not None:
+        encoder += f" complexity={complexity}"
+    if dtx:
+        encoder += " dtx=true"
+        payloader += " dtx=true"
+    if fec:
+        # FEC is only added when the encoder expects losses
+        encoder += " inband-fec=true packet-loss-percentage=10"
+    return encoder, payloader
+
+
+#: Policies of bounded queues between pipeline stages when host is overloaded
+OVERLOAD_POLICIES = ["drop", "block", "degrade"]
+
+
+def queue_desc(name: str, size: int, policy: str = "drop") -> str:
+    """Get description of a bounded queue between two pipeline stages.
+
+    Each queue runs next stage in its own streaming thread. When full, oldest
+    buffer is dropped, unless policy is block where previous stage waits.
+
+    :param name: queue name
+    :type name: str
+    :param size: maximum number of buffers
+    :type size: int
+    :param policy: overload policy, one of :data:`OVERLOAD_POLICIES`
+    :type policy: str, optional
+    :return: GStreamer pipeline description
+    :rtype: str
+    """
+    leaky = "no" if policy == "block" else "downstream"
+    return (
+        f"queue name={name} max-size-buffers={size} max-size-bytes=0 "
+        f"max-size-time=0 leaky={leaky}"
+    )
+
+
+#: Caps where uridecodebin stops decoding when video is not decoded
+PASSTHROUGH_CAPS = "video/x-h264;audio/x-raw"
+
+
+def sdp_accepts(sdp: str, media: str, name: str) -> bool:
+    """Check if a SDP answer accepts a codec for a media.
+
+    :param sdp: session description
+    :type sdp: str
+    :param media: media kind, e.g. "video"
+    :type media: str
+    :param name: encoding name, e.g. "VP8"
+    :type name: str
+    :return: True if media section is not rejected and uses this encoding
+    :rtype: bool
+    """
+    in_media = False
+    for line in sdp.splitlines():
+        if line.startswith("m="):
+            if in_media:
+                break
+            fields = line[2:].split()
+            in_media = fields[0] == media and fields[1] != "0"
+        elif in_media and line.startswith("a=rtpmap:"):
+            encoding = line.split(maxsplit=1)[1]
+            if encoding.split("/")[0].upper() == name.upper():
+                return True
+    return False
@@ -0,0 +1,82 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Configuration file support for multi-stream gateway mode.
+
+A configuration file uses the INI format. Each section describes one bridge
+from an input to a Galène group, and keys are the long command-line option
+names. The ``DEFAULT`` section holds options shared by all bridges, e.g.::
+
+    [DEFAULT]
+    output = https://galene.example.org/group/public/
+    username = bot
+
+    [camera1]
+    input = rtmp://127.0.0.1:1935/live/camera1
+
+    [camera2]
+    input = rtmp://127.0.0.1:1935/live/camera2
+    output =
+        https://galene.example.org/group/public/
+        https://galene.example.org/group/other/
+"""
+
+import argparse
+import configparser
+from typing import Dict, List
+
+
+def section_to_argv(
+    section: configparser.SectionProxy, parser: argparse.ArgumentParser
+) -> List[str]:
+    """Convert a configuration section to command-line arguments.
+
+    :param section: configuration section describing one bridge
+    :type section: configparser.SectionProxy
+    :param parser: command-line parser that will parse the arguments
+    :type parser: argparse.ArgumentParser
+    :return: command-line arguments
+    :rtype: list of str
+    """
+    flags = {o for a in parser._actions if a.nargs == 0 for o in a.option_strings}
+    lists = {o for a in parser._actions if a.nargs == "+" for o in a.option_strings}
+    argv = []
+    for key in section:
+        option = "--" + key.replace("_", "-")
+        if option in flags:
+            # Boolean flags are only given when enabled
+            if section.getboolean(key):
+                argv.append(option)
+        elif option in lists:
+            # Values are separated by spaces or new lines
+            argv += [option] + section[key].split()
+        else:
+            argv += [option, section[key]]
+    return argv
+
+
+def load_bridges(
+    path: str, parser: argparse.ArgumentParser
+) -> Dict[str, argparse.Namespace]:
+    """Load bridges options from configuration file.
+
+    :param path: path to the configuration file
+    :type path: str
+    :param parser: command-line parser used to parse each bridge options
+    :type parser: argparse.ArgumentParser
+    :raises ValueError: if the configuration file does not define any bridge
+    :return: options of each bridge, indexed by section name
+    :rtype: dict
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    with open(path) as f:
+        config.read_file(f)
+    if not config.sections():
+        raise ValueError(f"No bridge defined in {path}")
+
+    bridges = {}
+    for name in config.sections():
+        argv = section_to_argv(config[name], parser)
+        bridges[name] = parser.parse_args(argv)
+    return bridges
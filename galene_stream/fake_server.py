@@ -0,0 +1,274 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Fake Galène server, to test and load test gateways offline.
+
+It serves the group status and speaks the signaling protocol used by
+:class:`galene_stream.galene.GaleneClient`. When media answering is enabled,
+offers are answered by a loopback GStreamer WebRTC peer discarding media.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import websockets
+
+from galene_stream.httpserver import HTTPServer
+
+log = logging.getLogger(__name__)
+
+
+class FakeSession:
+    """Signaling session of one client connected to the fake server."""
+
+    def __init__(self, server: "FakeGalene", conn) -> None:
+        """Init FakeSession.
+
+        :param server: fake server, counting messages
+        :type server: FakeGalene
+        :param conn: WebSocket connection
+        :type conn: websockets connection
+        """
+        self.server = server
+        self.conn = conn
+        self.peers: Dict[str, Any] = {}
+        self.pending: Dict[str, Optional[List[dict]]] = {}
+
+    async def send(self, message: dict) -> None:
+        """Send message to client.
+
+        :param message: message to send
+        :type message: dict
+        """
+        await self.conn.send(json.dumps(message))
+        self.server.messages_sent += 1
+
+    async def ping(self, interval: float) -> None:
+        """Ping client periodically, as Galène does.
+
+        :param interval: time between two pings in seconds
+        :type interval: float
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self.send({"type": "ping"})
+
+    async def run(self) -> None:
+        """Answer client messages until it disconnects."""
+        async for raw in self.conn:
+            self.server.messages_received += 1
+            message = json.loads(raw)
+            handler = getattr(self, f"on_{message['type']}", None)
+            if handler is not None:
+                await handler(message)
+
+    async def on_handshake(self, message: dict) -> None:
+        """Answer handshake.
+
+        :param message: received message
+        :type message: dict
+        """
+        await self.send({"type": "handshake", "version": ["2"], "id": "server"})
+
+    async def on_join(self, message: dict) -> None:
+        """Join client to the group.
+
+        :param message: received message
+        :type message: dict
+        """
+        username = message.get("username")
+        if message.get("group") != self.server.group:
+            await self.send({"type": "joined", "kind": "fail", "value": "no group"})
+            return
+        await self.send(
+            {"type": "user", "kind": "add", "id": "server", "username": username}
+        )
+        await self.send(
+            {
+                "type": "joined",
+                "kind": "join",
+                "group": self.server.group,
+                "username": username,
+                "permissions": ["present"],
+                "rtcConfiguration": {"iceServers": []},
+            }
+        )
+
+    async def on_offer(self, message: dict) -> None:
+        """Answer offer using a loopback peer, if enabled.
+
+        :param message: received message
+        :type message: dict
+        """
+        self.server.offers += 1
+        if not self.server.answer_media:
+            return
+        from galene_stream.webrtc import LoopbackPeer
+
+        stream_id = message["id"]
+        self.close_peer(stream_id)
+        self.pending[stream_id] = []
+        peer = LoopbackPeer(lambda c: self.on_local_candidate(stream_id, c))
+        self.peers[stream_id] = peer
+        sdp = await peer.answer(message["sdp"])
+        await self.send({"type": "answer", "id": stream_id, "sdp": sdp})
+
+        # Candidates are sent after answer
+        candidates = self.pending.get(stream_id) or []
+        self.pending[stream_id] = None
+        for candidate in candidates:
+            await self.send({"type": "ice", "id": stream_id, "candidate": candidate})
+
+    def on_local_candidate(self, stream_id: str, candidate: dict) -> None:
+        """Send ICE candidate of a loopback peer, once answer is sent.
+
+        :param stream_id: stream id
+        :type stream_id: str
+        :param candidate: ICE candidate
+        :type candidate: dict
+        """
+        pending = self.pending.get(stream_id)
+        if pending is not None:
+            pending.append(candidate)
+            return
+        message = {"type": "ice", "id": stream_id, "candidate": candidate}
+        asyncio.ensure_future(self.send(message))
+
+    async def on_ice(self, message: dict) -> None:
+        """Add client ICE candidate to its loopback peer.
+
+        :param message: received message
+        :type message: dict
+        """
+        peer = self.peers.get(message.get("id"))
+        if peer is not None:
+            candidate = message["candidate"]
+            peer.add_ice_candidate(candidate["sdpMLineIndex"], candidate["candidate"])
+
+    async def on_close(self, message: dict) -> None:
+        """Close stream.
+
+        :param message: received message
+        :type message: dict
+        """
+        self.close_peer(message.get("id"))
+
+    def close_peer(self, stream_id: str) -> None:
+        """Close loopback peer of a stream, if any.
+
+        :param stream_id: stream id
+        :type stream_id: str
+        """
+        peer = self.peers.pop(stream_id, None)
+        self.pending.pop(stream_id, None)
+        if peer is not None:
+            peer.close()
+
+    def close(self) -> None:
+        """Close all loopback peers."""
+        for stream_id in list(self.peers):
+            self.close_peer(stream_id)
+
+
+class FakeGalene:
+    """Fake Galène server serving one group."""
+
+    def __init__(
+        self,
+        group: str = "test",
+        answer_media: bool = True,
+        ping_interval: Optional[float] = None,
+    ) -> None:
+        """Init FakeGalene.
+
+        :param group: group name
+        :type group: str, optional
+        :param answer_media: answer offers with a loopback WebRTC peer,
+            needs GStreamer
+        :type answer_media: bool, optional
+        :param ping_interval: time between two pings in seconds, if None
+            clients are not pinged
+        :type ping_interval: float, optional
+        """
+        self.group = group
+        self.answer_media = answer_media
+        self.ping_interval = ping_interval
+        self.http = HTTPServer({f"/group/{group}/.status.json": self.get_status})
+        self.ws_server = None
+        self.sessions: List[FakeSession] = []
+        self.url = ""
+        self.endpoint = ""
+
+        # Statistics
+        self.connections = 0
+        self.messages_received = 0
+        self.messages_sent = 0
+        self.offers = 0
+
+    def get_status(self) -> Tuple[str, bytes]:
+        """Get group status.
+
+        :return: content type and body
+        :rtype: tuple
+        """
+        status = {"name": self.group, "endpoint": self.endpoint}
+        return "application/json", json.dumps(status).encode()
+
+    async def handler(self, conn, path=None) -> None:
+        """Handle a WebSocket connection.
+
+        :param conn: WebSocket connection
+        :type conn: websockets connection
+        :param path: request path, with older websockets versions
+        :type path: str, optional
+        """
+        self.connections += 1
+        session = FakeSession(self, conn)
+        self.sessions.append(session)
+        ping_task = None
+        if self.ping_interval:
+            ping_task = asyncio.ensure_future(session.ping(self.ping_interval))
+        try:
+            await session.run()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if ping_task is not None:
+                ping_task.cancel()
+            session.close()
+            self.sessions.remove(session)
+
+    async def broadcast(self, message: dict) -> None:
+        """Send a message to all connected clients, such as an abort.
+
+        :param message: message to send
+        :type message: dict
+        """
+        for session in list(self.sessions):
+            await session.send(message)
+
+    async def start(self, host: str = "127.0.0.1") -> None:
+        """Listen on free ports.
+
+        :param host: address to listen on
+        :type host: str, optional
+        """
+        self.ws_server = await websockets.serve(self.handler, host, 0)
+        ws_port = self.ws_server.sockets[0].getsockname()[1]
+        self.endpoint = f"ws://{host}:{ws_port}/ws"
+        await self.http.start(host, 0)
+        assert self.http.server is not None
+        http_port = self.http.server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{http_port}/group/{self.group}/"
+        log.info(f"Fake Galène serving {self.url}")
+
+    async def close(self) -> None:
+        """Stop listening."""
+        await self.http.close()
+        if self.ws_server is not None:
+            self.ws_server.close()
+            await self.ws_server.wait_closed()
+            self.ws_server = None
@@ -5,23 +5,39 @@
 Galène protocol support.
 """
 
+import asyncio
+import functools
 import json
 import logging
 import secrets
 import ssl
+import time
 import urllib.parse
 import urllib.request
-from typing import List
+from typing import Dict, List, Optional, Set
 
 import websockets
 
-from galene_stream.webrtc import WebRTCClient
+from galene_stream.metrics import Sample
+from galene_stream.profiler import Profiler
+from galene_stream.protocol import Dispatcher, get_codec
+from galene_stream.webrtc import MediaPipeline, WebRTCClient
 
 log = logging.getLogger(__name__)
 
 
 class GaleneClient:
-    """Galène protocol implementation."""
+    """Galène protocol implementation.
+
+    One client joins the group once and may publish many streams over the
+    same connection, each with its own WebRTC session. Signaling messages are
+    routed to streams by their id.
+    """
+
+    #: First delay before reconnecting, in seconds
+    min_backoff = 0.1
+    #: Maximum delay before reconnecting, in seconds
+    max_backoff = 30.0
 
     def __init__(
         self,
@@ -31,6 +47,11 @@ class GaleneClient:
         username: str,
         password: str = "",
         insecure: bool = False,
+        media: Optional[MediaPipeline] = None,
+        reconnect: bool = False,
+        json_codec: Optional[str] = None,
+        preroll: bool = False,
+        profiler: Optional[Profiler] = None,
     ) -> None:
         """Create GaleneClient
 
@@ -45,18 +66,83 @@ class GaleneClient:
         :param password: group user password if required
         :type password: str, optional
         :type insecure: bool, optional
+        :param media: media pipeline shared with other clients, to encode
+            input once for many groups
+        :type media: MediaPipeline, optional
+        :param reconnect: reconnect when connection is lost, keeping input
+            decoding and encoding running
+        :type reconnect: bool, optional
+        :param json_codec: JSON library name, if None the fastest available
+        :type json_codec: str, optional
+        :param preroll: start decoding and encoding input while joining the
+            group, so that first frames are ready once joined
+        :type preroll: bool, optional
+        :param profiler: profiler timing signaling handlers, if None handlers
+            are not timed
+        :type profiler: Profiler, optional
         """
         self.output = output
         self.username = username
         self.password = password
         self.insecure = insecure
+        self.reconnect = reconnect
+        self.preroll = preroll
+        self.profiler = profiler
 
         self.conn = None
+        self.status: Optional[dict] = None
         self.ice_servers: List[str] = []
+
+        # Signaling statistics
+        self.connects = 0
+        self.reconnects = 0
+        self.messages_received = 0
+        self.messages_sent = 0
+        self.join_time: Optional[float] = None
+        self.offer_sent_at: Dict[str, float] = {}
+        self.answer_time: Optional[float] = None
+
+        # Handlers of received messages
+        self.dispatcher = Dispatcher(get_codec(json_codec), profiler)
+        self.dispatcher.register("ping", self.on_ping)
+        self.dispatcher.register("abort", self.on_abort)
+        self.dispatcher.register("answer", self.on_answer)
+        self.dispatcher.register("ice", self.on_ice)
+        self.dispatcher.register("renegotiate", self.on_renegotiate)
+        self.dispatcher.register("usermessage", self.on_usermessage)
+        self.dispatcher.register("chat", self.on_chat)
+        self.dispatcher.ignore("user", "close", "chathistory")
+
         self.client_id = secrets.token_bytes(16).hex()
-        self.webrtc = WebRTCClient(
-            input_uri, bitrate, self.send_sdp_offer, self.send_ice_candidate
+        self.streams: Dict[str, WebRTCClient] = {}
+        self.aborted: Set[str] = set()
+        self.webrtc = self.streams[self.add_stream(input_uri, bitrate, media)]
+
+    def add_stream(
+        self, input_uri: str, bitrate: int, media: Optional[MediaPipeline] = None
+    ) -> str:
+        """Add a stream published over the same connection.
+
+        Streams added while connected are offered on next connection.
+
+        :param input_uri: URI for GStreamer uridecodebin
+        :type input_uri: str
+        :param bitrate: video encoder bitrate in bit/s
+        :type bitrate: int
+        :param media: media pipeline, possibly shared with other clients
+        :type media: MediaPipeline, optional
+        :return: stream id
+        :rtype: str
+        """
+        stream_id = secrets.token_bytes(16).hex()
+        self.streams[stream_id] = WebRTCClient(
+            input_uri,
+            bitrate,
+            functools.partial(self.send_sdp_offer, stream_id),
+            functools.partial(self.send_ice_candidate, stream_id),
+            media,
         )
+        return stream_id
 
     async def send(self, message: dict) -> None:
         """Send message to remote.
@@ -64,38 +150,43 @@ class GaleneClient:
         :param message: message to send
         :type message: dict
         """
-        msg = json.dumps(message)
+        msg = self.dispatcher.codec.dumps(message)
         if self.conn is None:
             log.error("Connection is closed, cannot send message")
             return
         await self.conn.send(msg)
+        self.messages_sent += 1
 
-    async def send_sdp_offer(self, sdp: str) -> None:
+    async def send_sdp_offer(self, stream_id: str, sdp: str) -> None:
         """Send SDP offer to remote.
 
+        :param stream_id: stream id
+        :type stream_id: str
         :param sdp: session description
         :type sdp: str
         """
         log.debug(f"Sending local SDP offer to remote: {sdp}")
-        # We use client_id as stream id, but it can differ
         msg = {
             "type": "offer",
-            "id": self.client_id,  # stream id
+            "id": stream_id,
             "source": self.client_id,
             "username": self.username,
             "sdp": sdp,
             "label": "video",
         }
+        self.offer_sent_at[stream_id] = time.monotonic()
         await self.send(msg)
 
-    async def send_ice_candidate(self, candidate: dict) -> None:
+    async def send_ice_candidate(self, stream_id: str, candidate: dict) -> None:
         """Send ICE candidate to remote.
 
+        :param stream_id: stream id
+        :type stream_id: str
         :param canditate: ICE candidate
         :type canditate: dict
         """
         log.debug("Sending new ICE candidate to remote")
-        msg = {"type": "ice", "id": self.client_id, "candidate": candidate}
+        msg = {"type": "ice", "id": stream_id, "candidate": candidate}
         await self.send(msg)
 
     async def send_chat(self, message: str) -> None:
@@ -114,8 +205,76 @@ class GaleneClient:
             }
         )
 
+    def get_metrics(self) -> List[Sample]:
+        """Get signaling and WebRTC metrics.
+
+        When many streams are published, WebRTC metrics are labelled by input.
+
+        :return: metrics samples
+        :rtype: list
+        """
+        samples: List[Sample] = [
+            ("galene_stream_signaling_connects_total", {}, self.connects),
+            ("galene_stream_signaling_reconnects_total", {}, self.reconnects),
+            (
+                "galene_stream_signaling_messages_received_total",
+                {},
+                self.messages_received,
+            ),
+            ("galene_stream_signaling_messages_sent_total", {}, self.messages_sent),
+        ]
+        if self.join_time is not None:
+            samples.append(("galene_stream_signaling_join_seconds", {}, self.join_time))
+        if self.answer_time is not None:
+            samples.append(
+                ("galene_stream_signaling_answer_seconds", {}, self.answer_time)
+            )
+        for webrtc in self.streams.values():
+            if len(self.streams) == 1:
+                samples += webrtc.get_metrics()
+                continue
+            labels = {"input": webrtc.media.input_uri}
+            samples += [(m, {**labels, **l}, v) for m, l, v in webrtc.get_metrics()]
+        return samples
+
+    def fetch_status(self, ssl_context: ssl.SSLContext) -> dict:
+        """Fetch group status, this call is blocking.
+
+        :param ssl_context: SSL context used for HTTPS
+        :type ssl_context: ssl.SSLContext
+        :return: group status
+        :rtype: dict
+        """
+        status_url = urllib.parse.urljoin(self.output, ".status.json")
+        with urllib.request.urlopen(
+            status_url, context=ssl_context, timeout=10
+        ) as resp:
+            return json.load(resp)
+
+    @staticmethod
+    def elapsed(start: float) -> str:
+        """Format time elapsed since start, for startup timing logs.
+
+        :param start: start time
+        :type start: float
+        :return: elapsed time in milliseconds
+        :rtype: str
+        """
+        return f"{(time.monotonic() - start) * 1000:.0f}ms"
+
+    def prepare_output(self, start: float) -> None:
+        """Build WebRTC outputs, this call is blocking.
+
+        :param start: connection start time, for startup timing logs
+        :type start: float
+        """
+        for webrtc in self.streams.values():
+            webrtc.prepare_output()
+        log.debug(f"WebRTC output built after {self.elapsed(start)}")
+
     async def connect(self) -> None:
         """Connect to server."""
+        start = time.monotonic()
         if self.insecure:
             ssl_context = ssl.SSLContext()
             ssl_context.verify_mode = ssl.CERT_NONE
@@ -123,43 +282,70 @@ class GaleneClient:
         else:
             ssl_context = ssl.create_default_context()
 
-        # Get group status
-        log.info("Fetching group status")
-        status_url = urllib.parse.urljoin(self.output, ".status.json")
-        with urllib.request.urlopen(status_url, context=ssl_context) as resp:
-            status = json.load(resp)
+        if self.preroll:
+            for webrtc in self.streams.values():
+                webrtc.media.start()
+            log.debug(f"Pipeline started after {self.elapsed(start)}")
 
-        # Create WebSocket
-        log.info("Connecting to WebSocket")
-        self.conn = await websockets.connect(status["endpoint"], ssl=ssl_context)
+        # Build WebRTC output in an executor while connecting to server
+        event_loop = asyncio.get_event_loop()
+        prepare = event_loop.run_in_executor(None, self.prepare_output, start)
+        try:
+            # Get group status without blocking event loop, kept when reconnecting
+            if self.status is None:
+                log.info("Fetching group status")
+                self.status = await event_loop.run_in_executor(
+                    None, self.fetch_status, ssl_context
+                )
+                log.debug(f"Group status fetched after {self.elapsed(start)}")
+            status = self.status
 
-        # Handshake with server
-        log.info("Handshaking")
-        msg = {
-            "type": "handshake",
-            "version": ["2", "1"],
-            "id": self.client_id,
-        }
-        await self.send(msg)
-        await self.conn.recv()  # wait for handshake
+            # Create WebSocket, with a new client id if reconnecting
+            log.info("Connecting to WebSocket")
+            try:
+                endpoint = status["endpoint"]
+                if not endpoint.startswith("wss:"):
+                    ssl_context = None  # plain WebSocket, e.g. local test server
+                self.conn = await websockets.connect(endpoint, ssl=ssl_context)
+            except Exception:
+                self.status = None  # endpoint might have changed
+                raise
+            if self.connects:
+                self.client_id = secrets.token_bytes(16).hex()
+            self.connects += 1
+            log.debug(f"WebSocket connected after {self.elapsed(start)}")
 
-        # Join group
-        log.info("Joining group")
-        msg = {
-            "type": "join",
-            "kind": "join",
-            "group": status["name"],
-            "username": self.username,
-            "password": self.password,
-        }
-        await self.send(msg)
-        response = {"type": "none"}
-        while response["type"] != "joined":
-            # The server will send 'user' messages that we ignore
-            raw_response = await self.conn.recv()
-            response = json.loads(raw_response)
-        if response["kind"] != "join":
-            raise RuntimeError("failed to join room")
+            # Handshake with server
+            log.info("Handshaking")
+            msg = {
+                "type": "handshake",
+                "version": ["2", "1"],
+                "id": self.client_id,
+            }
+            await self.send(msg)
+            await self.conn.recv()  # wait for handshake
+
+            # Join group
+            log.info("Joining group")
+            msg = {
+                "type": "join",
+                "kind": "join",
+                "group": status["name"],
+                "username": self.username,
+                "password": self.password,
+            }
+            await self.send(msg)
+            response = {"type": "none"}
+            while response["type"] != "joined":
+                # The server will send 'user' messages that we ignore
+                raw_response = await self.conn.recv()
+                response = self.dispatcher.codec.loads(raw_response)
+            if response["kind"] != "join":
+                raise RuntimeError("failed to join room")
+            self.join_time = time.monotonic() - start
+            log.debug(f"Group joined after {self.elapsed(start)}")
+        finally:
+            await prepare
 
         # Get ICE servers
         rtc_configuration = response.get("rtcConfiguration", {})
@@ -173,16 +359,58 @@ class GaleneClient:
                 uri = f"turn://{username}:{credential}@{url}"
                 self.ice_servers.append(uri)
 
-    async def close(self) -> None:
-        """Close connection."""
+    async def disconnect(self) -> None:
+        """Close WebSocket connection."""
         log.info("Closing WebSocket connection")
-        self.webrtc.close_pipeline()
         if self.conn is None:
             log.warn("Connection is already closed")
             return
         await self.conn.close()
         self.conn = None
 
+    async def close(self) -> None:
+        """Close connection."""
+        if self.profiler is not None and self.profiler.handlers:
+            log.info(self.profiler.report())
+        for webrtc in self.streams.values():
+            webrtc.close_pipeline()
+        await self.disconnect()
+
+    async def run(self, event_loop) -> None:
+        """Connect and run client loop, reconnecting if enabled.
+
+        When reconnecting, only the WebRTC output is restarted, input decoding
+        and encoding keep running. Delay before reconnecting grows
+        exponentially while connections keep failing.
+
+        :param event_loop: asyncio event loop
+        :type event_loop: EventLoop
+        """
+        backoff = self.min_backoff
+        while True:
+            started = time.monotonic()
+            try:
+                await self.connect()
+                await self.loop(event_loop)
+            except (OSError, RuntimeError, websockets.WebSocketException) as e:
+                if not self.reconnect:
+                    raise
+                log.error(f"Connection failed: {e}")
+
+            if not self.reconnect:
+                return
+
+            # Reset backoff if connection was stable
+            if time.monotonic() - started > self.max_backoff:
+                backoff = self.min_backoff
+            for webrtc in self.streams.values():
+                webrtc.close_pipeline(keep_media=True)
+            await self.disconnect()
+            log.info(f"Reconnecting in {backoff:.1f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(2 * backoff, self.max_backoff)
+            self.reconnects += 1
+
     async def loop(self, event_loop) -> None:
         """Client loop
 
@@ -192,52 +420,133 @@ class GaleneClient:
         """
         if self.conn is None:
             raise RuntimeError("client not connected")
-        self.webrtc.start_pipeline(event_loop, self.ice_servers)
+        if self.aborted.issuperset(self.streams):
+            self.aborted.clear()  # session ended, offer all streams again
+        for stream_id, webrtc in self.streams.items():
+            if stream_id not in self.aborted:
+                webrtc.start_pipeline(event_loop, self.ice_servers)
         log.info("Waiting for incoming stream...")
 
         async for message in self.conn:
-            message = json.loads(message)
-            if message["type"] == "ping":
-                # Need to answer pong to ping request to keep connection
-                await self.send({"type": "pong"})
-            elif message["type"] == "abort":
-                # Server wants to close our stream
-                log.info("Received abort from server")
-                await self.send({"type": "close", "id": message.get("id")})
+            self.messages_received += 1
+            if await self.dispatcher.dispatch(message):
                 break
-            elif message["type"] == "answer":
-                # Server is sending a SDP offer
-                sdp = message.get("sdp")
-                log.debug(f"Receiving SDP from remote: {sdp}")
-                self.webrtc.set_remote_sdp(sdp)
-            elif message["type"] == "ice":
-                # Server is sending trickle ICE candidates
-                log.debug("Receiving new ICE candidate from remote")
-                mline_index = message.get("candidate").get("sdpMLineIndex")
-                candidate = message.get("candidate").get("candidate")
-                self.webrtc.add_ice_candidate(mline_index, candidate)
-            elif message["type"] == "renegotiate":
-                # Server is asking to renegotiate WebRTC session
-                self.webrtc.on_negotiation_needed(self.webrtc.webrtc)
-            elif message["type"] == "usermessage":
-                value = message.get("value")
-                if message["kind"] == "error":
-                    log.error(f"Server returned error: {value}")
-                    break
-                else:
-                    log.warn(f"Server sent: {value}")
-            elif message["type"] == "user":
-                continue  # ignore user events
-            elif message["type"] == "close":
-                continue  # ignore close events
-            elif message["type"] == "chat":
-                # User might request statistics using `!webrtc` chat command
-                if message.get("value") == "!webrtc":
-                    m = self.webrtc.get_stats()
-                    if m:
-                        await self.send_chat(m)
-            elif message["type"] == "chathistory":
-                continue  # ignore chat history events
-            else:
-                # Oh no! We receive something not implemented
-                log.warn(f"Not implemented {message}")
+
+    async def on_ping(self, message: dict) -> None:
+        """Answer pong to ping request to keep connection.
+
+        :param message: received message
+        :type message: dict
+        """
+        await self.send({"type": "pong"})
+
+    def get_stream(self, message: dict) -> Optional[WebRTCClient]:
+        """Get the stream a message is about.
+
+        :param message: received message
+        :type message: dict
+        :return: WebRTC client of the stream, or None if it is unknown or
+            was aborted
+        :rtype: WebRTCClient, optional
+        """
+        if message.get("id") in self.aborted:
+            log.debug(f"Received {message.get('type')} for an aborted stream")
+            return None
+        webrtc = self.streams.get(message.get("id"))
+        if webrtc is None:
+            log.warning(f"Received {message.get('type')} for an unknown stream")
+        return webrtc
+
+    async def on_abort(self, message: dict) -> bool:
+        """Close a stream, as asked by server.
+
+        :param message: received message
+        :type message: dict
+        :return: True to end the session once all streams are closed
+        :rtype: bool
+        """
+        log.info("Received abort from server")
+        stream_id = message.get("id")
+        await self.send({"type": "close", "id": stream_id})
+        webrtc = self.get_stream(message)
+        if webrtc is not None and len(self.streams) > 1:
+            webrtc.close_pipeline(keep_media=True)
+        self.aborted.add(stream_id)
+        return self.aborted.issuperset(self.streams)
+
+    async def on_answer(self, message: dict) -> None:
+        """Set SDP answer of server.
+
+        :param message: received message
+        :type message: dict
+        """
+        webrtc = self.get_stream(message)
+        if webrtc is None:
+            return
+        sdp = message.get("sdp")
+        log.debug(f"Receiving SDP from remote: {sdp}")
+        offer_sent_at = self.offer_sent_at.get(message["id"])
+        if offer_sent_at is not None:
+            self.answer_time = time.monotonic() - offer_sent_at
+        webrtc.set_remote_sdp(sdp)
+
+    async def on_ice(self, message: dict) -> None:
+        """Add trickle ICE candidate sent by server.
+
+        :param message: received message
+        :type message: dict
+        """
+        webrtc = self.get_stream(message)
+        if webrtc is None:
+            return
+        log.debug("Receiving new ICE candidate from remote")
+        mline_index = message.get("candidate").get("sdpMLineIndex")
+        candidate = message.get("candidate").get("candidate")
+        webrtc.add_ice_candidate(mline_index, candidate)
+
+    async def on_renegotiate(self, message: dict) -> None:
+        """Renegotiate WebRTC session, as asked by server.
+
+        :param message: received message
+        :type message: dict
+        """
+        webrtc = self.get_stream(message)
+        if webrtc is not None:
+            webrtc.on_negotiation_needed(webrtc.webrtc)
+
+    async def on_usermessage(self, message: dict) -> bool:
+        """Log message sent by server.
+
+        :param message: received message
+        :type message: dict
+        :return: True to end the session on errors
+        :rtype: bool
+        """
+        value = message.get("value")
+        if message["kind"] == "error":
+            log.error(f"Server returned error: {value}")
+            return True
+        log.warn(f"Server sent: {value}")
+        return False
+
+    async def on_chat(self, message: dict) -> None:
+        """Answer chat commands.
+
+        User might request statistics using `!webrtc` chat command, and
+        processing time since previous request using `!profile`.
+
+        :param message: received message
+        :type message: dict
+        """
+        if message.get("value") == "!webrtc":
+            for stream_id, webrtc in self.streams.items():
+                if stream_id in self.aborted:
+                    continue
+                m = webrtc.get_stats()
+                if m:
+                    await self.send_chat(m)
+        elif message.get("value") == "!profile":
+            profilers = [w.media.profiler for w in self.streams.values()]
+            reports = [p.report(window=True) for p in profilers + [self.profiler] if p]
+            if any(reports):
+                await self.send_chat("\n".join(r for r in reports if r))
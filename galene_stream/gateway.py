@@ -0,0 +1,98 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Multi-stream gateway running many bridges in one event loop.
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from galene_stream.metrics import Sample
+
+if TYPE_CHECKING:
+    from galene_stream.admission import AdmissionController
+    from galene_stream.galene import GaleneClient
+
+log = logging.getLogger(__name__)
+
+
+async def run_bridge(name: str, client: "GaleneClient") -> None:
+    """Run one bridge until it ends or fails.
+
+    Errors are logged and do not propagate, so that a failing bridge does not
+    stop the other bridges.
+
+    :param name: bridge name, used in logs
+    :type name: str
+    :param client: Galène client of this bridge
+    :type client: GaleneClient
+    """
+    log.info(f"Starting bridge {name}")
+    try:
+        await client.run(asyncio.get_event_loop())
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        log.exception(f"Bridge {name} failed")
+    finally:
+        await client.close()
+    log.info(f"Bridge {name} stopped")
+
+
+def collect_metrics(clients: Dict[str, "GaleneClient"]) -> List[Sample]:
+    """Collect metrics of all bridges, labelled by bridge name.
+
+    :param clients: Galène clients indexed by bridge name
+    :type clients: dict
+    :return: metrics samples
+    :rtype: list
+    """
+    samples = []
+    for name, client in clients.items():
+        try:
+            for metric, labels, value in client.get_metrics():
+                samples.append((metric, {"stream": name, **labels}, value))
+        except Exception:
+            log.exception(f"Failed to collect metrics of bridge {name}")
+    return samples
+
+
+async def run_bridges(
+    clients: Dict[str, "GaleneClient"],
+    admission: Optional["AdmissionController"] = None,
+) -> None:
+    """Run all bridges concurrently.
+
+    With admission control, bridges are started one at a time, and only while
+    the host is not overloaded. Load of running bridges is watched, shedding
+    low priority streams if enabled.
+
+    :param clients: Galène clients indexed by bridge name
+    :type clients: dict
+    :param admission: admission controller, if None all bridges start at once
+    :type admission: AdmissionController, optional
+    """
+    if admission is None:
+        await asyncio.gather(*(run_bridge(n, c) for n, c in clients.items()))
+        return
+
+    watch = asyncio.ensure_future(admission.run())
+    tasks = []
+    try:
+        pending = list(clients.items())
+        while pending:
+            name, client = pending[0]
+            if admission.admit(name):
+                tasks.append(asyncio.ensure_future(run_bridge(name, client)))
+                pending.pop(0)
+                if not pending:
+                    break
+            # Let load of started bridges be measured before starting another
+            await asyncio.sleep(admission.interval)
+        await asyncio.gather(*tasks)
+    finally:
+        watch.cancel()
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,94 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Minimal HTTP server for local endpoints, without external dependencies.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+#: A route returns a content type and a body
+Route = Callable[[], Tuple[str, bytes]]
+
+
+class HTTPServer:
+    """HTTP/1.0 server answering GET requests on a few routes."""
+
+    def __init__(self, routes: Dict[str, Route]) -> None:
+        """Init HTTPServer.
+
+        :param routes: functions generating responses, indexed by path
+        :type routes: dict
+        """
+        self.routes = routes
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str, port: int) -> None:
+        """Listen on a TCP port.
+
+        :param host: address to listen on
+        :type host: str
+        :param port: port to listen on
+        :type port: int
+        """
+        self.server = await asyncio.start_server(self.handle, host, port)
+        log.info(f"Listening on http://{host}:{port}/")
+
+    async def start_unix(self, path: str) -> None:
+        """Listen on a Unix socket.
+
+        :param path: socket path
+        :type path: str
+        """
+        self.server = await asyncio.start_unix_server(self.handle, path)
+        log.info(f"Listening on {path}")
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer one HTTP request.
+
+        :param reader: connection reader
+        :type reader: asyncio.StreamReader
+        :param writer: connection writer
+        :type writer: asyncio.StreamWriter
+        """
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in [b"\r\n", b"\n", b""]:
+                pass  # ignore headers
+
+            fields = request.decode(errors="replace").split()
+            path = fields[1].split("?")[0] if len(fields) > 1 else ""
+            route = self.routes.get(path)
+            if fields and fields[0] != "GET":
+                status, content_type, body = "405 Method Not Allowed", "text/plain", b""
+            elif route is None:
+                status, content_type, body = "404 Not Found", "text/plain", b""
+            else:
+                status = "200 OK"
+                content_type, body = route()
+
+            header = (
+                f"HTTP/1.0 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            )
+            writer.write(header.encode() + body)
+            await writer.drain()
+        except Exception:
+            log.exception("Failed to answer HTTP request")
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        """Stop listening."""
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
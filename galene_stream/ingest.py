@@ -0,0 +1,123 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Ingest profiles, tuning buffering of network inputs.
+
+Ingest lag is the time a buffer enters the pipeline after its running time.
+With live sources, it includes buffering that was there when input started.
+Ingest delay is the lag relative to the earliest buffer seen, so that it
+measures buffering and jitter added since input started, even for sources that
+are not live. Low latency profiles drop stale buffers to catch up.
+"""
+
+import urllib.parse
+from typing import Any, Dict, List, NamedTuple, Optional
+
+
+class IngestProfile(NamedTuple):
+    """Buffering of a network input."""
+
+    #: Properties of uridecodebin
+    decodebin: str = ""
+    #: Properties of source element, set when it has them
+    source: Dict[str, Any] = {}
+    #: Buffers later than this are dropped to catch up, in seconds
+    max_lag: Optional[float] = None
+
+
+INGEST_PROFILES: Dict[str, IngestProfile] = {
+    "default": IngestProfile(),
+    "low-latency": IngestProfile(
+        # Download buffering holds seconds of media before playing
+        decodebin="use-buffering=false buffer-size=65536 buffer-duration=100000000",
+        # SRT and RTSP latency in milliseconds
+        source={"latency": 80, "drop-on-latency": True},
+        max_lag=0.2,
+    ),
+}
+
+
+def source_properties(uri: str, profile: IngestProfile) -> Dict[str, Any]:
+    """Get properties of source element, unless already given in URI.
+
+    :param uri: input URI, e.g. ``srt://host:port?latency=200``
+    :type uri: str
+    :param profile: ingest profile
+    :type profile: IngestProfile
+    :return: properties to set on source element
+    :rtype: dict
+    """
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(uri).query)
+    return {k: v for k, v in profile.source.items() if k not in query}
+
+
+class IngestDelay:
+    """Ingest delay of one media kind, dropping stale buffers if enabled."""
+
+    #: Delay after which a lagging input is no longer dropped, in seconds
+    rebase_after = 2.0
+
+    def __init__(self, max_lag: Optional[float] = None) -> None:
+        """Init IngestDelay.
+
+        :param max_lag: buffers later than this are dropped, in seconds, if
+            None buffers are never dropped
+        :type max_lag: float, optional
+        """
+        self.max_lag = max_lag
+        self.baseline: Optional[float] = None
+        self.lag = 0.0
+        self.delay = 0.0
+        self.stale_since: Optional[float] = None
+        self.dropped = 0
+
+    def reset(self) -> None:
+        """Forget earliest buffer, e.g. when input restarts."""
+        self.baseline = None
+        self.stale_since = None
+
+    def observe(self, lag: float, now: float) -> bool:
+        """Record a buffer entering the pipeline.
+
+        If dropping stale buffers does not catch up within
+        :attr:`rebase_after`, input is assumed to be late for good and the
+        current lag becomes the reference.
+
+        :param lag: pipeline running time minus buffer running time, in seconds
+        :type lag: float
+        :param now: current time in seconds
+        :type now: float
+        :return: True if buffer is stale and should be dropped
+        :rtype: bool
+        """
+        self.lag = lag
+        if self.baseline is None or lag < self.baseline:
+            self.baseline = lag
+        self.delay = lag - self.baseline
+        if self.max_lag is None or self.delay <= self.max_lag:
+            self.stale_since = None
+            return False
+        if self.stale_since is None:
+            self.stale_since = now
+        elif now - self.stale_since > self.rebase_after:
+            self.baseline, self.delay, self.stale_since = lag, 0.0, None
+            return False
+        self.dropped += 1
+        return True
+
+
+def ingest_report(delays: Dict[str, IngestDelay]) -> List[str]:
+    """Get ingest delay report of each media kind.
+
+    :param delays: ingest delay indexed by media kind
+    :type delays: dict
+    :return: report lines
+    :rtype: list of str
+    """
+    return [
+        f"{kind} ingest delay: {d.delay * 1000:.0f}ms "
+        f"(lag {d.lag * 1000:.0f}ms), {d.dropped} stale dropped"
+        for kind, d in delays.items()
+        if d.baseline is not None
+    ]
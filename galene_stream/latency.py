@@ -0,0 +1,226 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Latency instrumentation of pipeline stages.
+
+Buffers are timestamped when they leave each stage, and matched to the previous
+stage using their presentation timestamp. As encoders may split or merge
+buffers, a buffer is matched to the latest buffer of the previous stage with a
+smaller or equal presentation timestamp.
+"""
+
+import bisect
+import threading
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from galene_stream.metrics import Sample
+
+#: Default histogram buckets in seconds
+DEFAULT_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0]
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    def __init__(self, buckets: List[float]) -> None:
+        """Init Histogram.
+
+        :param buckets: bucket upper bounds in seconds, sorted
+        :type buckets: list of float
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add a value.
+
+        :param value: latency in seconds
+        :type value: float
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of its bucket.
+
+        :param q: quantile, from 0 to 1
+        :type q: float
+        :return: estimated quantile in seconds
+        :rtype: float
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.max
+
+    def get_samples(self, name: str, labels: Dict[str, str]) -> List[Sample]:
+        """Get Prometheus histogram samples.
+
+        :param name: metric name
+        :type name: str
+        :param labels: labels of all samples
+        :type labels: dict
+        :return: metrics samples
+        :rtype: list
+        """
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else str(bound)
+            samples.append((f"{name}_bucket", {**labels, "le": le}, cumulative))
+        samples.append((f"{name}_sum", labels, self.sum))
+        samples.append((f"{name}_count", labels, self.count))
+        return samples
+
+
+class StageTimes:
+    """Times at which recent buffers left a stage."""
+
+    def __init__(self, size: int = 512) -> None:
+        """Init StageTimes.
+
+        :param size: number of buffers to remember
+        :type size: int, optional
+        """
+        self.size = size
+        self.pts: List[int] = []
+        self.times: List[float] = []
+        self.lock = threading.Lock()
+
+    def add(self, pts: int, now: float) -> bool:
+        """Remember time of a new buffer.
+
+        :param pts: buffer presentation timestamp
+        :type pts: int
+        :param now: current time in seconds
+        :type now: float
+        :return: False if a buffer with this timestamp was already seen
+        :rtype: bool
+        """
+        with self.lock:
+            if self.pts and pts <= self.pts[-1]:
+                return False  # e.g. many RTP packets of the same frame
+            self.pts.append(pts)
+            self.times.append(now)
+            if len(self.pts) > self.size:
+                del self.pts[: -self.size]
+                del self.times[: -self.size]
+            return True
+
+    def lookup(self, pts: int) -> Optional[float]:
+        """Get time of latest buffer with a smaller or equal timestamp.
+
+        :param pts: buffer presentation timestamp
+        :type pts: int
+        :return: time in seconds, or None if unknown
+        :rtype: float, optional
+        """
+        with self.lock:
+            i = bisect.bisect_right(self.pts, pts) - 1
+            return self.times[i] if i >= 0 else None
+
+
+class LatencyTracer:
+    """Measure latency added by each stage of the pipeline."""
+
+    def __init__(self, buckets: List[float] = DEFAULT_BUCKETS) -> None:
+        """Init LatencyTracer.
+
+        :param buckets: histogram bucket upper bounds in seconds
+        :type buckets: list of float, optional
+        """
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.stages: Dict[Hashable, StageTimes] = {}
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def record(
+        self,
+        kind: str,
+        stage: str,
+        previous: Optional[str],
+        pts: int,
+        key: Hashable = None,
+    ) -> None:
+        """Record a buffer leaving a stage.
+
+        :param kind: media kind, "video" or "audio"
+        :type kind: str
+        :param stage: stage name
+        :type stage: str
+        :param previous: previous stage name, None for first stage
+        :type previous: str, optional
+        :param pts: buffer presentation timestamp
+        :type pts: int
+        :param key: distinguishes many instances of the same stage, such as
+            payloaders of many outputs
+        :type key: hashable, optional
+        """
+        now = time.monotonic()
+        stage_times = self.stages.setdefault((kind, stage, key), StageTimes())
+        if not stage_times.add(pts, now) or previous is None:
+            return
+        previous_times = self.stages.get((kind, previous, None))
+        start = previous_times.lookup(pts) if previous_times else None
+        if start is None:
+            return
+        # Stages of each media kind are recorded by different threads
+        with self.lock:
+            histogram = self.histograms.get((kind, stage))
+            if histogram is None:
+                histogram = self.histograms[kind, stage] = Histogram(self.buckets)
+            histogram.observe(now - start)
+
+    def forget(self, key: Hashable) -> None:
+        """Forget stage times of an instance, e.g. a detached output.
+
+        :param key: key given to :meth:`record`
+        :type key: hashable
+        """
+        for stage in [s for s in list(self.stages) if s[2] == key]:
+            self.stages.pop(stage, None)
+
+    def get_metrics(self) -> List[Sample]:
+        """Get latency histograms of each stage.
+
+        :return: metrics samples
+        :rtype: list
+        """
+        samples = []
+        with self.lock:
+            for (kind, stage), histogram in self.histograms.items():
+                labels = {"kind": kind, "stage": stage}
+                samples += histogram.get_samples(
+                    "galene_stream_stage_latency_seconds", labels
+                )
+        return samples
+
+    def report(self) -> str:
+        """Get latency budget report of each stage.
+
+        :return: text report
+        :rtype: str
+        """
+        lines = []
+        with self.lock:
+            for (kind, stage), histogram in self.histograms.items():
+                if not histogram.count:
+                    continue
+                mean = histogram.sum / histogram.count
+                lines.append(
+                    f"{kind} {stage}: mean={mean * 1000:.1f}ms "
+                    f"p90<={histogram.quantile(0.9) * 1000:.0f}ms "
+                    f"max={histogram.max * 1000:.1f}ms"
+                )
+        return "\n".join(lines)
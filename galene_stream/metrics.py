@@ -0,0 +1,215 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Prometheus metrics endpoint.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from galene_stream.httpserver import HTTPServer
+
+log = logging.getLogger(__name__)
+
+#: A sample is a metric name, labels and value
+Sample = Tuple[str, Dict[str, str], float]
+
+#: Type and help of each exported metric
+METRICS: Dict[str, Tuple[str, str]] = {
+    "galene_stream_signaling_connects_total": (
+        "counter",
+        "WebSocket connections to Galène.",
+    ),
+    "galene_stream_signaling_reconnects_total": (
+        "counter",
+        "Reconnections to Galène after a lost connection.",
+    ),
+    "galene_stream_signaling_messages_received_total": (
+        "counter",
+        "Signaling messages received from Galène.",
+    ),
+    "galene_stream_signaling_messages_sent_total": (
+        "counter",
+        "Signaling messages sent to Galène.",
+    ),
+    "galene_stream_signaling_join_seconds": (
+        "gauge",
+        "Time to connect and join the group at last connection.",
+    ),
+    "galene_stream_signaling_answer_seconds": (
+        "gauge",
+        "Time between last SDP offer and its answer.",
+    ),
+    "galene_stream_ice_connection_state": (
+        "gauge",
+        "ICE connection state, 1 for the current state.",
+    ),
+    "galene_stream_rtp_octets_sent_total": ("counter", "RTP octets sent."),
+    "galene_stream_rtp_packets_sent_total": ("counter", "RTP packets sent."),
+    "galene_stream_rtp_packets_lost": (
+        "gauge",
+        "RTP packets lost, as reported by receiver.",
+    ),
+    "galene_stream_rtp_bitrate_bits": ("gauge", "Estimated RTP bitrate in bit/s."),
+    "galene_stream_rtp_round_trip_seconds": (
+        "gauge",
+        "Round-trip time, as reported by receiver.",
+    ),
+    "galene_stream_rtp_nack_received_total": (
+        "counter",
+        "NACK requests received.",
+    ),
+    "galene_stream_rtp_pli_received_total": ("counter", "PLI requests received."),
+    "galene_stream_encoded_frames_total": ("counter", "Frames out of encoders."),
+    "galene_stream_queue_buffers": ("gauge", "Buffers waiting in queue."),
+    "galene_stream_dropped_buffers_total": (
+        "counter",
+        "Buffers dropped by full queues between pipeline stages.",
+    ),
+    "galene_stream_element_processing_seconds_total": (
+        "counter",
+        "Time spent by pipeline elements processing buffers, with --profile.",
+    ),
+    "galene_stream_signaling_handler_seconds_total": (
+        "counter",
+        "Time spent decoding and handling signaling messages, including awaited "
+        "sends, with --profile.",
+    ),
+    "galene_stream_overloaded": ("gauge", "Host is overloaded, 1 if overloaded."),
+    "galene_stream_host_cpu_usage": ("gauge", "Host CPU usage, from 0 to 1."),
+    "galene_stream_refused_bridges_total": (
+        "counter",
+        "Bridges refused at least once by admission control.",
+    ),
+    "galene_stream_shed_steps_total": (
+        "counter",
+        "Streams degraded by admission control to shed load.",
+    ),
+    "galene_stream_worker_up": ("gauge", "Worker process running, 1 if up."),
+    "galene_stream_worker_restarts_total": (
+        "counter",
+        "Restarts of a worker process after it crashed.",
+    ),
+    "galene_stream_ingest_delay_seconds": (
+        "gauge",
+        "Delay of input buffers relative to the earliest buffer seen.",
+    ),
+    "galene_stream_ingest_lag_seconds": (
+        "gauge",
+        "Pipeline running time minus running time of latest input buffer.",
+    ),
+    "galene_stream_stale_buffers_dropped_total": (
+        "counter",
+        "Input buffers dropped as too late, to catch up.",
+    ),
+    "galene_stream_stage_latency_seconds": (
+        "histogram",
+        "Latency added by each pipeline stage.",
+    ),
+}
+
+#: Content type of Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """Format labels in Prometheus text exposition format.
+
+    :param labels: labels
+    :type labels: dict
+    :return: formatted labels
+    :rtype: str
+    """
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", r"\\").replace('"', r"\"")
+        value = value.replace("\n", r"\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def render(samples: List[Sample]) -> str:
+    """Render samples in Prometheus text exposition format.
+
+    :param samples: samples to render
+    :type samples: list
+    :return: text exposition
+    :rtype: str
+    """
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        names = [name]
+        if metric_type == "histogram":
+            names = [f"{name}_bucket", f"{name}_sum", f"{name}_count"]
+        metric_samples = [s for s in samples if s[0] in names]
+        if not metric_samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample_name, labels, value in metric_samples:
+            lines.append(f"{sample_name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Export periodically sampled metrics over HTTP."""
+
+    def __init__(
+        self,
+        collect: Callable[[], Union[List[Sample], Awaitable[List[Sample]]]],
+        interval: float = 5.0,
+    ) -> None:
+        """Init MetricsExporter.
+
+        :param collect: function or coroutine function collecting samples
+        :type collect: callable
+        :param interval: time between two samplings in seconds
+        :type interval: float, optional
+        """
+        self.collect = collect
+        self.interval = interval
+        self.text = b""
+        self.http = HTTPServer({"/metrics": self.get_metrics})
+        self.task: Optional[asyncio.Task] = None
+
+    def get_metrics(self) -> Tuple[str, bytes]:
+        """Get latest sampled metrics.
+
+        :return: content type and body
+        :rtype: tuple
+        """
+        return CONTENT_TYPE, self.text
+
+    async def sample(self) -> None:
+        """Sample metrics until exporter is closed."""
+        while True:
+            try:
+                samples = self.collect()
+                if asyncio.iscoroutine(samples):
+                    samples = await samples
+                self.text = render(samples).encode()
+            except Exception:
+                log.exception("Failed to collect metrics")
+            await asyncio.sleep(self.interval)
+
+    async def start(self, host: str, port: int) -> None:
+        """Start sampling and serving metrics.
+
+        :param host: address to listen on
+        :type host: str
+        :param port: port to listen on
+        :type port: int
+        """
+        await self.http.start(host, port)
+        self.task = asyncio.ensure_future(self.sample())
+
+    async def close(self) -> None:
+        """Stop sampling and serving metrics."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.http.close()
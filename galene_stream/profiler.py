@@ -0,0 +1,215 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Processing time profiling of pipeline elements and signaling handlers.
+
+Processing time of an element is the time between a buffer entering its sink
+pad and the first buffer it pushes on its source pad, in the same thread, as
+GStreamer proc-time tracers do. Queues only hand buffers to another thread,
+so their level is sampled instead.
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from galene_stream.metrics import Sample
+
+
+class Timing:
+    """Count, total and maximum of measured durations."""
+
+    def __init__(self) -> None:
+        """Init Timing."""
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        """Add a measured duration or level.
+
+        :param value: duration in seconds, or queue level
+        :type value: float
+        """
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def copy(self) -> "Timing":
+        """Copy current values, to compute a later window.
+
+        :return: copy
+        :rtype: Timing
+        """
+        timing = Timing()
+        timing.count, timing.total, timing.max = self.count, self.total, self.max
+        return timing
+
+
+class Profiler:
+    """Aggregate processing time of elements and signaling handlers."""
+
+    def __init__(self) -> None:
+        """Init Profiler."""
+        self.lock = threading.Lock()
+        self.entered = threading.local()
+        self.elements: Dict[str, Timing] = {}
+        self.queues: Dict[str, Timing] = {}
+        self.handlers: Dict[str, Timing] = {}
+        self.started_at = time.monotonic()
+        self.window_at = self.started_at
+        self.window: Dict[str, Timing] = {}
+
+    def enter(self, element: str) -> None:
+        """Record a buffer entering an element, in current thread.
+
+        :param element: element name
+        :type element: str
+        """
+        if not hasattr(self.entered, "times"):
+            self.entered.times = {}
+        self.entered.times[element] = time.perf_counter()
+
+    def leave(self, element: str) -> None:
+        """Record a buffer leaving an element, in current thread.
+
+        Only the first buffer pushed after a buffer entered is counted, as
+        later pushes include time spent downstream.
+
+        :param element: element name
+        :type element: str
+        """
+        times = getattr(self.entered, "times", None)
+        start = times.pop(element, None) if times else None
+        if start is None:
+            return  # e.g. buffer was produced by another thread
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.elements.setdefault(element, Timing()).add(elapsed)
+
+    def record_queue(self, queue: str, level: int) -> None:
+        """Record level of a queue when a buffer leaves it.
+
+        :param queue: queue name
+        :type queue: str
+        :param level: buffers in queue
+        :type level: int
+        """
+        with self.lock:
+            self.queues.setdefault(queue, Timing()).add(level)
+
+    def record_handler(self, message_type: str, elapsed: float) -> None:
+        """Record time spent decoding and handling a signaling message.
+
+        :param message_type: message type
+        :type message_type: str
+        :param elapsed: time in seconds
+        :type elapsed: float
+        """
+        with self.lock:
+            self.handlers.setdefault(message_type, Timing()).add(elapsed)
+
+    def get_metrics(self) -> List[Sample]:
+        """Get processing time of each element and handler.
+
+        :return: metrics samples
+        :rtype: list
+        """
+        samples: List[Sample] = []
+        with self.lock:
+            for element, timing in self.elements.items():
+                samples.append(
+                    (
+                        "galene_stream_element_processing_seconds_total",
+                        {"element": element},
+                        timing.total,
+                    )
+                )
+            for message_type, timing in self.handlers.items():
+                samples.append(
+                    (
+                        "galene_stream_signaling_handler_seconds_total",
+                        {"type": message_type},
+                        timing.total,
+                    )
+                )
+        return samples
+
+    def ranked(self, window: bool = False) -> Tuple[float, List[Tuple[str, Timing]]]:
+        """Get processing time of elements, most expensive first.
+
+        :param window: only count time since previous window, and start a new
+            window
+        :type window: bool, optional
+        :return: duration of the period in seconds, and timing of elements
+        :rtype: tuple
+        """
+        now = time.monotonic()
+        with self.lock:
+            elements = {k: v.copy() for k, v in self.elements.items()}
+            duration = now - self.started_at
+            if window:
+                for name, timing in elements.items():
+                    previous = self.window.get(name)
+                    if previous is not None:
+                        timing.count -= previous.count
+                        timing.total -= previous.total
+                duration = now - self.window_at
+                self.window = {k: v.copy() for k, v in self.elements.items()}
+                self.window_at = now
+        ranking = sorted(elements.items(), key=lambda e: e[1].total, reverse=True)
+        return duration, [(name, t) for name, t in ranking if t.count]
+
+    def report(self, window: bool = False) -> str:
+        """Get ranked report of elements, queues and signaling handlers.
+
+        CPU share is the processing time divided by the period duration, it
+        may exceed 100% when an element runs in many threads.
+
+        :param window: only report elements since previous window
+        :type window: bool, optional
+        :return: text report, empty if nothing was measured
+        :rtype: str
+        """
+        duration, ranking = self.ranked(window)
+        lines = [f"Processing time over {duration:.0f}s:"] if ranking else []
+        for name, timing in ranking:
+            share = 100 * timing.total / duration if duration else 0.0
+            mean = timing.total / timing.count
+            lines.append(
+                f"{name}: {share:.1f}% cpu mean={mean * 1000:.2f}ms "
+                f"max={timing.max * 1000:.1f}ms buffers={timing.count}"
+            )
+        with self.lock:
+            queues = sorted(self.queues.items())
+            handlers = sorted(self.handlers.items(), key=lambda h: -h[1].total)
+        for name, timing in queues:
+            mean = timing.total / timing.count
+            lines.append(f"queue {name}: mean={mean:.1f} max={timing.max:.0f}")
+        for message_type, timing in handlers:
+            mean = timing.total / timing.count
+            lines.append(
+                f"signaling {message_type}: mean={mean * 1000:.2f}ms "
+                f"max={timing.max * 1000:.1f}ms messages={timing.count} "
+                "(including sends)"
+            )
+        return "\n".join(lines)
+
+
+def element_key(name: str, factory: Optional[str]) -> str:
+    """Get profiling key of an element.
+
+    Elements named by galene-stream keep their name, while elements with
+    generated names, such as ``srtpenc0``, are grouped by factory.
+
+    :param name: element name
+    :type name: str
+    :param factory: element factory name
+    :type factory: str, optional
+    :return: profiling key
+    :rtype: str
+    """
+    if factory and name[-1:].isdigit():
+        return factory
+    return name
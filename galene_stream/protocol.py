@@ -0,0 +1,184 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Galène signaling message encoding and dispatch.
+
+Messages are decoded using the fastest available JSON library. Galène encodes
+the message type as first field, so ignored messages are dropped by looking at
+the beginning of the frame, without decoding it.
+"""
+
+import json
+import logging
+import time
+from typing import (
+    TYPE_CHECKING,
+    Awaitable,
+    Callable,
+    Dict,
+    NamedTuple,
+    Optional,
+    Set,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from galene_stream.profiler import Profiler
+
+log = logging.getLogger(__name__)
+
+#: A handler receives a decoded message and returns True to end the session
+Handler = Callable[[dict], Awaitable[Optional[bool]]]
+
+
+class JSONCodec(NamedTuple):
+    """JSON library used to encode and decode messages."""
+
+    name: str
+    loads: Callable[[Union[str, bytes]], dict]
+    dumps: Callable[[dict], str]
+
+
+def load_codecs() -> Dict[str, JSONCodec]:
+    """Load available JSON codecs, fastest first.
+
+    :return: available codecs indexed by name
+    :rtype: dict
+    """
+    codecs = {}
+    try:
+        import orjson
+
+        codecs["orjson"] = JSONCodec(
+            "orjson", orjson.loads, lambda obj: orjson.dumps(obj).decode()
+        )
+    except ImportError:
+        pass
+    try:
+        import msgspec
+
+        encoder, decoder = msgspec.json.Encoder(), msgspec.json.Decoder()
+        codecs["msgspec"] = JSONCodec(
+            "msgspec", decoder.decode, lambda obj: encoder.encode(obj).decode()
+        )
+    except ImportError:
+        pass
+    codecs["json"] = JSONCodec("json", json.loads, json.dumps)
+    return codecs
+
+
+#: Available JSON codecs, fastest first
+CODECS = load_codecs()
+
+#: Beginning of a message encoded by Galène, before its type
+TYPE_PREFIX = '{"type":"'
+
+
+def get_codec(name: Optional[str] = None) -> JSONCodec:
+    """Get a JSON codec.
+
+    :param name: codec name, if None the fastest available codec is used
+    :type name: str, optional
+    :raises ValueError: if codec is not available
+    :return: JSON codec
+    :rtype: JSONCodec
+    """
+    if name is None:
+        return next(iter(CODECS.values()))
+    if name not in CODECS:
+        raise ValueError(f"JSON codec {name} is not available")
+    return CODECS[name]
+
+
+def peek_type(raw: Union[str, bytes]) -> Optional[str]:
+    """Get message type without decoding the whole message.
+
+    :param raw: encoded message
+    :type raw: str or bytes
+    :return: message type, or None if it is not the first field
+    :rtype: str, optional
+    """
+    if not isinstance(raw, str) or not raw.startswith(TYPE_PREFIX):
+        return None
+    end = raw.find('"', len(TYPE_PREFIX))
+    if end < 0:
+        return None
+    return raw[len(TYPE_PREFIX) : end]
+
+
+class Dispatcher:
+    """Decode messages and call the handler registered for their type."""
+
+    def __init__(
+        self, codec: Optional[JSONCodec] = None, profiler: Optional["Profiler"] = None
+    ) -> None:
+        """Init Dispatcher.
+
+        :param codec: JSON codec, if None the fastest available is used
+        :type codec: JSONCodec, optional
+        :param profiler: profiler recording time spent decoding and handling
+            each message type, including messages sent by handlers, if None
+            handlers are not timed
+        :type profiler: Profiler, optional
+        """
+        self.codec = codec or get_codec()
+        self.profiler = profiler
+        self.handlers: Dict[str, Handler] = {}
+        self.ignored: Set[str] = set()
+
+    def register(self, message_type: str, handler: Handler) -> None:
+        """Register handler of a message type.
+
+        :param message_type: message type
+        :type message_type: str
+        :param handler: coroutine function handling decoded messages
+        :type handler: coroutine
+        """
+        self.handlers[message_type] = handler
+
+    def ignore(self, *message_types: str) -> None:
+        """Ignore message types, these messages are not decoded.
+
+        :param message_types: message types
+        :type message_types: str
+        """
+        self.ignored.update(message_types)
+
+    def decode(self, raw: Union[str, bytes]) -> Optional[dict]:
+        """Decode a message, unless it is ignored.
+
+        :param raw: encoded message
+        :type raw: str or bytes
+        :return: decoded message, or None if it is ignored
+        :rtype: dict, optional
+        """
+        if peek_type(raw) in self.ignored:
+            return None
+        message = self.codec.loads(raw)
+        if message.get("type") in self.ignored:
+            return None
+        return message
+
+    async def dispatch(self, raw: Union[str, bytes]) -> bool:
+        """Decode a message and call its handler.
+
+        :param raw: encoded message
+        :type raw: str or bytes
+        :return: True if the session should end
+        :rtype: bool
+        """
+        start = time.perf_counter()
+        message = self.decode(raw)
+        if message is None:
+            return False
+        handler = self.handlers.get(message.get("type"))
+        if handler is None:
+            # Oh no! We receive something not implemented
+            log.warning(f"Not implemented {message}")
+            return False
+        end = bool(await handler(message))
+        if self.profiler is not None:
+            elapsed = time.perf_counter() - start
+            self.profiler.record_handler(message["type"], elapsed)
+        return end
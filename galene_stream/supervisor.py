@@ -0,0 +1,503 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Supervisor sharding bridges across worker processes.
+
+Each worker runs its share of bridges in its own interpreter and event loop,
+pinned to its own CPU cores, so that signaling and encoders of many bridges
+do not contend on one interpreter. Crashed workers are restarted, and their
+statistics are aggregated on a local control socket.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from galene_stream.cli import (
+    available_cpus,
+    check_options,
+    create_admission,
+    create_gateway,
+)
+from galene_stream.cli import get_parser as get_cli_parser
+from galene_stream.cli import set_record_dirs, setup_logging
+from galene_stream.config import load_bridges
+from galene_stream.gateway import collect_metrics, run_bridges
+from galene_stream.metrics import MetricsExporter, Sample
+
+log = logging.getLogger(__name__)
+
+#: Workers are spawned, so that they do not inherit the supervisor event loop
+mp = multiprocessing.get_context("spawn")
+
+
+def shard(names: List[str], workers: int) -> List[List[str]]:
+    """Distribute bridges across workers.
+
+    :param names: bridge names
+    :type names: list of str
+    :param workers: number of workers
+    :type workers: int
+    :return: bridge names of each worker, empty workers are omitted
+    :rtype: list
+    """
+    shards: List[List[str]] = [[] for _ in range(workers)]
+    for i, name in enumerate(names):
+        shards[i % workers].append(name)
+    return [s for s in shards if s]
+
+
+def split_cpus(cpus: List[int], workers: int) -> List[List[int]]:
+    """Split CPU cores in contiguous sets, one per worker.
+
+    When there are more workers than cores, cores are shared.
+
+    :param cpus: available CPU cores
+    :type cpus: list of int
+    :param workers: number of workers
+    :type workers: int
+    :return: CPU cores of each worker
+    :rtype: list
+    """
+    cpus = sorted(cpus)
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    size, extra = divmod(len(cpus), workers)
+    sets, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cpus[start:end])
+        start = end
+    return sets
+
+
+def run_worker(
+    name: str,
+    bridges: Dict[str, argparse.Namespace],
+    cpus: List[int],
+    conn,
+    debug: bool = False,
+) -> None:
+    """Run bridges of one worker, answering statistics requests.
+
+    :param name: worker name, used in logs
+    :type name: str
+    :param bridges: options of each bridge, indexed by bridge name
+    :type bridges: dict
+    :param cpus: CPU cores to run on, encoder threads are created after
+        pinning so they inherit it
+    :type cpus: list of int
+    :param conn: pipe end receiving statistics requests
+    :type conn: multiprocessing.connection.Connection
+    :param debug: show debug messages
+    :type debug: bool, optional
+    """
+    setup_logging(debug, f"{name} ")
+    # Terminating a worker closes its bridges as Ctrl-C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    admission = create_admission(next(iter(bridges.values())))
+    clients = create_gateway(bridges, admission)
+
+    def answer_stats() -> None:
+        """Send metrics of all bridges to supervisor."""
+        try:
+            conn.recv()
+        except EOFError:
+            event_loop.remove_reader(conn.fileno())  # supervisor is gone
+            return
+        conn.send(collect_metrics(clients))
+
+    event_loop.add_reader(conn.fileno(), answer_stats)
+    try:
+        event_loop.run_until_complete(run_bridges(clients, admission))
+    except KeyboardInterrupt:
+        for client in clients.values():
+            event_loop.run_until_complete(client.close())
+
+
+class Worker:
+    """Worker process running a share of bridges."""
+
+    def __init__(
+        self,
+        index: int,
+        bridges: Dict[str, argparse.Namespace],
+        cpus: List[int],
+        debug: bool = False,
+        target: Callable = run_worker,
+    ) -> None:
+        """Init Worker.
+
+        :param index: worker index
+        :type index: int
+        :param bridges: options of each bridge, indexed by bridge name
+        :type bridges: dict
+        :param cpus: CPU cores to run on
+        :type cpus: list of int
+        :param debug: show debug messages
+        :type debug: bool, optional
+        :param target: function run in worker process, with the arguments of
+            :func:`run_worker`
+        :type target: callable, optional
+        """
+        self.index = index
+        self.bridges = bridges
+        self.cpus = cpus
+        self.debug = debug
+        self.target = target
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.conn = None
+        self.conn_lock: Optional[asyncio.Lock] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = Supervisor.min_backoff
+        self.restart_at: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        """Worker name.
+
+        :return: name used in logs
+        :rtype: str
+        """
+        return f"worker{self.index}"
+
+    def start(self) -> None:
+        """Start worker process, releasing previous one if it crashed."""
+        self.stop(0)
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(
+            target=self.target,
+            args=(self.name, self.bridges, self.cpus, child_conn, self.debug),
+            name=self.name,
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        log.info(
+            f"Started {self.name} (pid {self.process.pid}) on CPU {self.cpus} "
+            f"with bridges {', '.join(self.bridges)}"
+        )
+
+    def is_alive(self) -> bool:
+        """Check whether worker process is running.
+
+        :return: True if running
+        :rtype: bool
+        """
+        return self.process is not None and self.process.is_alive()
+
+    async def collect_metrics(self, timeout: float) -> List[Sample]:
+        """Ask worker for metrics of its bridges, without blocking event loop.
+
+        :param timeout: time to wait for an answer in seconds
+        :type timeout: float
+        :return: metrics samples, empty if worker did not answer
+        :rtype: list
+        """
+        if self.conn_lock is None:
+            self.conn_lock = asyncio.Lock()
+        async with self.conn_lock:  # one request at a time on the pipe
+            conn = self.conn
+            if not self.is_alive() or conn is None:
+                return []
+            event_loop = asyncio.get_event_loop()
+            answer = event_loop.create_future()
+
+            def on_readable() -> None:
+                """Receive answer once worker wrote it."""
+                try:
+                    samples = conn.recv()
+                except (EOFError, OSError):
+                    samples = None
+                if not answer.done():
+                    answer.set_result(samples)
+
+            try:
+                # Drop late answers to earlier requests
+                while conn.poll():
+                    conn.recv()
+                conn.send("metrics")
+                event_loop.add_reader(conn.fileno(), on_readable)
+                try:
+                    samples = await asyncio.wait_for(answer, timeout)
+                finally:
+                    event_loop.remove_reader(conn.fileno())
+                if samples is not None:
+                    return samples
+            except (EOFError, OSError, asyncio.TimeoutError):
+                pass
+        log.warning(f"{self.name} did not send its metrics")
+        return []
+
+    def stop(self, timeout: float) -> None:
+        """Stop worker, killing it if it does not stop in time.
+
+        :param timeout: time to wait for bridges to close in seconds
+        :type timeout: float
+        """
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        if self.process.is_alive():
+            log.warning(f"Killing {self.name}")
+            self.process.kill()
+            self.process.join()
+        self.process.close()
+        if self.conn is not None:
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+
+class Supervisor:
+    """Run bridges in worker processes and restart them when they crash."""
+
+    #: First delay before restarting a worker, in seconds
+    min_backoff = 1.0
+    #: Maximum delay before restarting a worker, in seconds
+    max_backoff = 60.0
+    #: Time between two checks of workers, in seconds
+    check_interval = 1.0
+    #: Time to wait for metrics of a worker, in seconds
+    stats_timeout = 2.0
+    #: Time to wait for a worker to close its bridges, in seconds
+    stop_timeout = 10.0
+
+    def __init__(
+        self,
+        bridges: Dict[str, argparse.Namespace],
+        workers: int,
+        control_socket: Optional[str] = None,
+        debug: bool = False,
+    ) -> None:
+        """Init Supervisor.
+
+        :param bridges: options of each bridge, indexed by bridge name
+        :type bridges: dict
+        :param workers: maximum number of worker processes
+        :type workers: int
+        :param control_socket: path of a Unix socket serving statistics,
+            if None it is disabled
+        :type control_socket: str, optional
+        :param debug: show debug messages
+        :type debug: bool, optional
+        """
+        self.control_socket = control_socket
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.stopping = False
+
+        cpus = list(range(os.cpu_count() or 1))
+        if hasattr(os, "sched_getaffinity"):
+            cpus = list(os.sched_getaffinity(0))
+        shards = shard(list(bridges), workers)
+        cpu_sets = split_cpus(cpus, len(shards))
+        self.workers = [
+            Worker(i, {n: bridges[n] for n in names}, cpu_sets[i], debug)
+            for i, names in enumerate(shards)
+        ]
+
+    async def get_stats(self) -> dict:
+        """Get state of workers and metrics of their bridges.
+
+        :return: statistics, serializable to JSON
+        :rtype: dict
+        """
+        workers = []
+        for worker in self.workers:
+            workers.append(
+                {
+                    "name": worker.name,
+                    "pid": worker.process.pid if worker.process else None,
+                    "alive": worker.is_alive(),
+                    "cpus": worker.cpus,
+                    "bridges": list(worker.bridges),
+                    "restarts": worker.restarts,
+                    "uptime": (
+                        time.monotonic() - worker.started_at
+                        if worker.is_alive()
+                        else 0.0
+                    ),
+                }
+            )
+        return {"workers": workers, "metrics": await self.collect_metrics()}
+
+    async def collect_metrics(self) -> List[Sample]:
+        """Collect metrics of all workers, labelled by worker name.
+
+        Workers are asked concurrently, so that a hung worker delays
+        collection by at most :attr:`stats_timeout`.
+
+        :return: metrics samples
+        :rtype: list
+        """
+        answers = await asyncio.gather(
+            *(w.collect_metrics(self.stats_timeout) for w in self.workers)
+        )
+        samples: List[Sample] = []
+        for worker, worker_samples in zip(self.workers, answers):
+            labels = {"worker": worker.name}
+            samples.append(("galene_stream_worker_up", labels, int(worker.is_alive())))
+            samples.append(
+                ("galene_stream_worker_restarts_total", labels, worker.restarts)
+            )
+            for metric, sample_labels, value in worker_samples:
+                samples.append((metric, {**labels, **sample_labels}, value))
+        return samples
+
+    async def handle_control(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer commands received on control socket, one per line.
+
+        Only the ``stats`` command is supported, answered by a JSON line.
+
+        :param reader: control connection reader
+        :type reader: asyncio.StreamReader
+        :param writer: control connection writer
+        :type writer: asyncio.StreamWriter
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode().strip()
+                if command == "stats":
+                    answer = await self.get_stats()
+                else:
+                    answer = {"error": f"unknown command {command}"}
+                writer.write(json.dumps(answer).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def check_workers(self) -> None:
+        """Restart crashed workers, with a delay growing while they crash."""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None or worker.is_alive():
+                continue
+            exitcode = worker.process.exitcode
+            if exitcode == 0:
+                log.info(f"{worker.name} stopped, all its bridges ended")
+                worker.stop(0)
+                continue
+            if worker.restart_at is None:
+                # Reset backoff if worker was stable
+                if now - worker.started_at > self.max_backoff:
+                    worker.backoff = self.min_backoff
+                log.error(
+                    f"{worker.name} exited with code {exitcode}, "
+                    f"restarting in {worker.backoff:.0f}s"
+                )
+                worker.restart_at = now + worker.backoff
+                worker.backoff = min(2 * worker.backoff, self.max_backoff)
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                worker.start()
+
+    async def run(self) -> None:
+        """Start workers and supervise them until they all stop."""
+        for worker in self.workers:
+            worker.start()
+        if self.control_socket:
+            if os.path.exists(self.control_socket):
+                os.unlink(self.control_socket)  # left by a previous run
+            self.server = await asyncio.start_unix_server(
+                self.handle_control, self.control_socket
+            )
+            log.info(f"Serving statistics on {self.control_socket}")
+        while any(w.process is not None for w in self.workers):
+            self.check_workers()
+            await asyncio.sleep(self.check_interval)
+
+    async def close(self) -> None:
+        """Stop control socket and all workers."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            os.unlink(self.control_socket)
+            self.server = None
+        for worker in self.workers:
+            worker.stop(self.stop_timeout)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Get command-line arguments parser of the supervisor.
+
+    :return: arguments parser, with bridge options as defaults for bridges
+    :rtype: argparse.ArgumentParser
+    """
+    parser = get_cli_parser()
+    parser.prog = "galene-stream-supervisor"
+    parser.description = "Galène stream gateway running bridges in workers."
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes, default to one per CPU core",
+    )
+    parser.add_argument(
+        "--control-socket",
+        help="Serve workers statistics on this Unix socket, disabled by default",
+    )
+    return parser
+
+
+def main():
+    """Entrypoint."""
+    parser = get_parser()
+    options = parser.parse_args()
+    setup_logging(options.debug, "supervisor ")
+    if not options.config:
+        parser.error("the following arguments are required: -c/--config")
+
+    # Command-line options are defaults for bridges in configuration file
+    parser.set_defaults(**{k: v for k, v in vars(options).items() if v})
+    bridges = load_bridges(options.config, parser)
+    for bridge_options in bridges.values():
+        check_options(parser, bridge_options)
+    set_record_dirs(bridges)
+
+    supervisor = Supervisor(
+        bridges,
+        options.workers or available_cpus(),
+        options.control_socket,
+        options.debug,
+    )
+    event_loop = asyncio.get_event_loop()
+    exporter = None
+    if options.metrics_port:
+        exporter = MetricsExporter(supervisor.collect_metrics)
+        event_loop.run_until_complete(
+            exporter.start(options.metrics_host, options.metrics_port)
+        )
+    try:
+        event_loop.run_until_complete(supervisor.run())
+    except KeyboardInterrupt:
+        sys.exit(1)
+    finally:
+        event_loop.run_until_complete(supervisor.close())
+        if exporter is not None:
+            event_loop.run_until_complete(exporter.close())
+
+
+if __name__ == "__main__":
+    main()
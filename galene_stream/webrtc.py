@@ -9,8 +9,10 @@ import asyncio
 import logging
 import os
 import pprint
-import sys
-from typing import List
+import threading
+import time
+import urllib.parse
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import gi
 
@@ -21,8 +23,1212 @@ gi.require_version("GstSdp", "1.0")
 
 from gi.repository import Gst, GstSdp, GstWebRTC
 
+from galene_stream.bitrate import BitrateController
+from galene_stream.codecs import (
+    PASSTHROUGH_CAPS,
+    VIDEO_CODECS,
+    encoder_desc,
+    opus_desc,
+    preprocess_desc,
+    queue_desc,
+    sdp_accepts,
+)
+from galene_stream.ingest import (
+    INGEST_PROFILES,
+    IngestDelay,
+    ingest_report,
+    source_properties,
+)
+from galene_stream.latency import LatencyTracer
+from galene_stream.metrics import Sample
+from galene_stream.profiler import Profiler, element_key
+
 log = logging.getLogger(__name__)
 
+NEEDED_PLUGINS = [
+    "nice",
+    "webrtc",
+    "dtls",
+    "srtp",
+    "rtp",
+    "rtpmanager",
+]
+
+_checked_plugins: Set[str] = set()
+_registry_cookie: Optional[int] = None
+
+
+def pattern_source_desc(uri: str, kinds: Tuple[str, ...] = ("video", "audio")) -> str:
+    """Get description of a live test source, e.g. to load test gateways.
+
+    Test source is set using ``test:`` URI, with optional ``width``,
+    ``height``, ``framerate``, ``pattern`` and ``audio`` parameters, such as
+    ``test:?width=1920&height=1080&audio=0``.
+
+    :param uri: test source URI
+    :type uri: str
+    :param kinds: media kinds to generate
+    :type kinds: tuple of str, optional
+    :return: GStreamer description of test source
+    :rtype: str
+    """
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(uri).query)
+    params = {k: v[-1] for k, v in query.items()}
+    sources = []
+    if "video" in kinds:
+        sources.append(
+            f"videotestsrc is-live=true pattern={params.get('pattern', 'ball')} ! "
+            f"video/x-raw,width={params.get('width', 1280)},"
+            f"height={params.get('height', 720)},"
+            f"framerate={params.get('framerate', 30)}/1"
+        )
+    if "audio" in kinds and params.get("audio", "1") != "0":
+        sources.append("audiotestsrc is-live=true wave=ticks")
+    return " ".join(sources)
+
+
+#: Local ingest sources, by URI scheme, with the plugins they need
+LOCAL_SOURCES = {
+    # Frames serialized with gdppay into a shmsink
+    "shm": (
+        "shmsrc socket-path={path} is-live=true do-timestamp=true ! gdpdepay",
+        ["shm", "gdp"],
+    ),
+    # Frames passed as memfd or dmabuf file descriptors, since GStreamer 1.24
+    "unixfd": ("unixfdsrc socket-path={path}", ["unixfd"]),
+    # Any container written to an inherited file descriptor, such as a pipe
+    "fd": ("fdsrc fd={path}", ["coreelements"]),
+}
+#: Local sources which cannot be reopened once ended, such as a pipe
+ONE_SHOT_SOURCES = ["fd"]
+
+
+def local_source_desc(uri: str, caps: Optional[str] = None) -> str:
+    """Get description of a local ingest source.
+
+    Video and audio may be sent on the same source, or audio on a second
+    source given as ``audio`` parameter, such as
+    ``shm:///tmp/video?audio=/tmp/audio``. Each source is decoded by a
+    decodebin named ``dec0`` and ``dec1``.
+
+    :param uri: local source URI, one of :data:`LOCAL_SOURCES` schemes
+    :type uri: str
+    :param caps: caps where decoding stops, if None media is fully decoded
+    :type caps: str, optional
+    :return: GStreamer description of local source
+    :rtype: str
+    """
+    url = urllib.parse.urlsplit(uri)
+    source = LOCAL_SOURCES[url.scheme][0]
+    paths = [url.netloc + url.path]
+    paths += urllib.parse.parse_qs(url.query).get("audio", [])[-1:]
+    decodebin = "decodebin" if caps is None else f'decodebin caps="{caps}"'
+    return " ".join(
+        f"{source.format(path=path)} ! {decodebin} name=dec{i}"
+        for i, path in enumerate(paths)
+    )
+
+
+def init_gstreamer(plugins: Optional[List[str]] = None) -> None:
+    """Initialize GStreamer and check available plugins.
+
+    GStreamer is only initialized once per process, so that many clients can
+    share the same GStreamer initialization. Each plugin is only checked once,
+    until the registry changes.
+
+    :param plugins: GStreamer plugins needed in addition to base plugins
+    :type plugins: list of str, optional
+    :raises RuntimeError: if some GStreamer plugins are missing
+    """
+    global _registry_cookie
+    start = time.monotonic()
+    if not Gst.is_initialized():
+        # If gstreamer debug level is undefined, show warnings and errors
+        if "GST_DEBUG" not in os.environ:
+            os.environ["GST_DEBUG"] = "2"
+        Gst.init(None)
+
+    # Registry cookie changes when plugins are added or removed
+    registry = Gst.Registry.get()
+    cookie = registry.get_feature_list_cookie()
+    if cookie != _registry_cookie:
+        _checked_plugins.clear()
+        _registry_cookie = cookie
+
+    needed = NEEDED_PLUGINS + (plugins or [])
+    needed = [p for p in needed if p not in _checked_plugins]
+    if not needed:
+        return
+    missing = [p for p in needed if registry.find_plugin(p) is None]
+    if missing:
+        log.error(f"Missing gstreamer plugins: {missing}")
+        raise RuntimeError("missing gstreamer plugins")
+    _checked_plugins.update(needed)
+    elapsed = (time.monotonic() - start) * 1000
+    log.debug(f"GStreamer initialized and {needed} checked in {elapsed:.0f}ms")
+
+
+def get_source_stats(webrtc: Gst.Element) -> List[Gst.Structure]:
+    """Get RTP statistics of each SSRC of a webrtcbin.
+
+    :param webrtc: the webrtcbin
+    :type webrtc: Gst.Element
+    :return: statistics of each source
+    :rtype: list of Gst.Structure
+    """
+    # Session names come from a counter shared by the whole process, so the
+    # session is asked to the rtpbin of this webrtcbin
+    rtpbin = webrtc.get_by_name("rtpbin")
+    session = rtpbin.emit("get-session", 0) if rtpbin is not None else None
+    if session is None:
+        return []
+    stats = session.get_property("stats")
+    sources_stats = stats.get_value("source-stats")
+    return [s for s in sources_stats if s.get_value("ssrc") != 0]
+
+
+# Stages traced by latency instrumentation, as media kind, stage name, previous
+# stage name, element name and pad where buffers leave the stage
+PIPELINE_STAGES = [
+    ("video", "decoded", None, "vin", "src"),
+    ("video", "converted", "decoded", "vconv", "src"),
+    ("video", "encoded", "converted", "vtee", "sink"),
+    ("audio", "decoded", None, "ain", "src"),
+    ("audio", "converted", "decoded", "aresample", "src"),
+    ("audio", "encoded", "converted", "atee", "sink"),
+]
+OUTPUT_STAGES = [
+    ("video", "payloaded", "encoded", "vpay", "src"),
+    ("audio", "payloaded", "encoded", "apay", "src"),
+]
+
+
+class MediaPipeline:
+    """Decode input and encode it once for one or many WebRTC outputs.
+
+    Encoded streams end in ``tee`` elements, so that many ``webrtcbin`` can be
+    attached to the same encoders. Each output only costs RTP packetization,
+    DTLS and SRTP.
+    """
+
+    #: Time to wait before restarting a lost input, in seconds
+    input_retry_delay = 1.0
+    #: Bounded queues between stages, with their size in buffers
+    stage_queues = [("vinq", 4), ("vencq", 2), ("ainq", 10)]
+    #: Time without overload before raising back degraded framerate, in seconds
+    recover_delay = 10.0
+    #: Minimum framerate when degrading
+    min_framerate = 5
+    #: Encoded media buffered before recording, in nanoseconds
+    record_queue_time = 2 * Gst.SECOND
+    #: Size of file write buffer when recording, in bytes
+    record_buffer_size = 1 << 20
+    #: Time to wait for last recorded segment to be written, in seconds
+    record_finalize_timeout = 2.0
+
+    def __init__(
+        self,
+        input_uri: str,
+        bitrate: int,
+        codec: str = "vp8",
+        encoder_preset: Optional[str] = None,
+        encoder_threads: Optional[int] = None,
+        keyframe_interval: Optional[int] = None,
+        bitrate_controller: Optional[BitrateController] = None,
+        temporal_layers: int = 1,
+        latency_tracer: Optional[LatencyTracer] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        framerate: Optional[int] = None,
+        overload_policy: str = "drop",
+        record_dir: Optional[str] = None,
+        record_segment: int = 600,
+        record_max_files: int = 0,
+        kinds: Tuple[str, ...] = ("video", "audio"),
+        audio_encoder: Optional[Tuple[str, str]] = None,
+        profiler: Optional[Profiler] = None,
+        ingest_profile: str = "default",
+    ) -> None:
+        """Init MediaPipeline.
+
+        :param input_uri: URI for GStreamer uridecodebin, ``test:`` for
+            a live test source, or a local source of :data:`LOCAL_SOURCES`
+        :type input_uri: str
+        :param bitrate: video encoder bitrate in bit/s
+        :type bitrate: int
+        :param codec: video codec, one of :data:`VIDEO_CODECS` keys
+        :type codec: str, optional
+        :param encoder_preset: video encoder preset, one of
+            :data:`ENCODER_PRESETS`
+        :type encoder_preset: str, optional
+        :param encoder_threads: number of video encoder threads
+        :type encoder_threads: int, optional
+        :param keyframe_interval: maximum distance between keyframes in frames
+        :type keyframe_interval: int, optional
+        :param bitrate_controller: controller adapting video bitrate to RTCP
+            feedback, if None bitrate is static
+        :type bitrate_controller: BitrateController, optional
+        :param temporal_layers: number of video temporal layers, so that the SFU
+            can forward a lower framerate to constrained receivers
+        :type temporal_layers: int, optional
+        :param latency_tracer: tracer measuring latency added by each stage,
+            if None pipeline is not instrumented
+        :type latency_tracer: LatencyTracer, optional
+        :param width: output video width, if None input width is kept
+        :type width: int, optional
+        :param height: output video height, if None input height is kept
+        :type height: int, optional
+        :param framerate: maximum output framerate, frames above are dropped
+        :type framerate: int, optional
+        :param overload_policy: behaviour of queues between stages when they
+            are full, one of :data:`OVERLOAD_POLICIES`
+        :type overload_policy: str, optional
+        :param record_dir: directory where encoded streams are recorded, if
+            None streams are not recorded
+        :type record_dir: str, optional
+        :param record_segment: duration of recorded segments in seconds
+        :type record_segment: int, optional
+        :param record_max_files: number of segments to keep, 0 to keep all
+        :type record_max_files: int, optional
+        :param kinds: media kinds to publish, "video" and/or "audio"
+        :type kinds: tuple of str, optional
+        :param audio_encoder: Opus encoder and payloader descriptions, given
+            by :func:`galene_stream.codecs.opus_desc`
+        :type audio_encoder: tuple, optional
+        :param profiler: profiler measuring processing time of each element,
+            if None pipeline is not profiled
+        :type profiler: Profiler, optional
+        :param ingest_profile: buffering of network inputs, one of
+            :data:`galene_stream.ingest.INGEST_PROFILES` keys
+        :type ingest_profile: str, optional
+        """
+        self.event_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.input_uri = input_uri
+        self.pipe = None
+        self.source = None
+        self.outputs: List[Gst.Bin] = []
+        self.kinds = kinds
+        self.frames = {kind: 0 for kind in kinds}
+        self.input_frames = 0
+        self.overload_policy = overload_policy
+        self.max_framerate = framerate
+        self.framerate = framerate
+        self.degraded_at = 0.0
+        self.record_dir = record_dir
+        self.record_segment = record_segment
+        self.record_max_files = record_max_files
+        self.recorder: Optional[Gst.Bin] = None
+        # Recorders being stopped, set once their last segment is written
+        self.record_closing: Dict[Gst.Element, threading.Event] = {}
+        self.latency_tracer = latency_tracer
+        self.profiler = profiler
+        # Elements with profiling probes, as elements of a bin added to the
+        # pipeline are both walked and announced by deep-element-added
+        self.profiled: Set[Gst.Element] = set()
+        self.profiled_lock = threading.Lock()
+        self.bitrate_task: Optional[asyncio.Task] = None
+        self.video_codec = VIDEO_CODECS[codec]
+        self.dropped = {
+            name: 0
+            for name, _ in self.stage_queues
+            if name[0] in self.prefixes and self.queue_policy(name) != "block"
+        }
+        # Ingest delay is only measured to drop stale buffers, or to report
+        # it with latency instrumentation, as it costs a probe per buffer
+        self.ingest_profile = INGEST_PROFILES[ingest_profile]
+        self.ingest_delays: Dict[str, IngestDelay] = {}
+        for kind in kinds:
+            max_lag = self.ingest_profile.max_lag
+            if kind == "video" and not self.video_codec.decode:
+                max_lag = None  # dropping encoded video would break frames
+            if max_lag is not None or latency_tracer is not None:
+                self.ingest_delays[kind] = IngestDelay(max_lag)
+        if temporal_layers > 1 and not self.video_codec.temporal_layers:
+            log.warning("Temporal layers are not supported with this codec")
+            temporal_layers = 1
+        if temporal_layers > 1 and bitrate_controller:
+            log.warning("Adaptive bitrate is not supported with temporal layers")
+            bitrate_controller = None
+        if "video" not in kinds and bitrate_controller:
+            bitrate_controller = None
+        self.temporal_layers = temporal_layers
+        self.bitrate_controller = bitrate_controller
+        self.max_bitrate = (
+            bitrate_controller.max_bitrate if bitrate_controller else bitrate
+        )
+
+        # Without decoding, uridecodebin must stop at encoded video
+        # Media kinds which are not published are not exposed nor encoded
+        plugins = []
+        caps = None
+        if "video" in kinds:
+            plugins += self.video_codec.plugins
+            if not self.video_codec.decode:
+                caps = PASSTHROUGH_CAPS
+        if "audio" in kinds:
+            plugins += ["opus"]
+        if "video" not in kinds:
+            caps = "audio/x-raw"
+        elif "audio" not in kinds:
+            caps = "video/x-raw" if self.video_codec.decode else "video/x-h264"
+        scheme = urllib.parse.urlsplit(input_uri).scheme
+        self.source_desc = f'uridecodebin uri="{input_uri}"'
+        if caps is not None:
+            self.source_desc += f' caps="{caps}" expose-all-streams=false'
+        if self.ingest_profile.decodebin:
+            self.source_desc += f" {self.ingest_profile.decodebin}"
+        if input_uri.startswith("test:"):
+            self.source_desc = pattern_source_desc(input_uri, kinds)
+            plugins += ["videotestsrc"] if "video" in kinds else []
+            plugins += ["audiotestsrc"] if "audio" in kinds else []
+        elif scheme in LOCAL_SOURCES:
+            self.source_desc = local_source_desc(input_uri, caps)
+            plugins += LOCAL_SOURCES[scheme][1] + ["playback"]
+
+        # Input is linked to vin and ain, so that it can be restarted alone
+        # Bounded queues run each stage in its own thread
+        queues = {
+            name: queue_desc(name, size, self.queue_policy(name))
+            for name, size in self.stage_queues
+        }
+        pipeline = []
+        output = ["webrtcbin name=send bundle-policy=max-bundle"]
+        if "video" in kinds:
+            video_convert = ""
+            if self.video_codec.decode:
+                video_convert = preprocess_desc(width, height, framerate)
+                if overload_policy == "degrade" and not framerate:
+                    # Framerate is lowered under load
+                    vrate = "videorate name=vrate drop-only=true ! "
+                    video_convert = vrate + video_convert
+                video_convert += "videoconvert name=vconv ! "
+                if framerate or overload_policy == "degrade":
+                    plugins += ["videorate"]
+                if width or height:
+                    plugins += ["videoscale"]
+            elif width or height or framerate:
+                log.warning("Video is not scaled nor rate limited without decoding")
+            video_encoder = encoder_desc(
+                self.video_codec,
+                bitrate,
+                encoder_preset,
+                encoder_threads,
+                keyframe_interval,
+                temporal_layers,
+            )
+            video_payloader = self.video_codec.payloader
+            if temporal_layers > 1:
+                # Picture ID lets the SFU detect frames of dropped layers
+                video_payloader += " picture-id-mode=15-bit"
+            pipeline.append(
+                "identity name=vin silent=true ! valve name=vvalve ! "
+                f"{queues['vinq']} ! {video_convert}"
+                f"{queues['vencq']} ! {video_encoder} ! "
+                "tee name=vtee allow-not-linked=true"
+            )
+            output.append(f"queue name=vqueue ! {video_payloader} name=vpay ! send.")
+        if "audio" in kinds:
+            audio_encoder, audio_payloader = audio_encoder or opus_desc()
+            pipeline.append(
+                f"identity name=ain silent=true ! {queues['ainq']} ! "
+                "audioconvert name=aconv ! audioresample name=aresample ! "
+                f"{audio_encoder} ! tee name=atee allow-not-linked=true"
+            )
+            output.append(f"queue name=aqueue ! {audio_payloader} name=apay ! send.")
+        self.pipeline_desc = " ".join(pipeline)
+        self.output_desc = " ".join(output)
+
+        if record_dir is not None:
+            plugins = plugins + ["matroska", "multifile"]
+        init_gstreamer(plugins)
+        if bitrate_controller and not self.video_codec.bitrate_property[0]:
+            log.warning("Adaptive bitrate is not supported with this codec")
+            self.bitrate_controller = None
+
+    @property
+    def prefixes(self) -> List[str]:
+        """Prefixes of element names of each published media kind.
+
+        :return: "v" for video and "a" for audio
+        :rtype: list of str
+        """
+        return [kind[0] for kind in self.kinds]
+
+    def queue_policy(self, name: str) -> str:
+        """Get overload policy of a queue between stages.
+
+        :param name: queue name, one of :attr:`stage_queues`
+        :type name: str
+        :return: overload policy, one of :data:`OVERLOAD_POLICIES`
+        :rtype: str
+        """
+        if name[0] == "v" and not self.video_codec.decode:
+            # Passthrough video is encoded, a dropped buffer would corrupt
+            # every frame referencing it until next keyframe
+            return "block"
+        return self.overload_policy
+
+    def create_output(self) -> Gst.Bin:
+        """Create a new WebRTC output.
+
+        The output is not attached to the pipeline yet, so that signals can be
+        connected before attaching it with :meth:`add_output`.
+
+        :return: output bin containing a webrtcbin named ``send``
+        :rtype: Gst.Bin
+        """
+        output = Gst.parse_bin_from_description(self.output_desc, False)
+        for kind in self.prefixes:
+            queue = output.get_by_name(f"{kind}queue")
+            pad = Gst.GhostPad.new(f"{kind}sink", queue.get_static_pad("sink"))
+            output.add_pad(pad)
+        return output
+
+    def start(self) -> None:
+        """Start decoding and encoding input, without any output."""
+        if self.pipe is not None:
+            return
+        log.info("Starting pipeline")
+        self.event_loop = asyncio.get_event_loop()
+        self.pipe = Gst.parse_launch(self.pipeline_desc)
+        self.pipe.get_bus().set_sync_handler(self.on_bus_message)
+        for kind in self.kinds:
+            pad = self.pipe.get_by_name(f"{kind[0]}tee").get_static_pad("sink")
+            pad.add_probe(Gst.PadProbeType.BUFFER, self.on_frame, kind)
+            pad = self.pipe.get_by_name(f"{kind[0]}in").get_static_pad("sink")
+            pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_input_event, kind)
+            if kind in self.ingest_delays:
+                pad.add_probe(Gst.PadProbeType.BUFFER, self.on_input_buffer, kind)
+        for name in self.dropped:
+            queue = self.pipe.get_by_name(name)
+            queue.connect("overrun", self.on_queue_overrun)
+        if "video" in self.kinds:
+            pad = self.pipe.get_by_name("vencq").get_static_pad("sink")
+            pad.add_probe(Gst.PadProbeType.BUFFER, self.on_encoder_input)
+        if self.latency_tracer is not None:
+            self.trace_latency(self.pipe, self.pipeline_stages())
+        if self.profiler is not None:
+            # Source, outputs and webrtcbin internals are added later
+            self.profile_bin(self.pipe)
+            self.pipe.connect("deep-element-added", self.on_element_added)
+
+        self.add_source()
+        if self.record_dir is not None:
+            self.add_recorder()
+        self.pipe.set_state(Gst.State.PLAYING)
+        if self.bitrate_controller is not None:
+            self.bitrate_task = asyncio.ensure_future(self.adapt_bitrate())
+
+    def add_source(self) -> None:
+        """Add a new input source to the pipeline."""
+        if self.pipe is None or self.source is not None:
+            return
+        scheme = urllib.parse.urlsplit(self.input_uri).scheme
+        if scheme == "test":
+            # Test sources have static pads, exposed as ghost pads
+            self.source = Gst.parse_bin_from_description(self.source_desc, True)
+        elif scheme in LOCAL_SOURCES:
+            # Decoded pads are exposed when decodebin adds them
+            self.source = Gst.parse_bin_from_description(self.source_desc, False)
+            for i in range(2):
+                decodebin = self.source.get_by_name(f"dec{i}")
+                if decodebin is not None:
+                    decodebin.connect("pad-added", self.on_decoder_pad_added)
+        else:
+            self.source = Gst.parse_launch(self.source_desc)
+            self.source.connect("source-setup", self.on_source_setup)
+        self.source.connect("pad-added", self.on_source_pad_added)
+        self.pipe.add(self.source)
+        for pad in self.source.srcpads:
+            self.on_source_pad_added(self.source, pad)
+        self.source.sync_state_with_parent()
+
+    def on_decoder_pad_added(self, decodebin: Gst.Element, pad: Gst.Pad) -> None:
+        """Expose new pad of a decodebin on its source bin.
+
+        :param decodebin: decodebin of a local source
+        :type decodebin: Gst.Element
+        :param pad: new pad of decodebin
+        :type pad: Gst.Pad
+        """
+        ghost = Gst.GhostPad.new(None, pad)
+        ghost.set_active(True)
+        decodebin.get_parent().add_pad(ghost)
+
+    def restart_source(self, source: Gst.Element) -> None:
+        """Replace failed input source, keeping encoders and outputs running.
+
+        :param source: failed source
+        :type source: Gst.Element
+        """
+        if self.pipe is None or source is not self.source:
+            return  # already restarted
+        assert self.event_loop is not None
+        self.source = None
+        source.set_state(Gst.State.NULL)
+        self.pipe.remove(source)
+        if urllib.parse.urlsplit(self.input_uri).scheme in ONE_SHOT_SOURCES:
+            log.error("Input ended and cannot be reopened, not restarting it")
+            return
+        log.warning(f"Input lost, restarting it in {self.input_retry_delay}s")
+        self.event_loop.call_later(self.input_retry_delay, self.add_source)
+
+    def on_source_pad_added(self, _, pad: Gst.Pad) -> None:
+        """Link new input pad to video or audio chain.
+
+        :param pad: new pad of input source
+        :type pad: Gst.Pad
+        """
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        name = caps.get_structure(0).get_name()
+        kind = name.split("/")[0]
+        if kind not in self.kinds or self.pipe is None:
+            return
+        sink = self.pipe.get_by_name(f"{kind[0]}in").get_static_pad("sink")
+        if not sink.is_linked():
+            pad.link(sink)
+
+    def on_source_setup(self, _, source: Gst.Element) -> None:
+        """Apply ingest profile to network source, e.g. SRT latency.
+
+        :param source: source element created by uridecodebin
+        :type source: Gst.Element
+        """
+        properties = source_properties(self.input_uri, self.ingest_profile)
+        for name, value in properties.items():
+            if source.find_property(name) is not None:
+                log.debug(f"Setting {name}={value} on {source.get_name()}")
+                source.set_property(name, value)
+
+    def on_input_event(self, _, info, kind: str) -> Gst.PadProbeReturn:
+        """Restart input on end of stream, instead of ending encoders.
+
+        :param info: probe information
+        :type info: Gst.PadProbeInfo
+        :param kind: media kind, "video" or "audio"
+        :type kind: str
+        :return: probe return, dropping end of stream
+        :rtype: Gst.PadProbeReturn
+        """
+        event_type = info.get_event().type
+        if event_type == Gst.EventType.SEGMENT and kind in self.ingest_delays:
+            # Restarted input has new timestamps
+            self.ingest_delays[kind].reset()
+        if event_type != Gst.EventType.EOS:
+            return Gst.PadProbeReturn.OK
+        if self.event_loop is not None:
+            self.event_loop.call_soon_threadsafe(self.restart_source, self.source)
+        return Gst.PadProbeReturn.DROP
+
+    def on_input_buffer(self, pad: Gst.Pad, info, kind: str) -> Gst.PadProbeReturn:
+        """Measure ingest delay of input buffer, and drop it if stale.
+
+        Lag is the pipeline running time minus buffer running time. Delay is
+        relative to the earliest buffer, so that it also works with sources
+        which are not live, or live sources timestamped by their own clock.
+
+        :param pad: input pad
+        :type pad: Gst.Pad
+        :param info: probe information
+        :type info: Gst.PadProbeInfo
+        :param kind: media kind, "video" or "audio"
+        :type kind: str
+        :return: probe return, dropping stale buffers
+        :rtype: Gst.PadProbeReturn
+        """
+        clock = self.pipe.get_clock() if self.pipe else None
+        pts = info.get_buffer().pts
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if clock is None or event is None or pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        running_time = event.parse_segment().to_running_time(Gst.Format.TIME, pts)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        now = clock.get_time() - self.pipe.get_base_time()
+        lag = (now - running_time) / Gst.SECOND
+        if self.ingest_delays[kind].observe(lag, time.monotonic()):
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    def on_bus_message(self, _, message: Gst.Message) -> Gst.BusSyncReply:
+        """Handle pipeline messages, from any thread.
+
+        :param message: bus message
+        :type message: Gst.Message
+        :return: bus reply, dropping messages as nobody pops them
+        :rtype: Gst.BusSyncReply
+        """
+        if message.type == Gst.MessageType.ERROR:
+            error, _ = message.parse_error()
+            source = self.source
+            if source is not None and (
+                message.src == source or message.src.has_as_ancestor(source)
+            ):
+                log.warning(f"Input error: {error.message}")
+                if self.event_loop is not None:
+                    self.event_loop.call_soon_threadsafe(self.restart_source, source)
+            else:
+                log.error(f"Error from {message.src.get_name()}: {error.message}")
+        elif message.type == Gst.MessageType.ELEMENT:
+            structure = message.get_structure()
+            if structure.get_name() == "splitmuxsink-fragment-closed":
+                log.info(f"Recorded {structure.get_value('location')}")
+                closed = self.record_closing.get(message.src)
+                if closed is not None:
+                    closed.set()
+        return Gst.BusSyncReply.DROP
+
+    def add_output(self, output: Gst.Bin) -> None:
+        """Attach output to encoders, and start pipeline if needed.
+
+        :param output: output bin created by :meth:`create_output`
+        :type output: Gst.Bin
+        """
+        self.start()
+        assert self.pipe is not None
+        if self.latency_tracer is not None:
+            self.trace_latency(output, OUTPUT_STAGES, output)
+        self.link_tees(output)
+        self.outputs.append(output)
+
+        # New output needs a keyframe to start decoding
+        self.force_keyframe()
+
+    def remove_output(self, output: Gst.Bin, keep_running: bool = False) -> None:
+        """Detach output from encoders, and stop pipeline if it was the last.
+
+        :param output: output bin attached by :meth:`add_output`
+        :type output: Gst.Bin
+        :param keep_running: keep pipeline running without outputs, e.g. to
+            reconnect
+        :type keep_running: bool, optional
+        """
+        if output not in self.outputs:
+            return
+        self.outputs.remove(output)
+
+        if not self.outputs and not keep_running:
+            self.close()
+        else:
+            self.unlink_tees(output)
+            self.pipe.remove(output)
+            output.set_state(Gst.State.NULL)
+        if self.latency_tracer is not None:
+            # Stage times must not keep detached output alive
+            self.latency_tracer.forget(output)
+        with self.profiled_lock:
+            self.profiled.difference_update(output.iterate_recurse())
+
+    def link_tees(self, output: Gst.Bin) -> None:
+        """Add a bin to the pipeline and link it to encoders.
+
+        :param output: bin with ``vsink`` and ``asink`` pads
+        :type output: Gst.Bin
+        """
+        self.pipe.add(output)
+        for kind in self.prefixes:
+            tee = self.pipe.get_by_name(f"{kind}tee")
+            tee_pad = tee.get_request_pad("src_%u")
+            tee_pad.link(output.get_static_pad(f"{kind}sink"))
+        output.sync_state_with_parent()
+
+    def unlink_tees(self, output: Gst.Bin) -> None:
+        """Unlink a bin from encoders.
+
+        :param output: bin linked by :meth:`link_tees`
+        :type output: Gst.Bin
+        """
+        for kind in self.prefixes:
+            pad = output.get_static_pad(f"{kind}sink")
+            tee_pad = pad.get_peer()
+            if tee_pad is not None:
+                tee_pad.unlink(pad)
+                tee_pad.get_parent_element().release_request_pad(tee_pad)
+
+    def add_recorder(self) -> None:
+        """Record encoded streams in rotating segments, without re-encoding.
+
+        Leaky queues drop media rather than stalling encoders when disk is
+        slow, and files are written by blocks.
+        """
+        os.makedirs(self.record_dir, exist_ok=True)
+        prefix = time.strftime("%Y%m%d-%H%M%S")
+        extension = self.video_codec.container[1]
+        location = os.path.join(self.record_dir, f"{prefix}-%05d.{extension}")
+        self.recorder = Gst.parse_bin_from_description(
+            self.recorder_desc(location), False
+        )
+        sink = Gst.ElementFactory.make("filesink")
+        sink.set_property("buffer-mode", 0)  # full buffering
+        sink.set_property("buffer-size", self.record_buffer_size)
+        self.recorder.get_by_name("rec").set_property("sink", sink)
+        for kind in self.prefixes:
+            queue = self.recorder.get_by_name(f"r{kind}queue")
+            pad = Gst.GhostPad.new(f"{kind}sink", queue.get_static_pad("sink"))
+            self.recorder.add_pad(pad)
+        self.link_tees(self.recorder)
+        log.info(f"Recording to {location}")
+
+    def recorder_desc(self, location: str) -> str:
+        """Get description of recorder bin.
+
+        :param location: segment file names, with a ``%05d`` segment index
+        :type location: str
+        :return: GStreamer description of recorder, with a queue named
+            ``rvqueue`` or ``raqueue`` for each published media kind
+        :rtype: str
+        """
+        muxer = self.video_codec.container[0]
+        queue = (
+            "queue max-size-buffers=0 max-size-bytes=0 "
+            f"max-size-time={self.record_queue_time} leaky=downstream"
+        )
+        branches = {"v": "rec.video", "a": "rec.audio_%u"}
+        return (
+            f'splitmuxsink name=rec muxer-factory={muxer} location="{location}" '
+            f"max-size-time={self.record_segment * Gst.SECOND} "
+            f"max-files={self.record_max_files} send-keyframe-requests=true "
+            + " ".join(f"{queue} name=r{k}queue ! {branches[k]}" for k in self.prefixes)
+        )
+
+    def stop_recorder(self) -> Optional[threading.Event]:
+        """Stop recording, sending end of stream to write last segment.
+
+        :return: event set once last segment is written, or None if not
+            recording
+        :rtype: threading.Event, optional
+        """
+        if self.recorder is None:
+            return None
+        closed = threading.Event()
+        self.record_closing[self.recorder.get_by_name("rec")] = closed
+        self.unlink_tees(self.recorder)
+        for kind in self.prefixes:
+            pad = self.recorder.get_static_pad(f"{kind}sink")
+            pad.send_event(Gst.Event.new_eos())
+        self.recorder = None
+        return closed
+
+    def finalize_recording(self, pipe: Gst.Pipeline, closed: threading.Event) -> None:
+        """Stop pipeline once last recorded segment is written.
+
+        This call is blocking, so that it runs in an executor.
+
+        :param pipe: pipeline to stop
+        :type pipe: Gst.Pipeline
+        :param closed: event returned by :meth:`stop_recorder`
+        :type closed: threading.Event
+        """
+        if not closed.wait(self.record_finalize_timeout):
+            log.warning("Last recorded segment might be incomplete")
+        pipe.set_state(Gst.State.NULL)
+        for sink, event in list(self.record_closing.items()):
+            if event is closed:
+                del self.record_closing[sink]
+
+    def pipeline_stages(self) -> list:
+        """Get stages of the pipeline traced by latency instrumentation.
+
+        :return: stages of :data:`PIPELINE_STAGES` measured with this codec
+        :rtype: list
+        """
+        if self.video_codec.decode:
+            return PIPELINE_STAGES
+        # Passthrough video is not encoded, its tee only starts payloading
+        return [
+            (kind, stage, None if (kind, stage) == ("video", "encoded") else p, *el)
+            for kind, stage, p, *el in PIPELINE_STAGES
+        ]
+
+    def trace_latency(self, bin: Gst.Bin, stages: list, key=None) -> None:
+        """Add probes recording buffers leaving each stage of a bin.
+
+        :param bin: bin containing stages elements
+        :type bin: Gst.Bin
+        :param stages: stages as media kind, stage name, previous stage name,
+            element name and pad name
+        :type stages: list
+        :param key: distinguishes stages of many outputs
+        :type key: hashable, optional
+        """
+        for kind, stage, previous, element_name, pad_name in stages:
+            element = bin.get_by_name(element_name)
+            if element is None:
+                continue  # e.g. video is not converted in passthrough
+            pad = element.get_static_pad(pad_name)
+            data = (kind, stage, previous, key)
+            pad.add_probe(Gst.PadProbeType.BUFFER, self.on_traced_buffer, data)
+
+    def on_traced_buffer(self, _, info, data: tuple) -> Gst.PadProbeReturn:
+        """Record buffer leaving a stage.
+
+        :param info: probe information
+        :type info: Gst.PadProbeInfo
+        :param data: media kind, stage name, previous stage name and key
+        :type data: tuple
+        :return: probe return, always letting buffer pass
+        :rtype: Gst.PadProbeReturn
+        """
+        assert self.latency_tracer is not None
+        pts = info.get_buffer().pts
+        if pts != Gst.CLOCK_TIME_NONE:
+            self.latency_tracer.record(*data[:3], pts, data[3])
+        return Gst.PadProbeReturn.OK
+
+    def profile_bin(self, bin: Gst.Bin) -> None:
+        """Profile all elements of a bin, recursively.
+
+        :param bin: bin to profile
+        :type bin: Gst.Bin
+        """
+        for element in bin.iterate_recurse():
+            self.profile_element(element)
+
+    def on_element_added(self, _, __, element: Gst.Element) -> None:
+        """Profile an element added to the pipeline, and its children.
+
+        :param element: added element
+        :type element: Gst.Element
+        """
+        self.profile_element(element)
+        if isinstance(element, Gst.Bin):
+            self.profile_bin(element)
+
+    def profile_element(self, element: Gst.Element) -> None:
+        """Add probes measuring processing time of an element.
+
+        :param element: element to profile, bins are skipped as their
+            children are profiled
+        :type element: Gst.Element
+        """
+        if isinstance(element, Gst.Bin):
+            return
+        with self.profiled_lock:
+            if element in self.profiled:
+                return
+            self.profiled.add(element)
+        factory = element.get_factory()
+        factory_name = factory.get_name() if factory is not None else None
+        data = (element_key(element.get_name(), factory_name), factory_name == "queue")
+        for pad in element.iterate_pads():
+            self.on_profiled_pad_added(element, pad, data)
+        element.connect("pad-added", self.on_profiled_pad_added, data)
+
+    def on_profiled_pad_added(self, _, pad: Gst.Pad, data: tuple) -> None:
+        """Add profiling probe to a pad of a profiled element.
+
+        :param pad: new pad
+        :type pad: Gst.Pad
+        :param data: profiling key of element, and whether it is a queue
+        :type data: tuple
+        """
+        mask = Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST
+        key, is_queue = data
+        if pad.get_direction() == Gst.PadDirection.SINK and not is_queue:
+            pad.add_probe(mask, self.on_profiled_enter, key)
+        elif pad.get_direction() == Gst.PadDirection.SRC:
+            pad.add_probe(mask, self.on_profiled_leave, data)
+
+    def on_profiled_enter(self, _, __, key: str) -> Gst.PadProbeReturn:
+        """Record buffer entering a profiled element.
+
+        :param key: profiling key of element
+        :type key: str
+        :return: probe return, always letting buffer pass
+        :rtype: Gst.PadProbeReturn
+        """
+        assert self.profiler is not None
+        self.profiler.enter(key)
+        return Gst.PadProbeReturn.OK
+
+    def on_profiled_leave(self, pad: Gst.Pad, __, data: tuple) -> Gst.PadProbeReturn:
+        """Record buffer leaving a profiled element, or level of a queue.
+
+        :param pad: source pad of profiled element
+        :type pad: Gst.Pad
+        :param data: profiling key of element, and whether it is a queue
+        :type data: tuple
+        :return: probe return, always letting buffer pass
+        :rtype: Gst.PadProbeReturn
+        """
+        assert self.profiler is not None
+        key, is_queue = data
+        if is_queue:
+            queue = pad.get_parent_element()
+            level = queue.get_property("current-level-buffers")
+            self.profiler.record_queue(key, level)
+        else:
+            self.profiler.leave(key)
+        return Gst.PadProbeReturn.OK
+
+    def on_frame(self, _, __, kind: str) -> Gst.PadProbeReturn:
+        """Count encoded frames.
+
+        :param kind: media kind, "video" or "audio"
+        :type kind: str
+        :return: probe return, always letting buffer pass
+        :rtype: Gst.PadProbeReturn
+        """
+        self.frames[kind] += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_encoder_input(self, _, __) -> Gst.PadProbeReturn:
+        """Count video frames entering encoder, after rate limiting.
+
+        :return: probe return, always letting buffer pass
+        :rtype: Gst.PadProbeReturn
+        """
+        self.input_frames += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_queue_overrun(self, queue: Gst.Element) -> None:
+        """Count dropped buffers of a full queue, and degrade if enabled.
+
+        :param queue: full queue
+        :type queue: Gst.Element
+        """
+        if self.overload_policy == "block":
+            return  # previous stage waits, nothing is dropped
+        name = queue.get_name()
+        self.dropped[name] += 1
+        if self.overload_policy == "degrade" and name.startswith("v"):
+            assert self.event_loop is not None
+            self.event_loop.call_soon_threadsafe(self.degrade)
+
+    def get_input_framerate(self) -> Optional[int]:
+        """Get framerate of video entering rate limiter.
+
+        :return: framerate, or None if unknown
+        :rtype: int, optional
+        """
+        vrate = self.pipe.get_by_name("vrate") if self.pipe else None
+        caps = vrate.get_static_pad("sink").get_current_caps() if vrate else None
+        if caps is None:
+            return None
+        ok, num, den = caps.get_structure(0).get_fraction("framerate")
+        return num // den if ok and num and den else None
+
+    def set_framerate(self, framerate: int) -> None:
+        """Set maximum video framerate while playing.
+
+        :param framerate: maximum framerate
+        :type framerate: int
+        """
+        self.framerate = framerate
+        vrate = self.pipe.get_by_name("vrate") if self.pipe else None
+        if vrate is not None:
+            vrate.set_property("max-rate", framerate)
+
+    def degrade(self) -> None:
+        """Lower video framerate when encoders cannot keep up with input."""
+        now = time.monotonic()
+        if now - self.degraded_at < 1.0:
+            return  # give previous step time to take effect
+        self.degraded_at = now
+        if self.max_framerate is None:
+            self.max_framerate = self.get_input_framerate()
+        current = self.framerate or self.max_framerate
+        if current is None or current <= self.min_framerate:
+            return
+        framerate = max(self.min_framerate, current * 3 // 4)
+        log.warning(f"Pipeline is overloaded, lowering framerate to {framerate}")
+        self.set_framerate(framerate)
+        assert self.event_loop is not None
+        self.event_loop.call_later(self.recover_delay, self.recover)
+
+    def recover(self) -> None:
+        """Raise back degraded video framerate when load is lower."""
+        if self.pipe is None or self.framerate is None or not self.max_framerate:
+            return
+        if time.monotonic() - self.degraded_at < self.recover_delay:
+            return  # degraded again since, a later call will recover
+        framerate = min(self.max_framerate, self.framerate * 5 // 4 + 1)
+        if framerate == self.framerate:
+            return
+        log.info(f"Raising framerate back to {framerate}")
+        self.set_framerate(framerate)
+        if framerate < self.max_framerate:
+            self.event_loop.call_later(self.recover_delay, self.recover)
+
+    def get_metrics(self) -> List[Sample]:
+        """Get encoder metrics.
+
+        :return: metrics samples
+        :rtype: list
+        """
+        samples: List[Sample] = [
+            ("galene_stream_encoded_frames_total", {"kind": k}, v)
+            for k, v in self.frames.items()
+        ]
+        for name, dropped in self.dropped.items():
+            labels = {"queue": name}
+            samples.append(("galene_stream_dropped_buffers_total", labels, dropped))
+            queue = self.pipe.get_by_name(name) if self.pipe else None
+            if queue is not None:
+                level = queue.get_property("current-level-buffers")
+                samples.append(("galene_stream_queue_buffers", labels, level))
+        for kind, delay in self.ingest_delays.items():
+            labels = {"kind": kind}
+            if delay.baseline is not None:
+                samples.append(
+                    ("galene_stream_ingest_delay_seconds", labels, delay.delay)
+                )
+                samples.append(("galene_stream_ingest_lag_seconds", labels, delay.lag))
+            samples.append(
+                ("galene_stream_stale_buffers_dropped_total", labels, delay.dropped)
+            )
+        if self.latency_tracer is not None:
+            samples += self.latency_tracer.get_metrics()
+        if self.profiler is not None:
+            samples += self.profiler.get_metrics()
+        return samples
+
+    def force_keyframe(self) -> None:
+        """Ask video encoder to produce a keyframe as soon as possible.
+
+        Without decoding, the keyframe is asked to the input, such as an RTSP
+        camera, if it supports it.
+        """
+        if self.pipe is None or "video" not in self.kinds:
+            return
+        if self.video_codec.decode:
+            pad = self.pipe.get_by_name("venc").get_static_pad("src")
+        else:
+            pad = self.pipe.get_by_name("vvalve").get_static_pad("sink")
+        structure = Gst.Structure.new_from_string(
+            "GstForceKeyUnit, all-headers=(boolean)true"
+        )
+        event = Gst.Event.new_custom(Gst.EventType.CUSTOM_UPSTREAM, structure)
+        pad.send_event(event)
+
+    def get_feedback(self) -> Tuple[Optional[float], Optional[float]]:
+        """Get worst video loss and round-trip time reported by receivers.
+
+        :return: fraction of packets lost and round-trip time in seconds, or
+            None if no receiver report was received
+        :rtype: tuple
+        """
+        loss, rtt = None, None
+        for output in self.outputs:
+            for stats in get_source_stats(output.get_by_name("send")):
+                if not stats.get_value("is-sender") or not stats.get_value("have-rb"):
+                    continue
+                if stats.get_value("clock-rate") != 90000:
+                    continue  # not video
+                source_loss = stats.get_value("rb-fractionlost") / 256
+                source_rtt = stats.get_value("rb-round-trip") / 65536
+                loss = source_loss if loss is None else max(loss, source_loss)
+                rtt = source_rtt if rtt is None else max(rtt, source_rtt)
+        return loss, rtt
+
+    def set_bitrate(self, bitrate: int) -> None:
+        """Set video encoder bitrate while playing.
+
+        :param bitrate: bitrate in bit/s
+        :type bitrate: int
+        """
+        if self.pipe is None:
+            return
+        encoder = self.pipe.get_by_name("venc")
+        name, unit = self.video_codec.bitrate_property
+        if encoder is not None and name:
+            encoder.set_property(name, bitrate // unit)
+
+    def limit_bitrate(self, limit: Optional[int]) -> None:
+        """Cap video bitrate, e.g. to shed load.
+
+        :param limit: maximum bitrate in bit/s, if None the cap is removed
+        :type limit: int, optional
+        """
+        bitrate = self.max_bitrate if limit is None else min(limit, self.max_bitrate)
+        controller = self.bitrate_controller
+        if controller is not None:
+            # Adaptive bitrate keeps adapting below the cap
+            controller.max_bitrate = max(controller.min_bitrate, bitrate)
+            controller.bitrate = min(controller.bitrate, controller.max_bitrate)
+            bitrate = controller.bitrate
+        self.set_bitrate(bitrate)
+
+    def set_video_enabled(self, enabled: bool) -> None:
+        """Drop video before encoding, or send it again.
+
+        Receivers keep audio while video is dropped.
+
+        :param enabled: True to send video
+        :type enabled: bool
+        """
+        valve = self.pipe.get_by_name("vvalve") if self.pipe else None
+        if valve is None:
+            return
+        if enabled and not self.video_codec.decode:
+            # Encoded video can only resume at a keyframe
+            pad = valve.get_static_pad("src")
+            pad.add_probe(Gst.PadProbeType.BUFFER, self.on_resumed_video)
+        valve.set_property("drop", not enabled)
+        if enabled:
+            self.force_keyframe()
+
+    def on_resumed_video(self, _, info) -> Gst.PadProbeReturn:
+        """Drop encoded video resumed after a drop, until next keyframe.
+
+        :param info: probe information
+        :type info: Gst.PadProbeInfo
+        :return: probe return, dropping frames depending on dropped ones
+        :rtype: Gst.PadProbeReturn
+        """
+        if info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.REMOVE
+
+    async def adapt_bitrate(self, interval: float = 1.0) -> None:
+        """Adapt video bitrate to receivers feedback until pipeline is closed.
+
+        :param interval: time between two adaptations in seconds
+        :type interval: float, optional
+        """
+        assert self.bitrate_controller is not None
+        while self.pipe is not None:
+            await asyncio.sleep(interval)
+            loss, rtt = self.get_feedback()
+            if loss is not None:
+                self.set_bitrate(self.bitrate_controller.update(loss, rtt))
+
+    def close(self) -> None:
+        """Stop gstreamer pipeline."""
+        log.info("Closing pipeline")
+        if self.bitrate_task is not None:
+            self.bitrate_task.cancel()
+            self.bitrate_task = None
+
+        # If pipeline is running, then export pipeline graph before closing
+        # To use this, set GST_DEBUG_DUMP_DOT_DIR environnement variable
+        if self.latency_tracer is not None:
+            log.info(f"Latency budget:\n{self.latency_tracer.report()}")
+        if self.profiler is not None and self.profiler.elements:
+            log.info(self.profiler.report())
+        for line in ingest_report(self.ingest_delays):
+            log.info(line.capitalize())
+
+        if self.pipe is not None:
+            closed = self.stop_recorder()
+            Gst.debug_bin_to_dot_file_with_ts(
+                self.pipe, Gst.DebugGraphDetails.ALL, "pipeline"
+            )
+            if closed is None:
+                self.pipe.set_state(Gst.State.NULL)
+            else:
+                # Last segment is written without blocking other bridges
+                assert self.event_loop is not None
+                self.event_loop.run_in_executor(
+                    None, self.finalize_recording, self.pipe, closed
+                )
+
+        self.pipe = None
+        self.source = None
+        self.outputs = []
+        with self.profiled_lock:
+            self.profiled.clear()
+
 
 class WebRTCClient:
     """WebRTCClient
@@ -31,7 +1237,12 @@ class WebRTCClient:
     """
 
     def __init__(
-        self, input_uri: str, bitrate: int, sdp_offer_callback, ice_candidate_callback
+        self,
+        input_uri: str,
+        bitrate: int,
+        sdp_offer_callback,
+        ice_candidate_callback,
+        media: Optional[MediaPipeline] = None,
     ) -> None:
         """Init WebRTCClient.
 
@@ -43,42 +1254,58 @@ class WebRTCClient:
         :type sdp_offer_callback: coroutine
         :param ice_candidate_callback: coroutine to send ICE candidate
         :type ice_candidate_callback: coroutine
+        :param media: media pipeline shared with other clients, if None a new
+            pipeline is created from input_uri and bitrate
+        :type media: MediaPipeline, optional
         """
         self.event_loop = None
         self.pipe = None
+        self.output = None
         self.webrtc = None
         self.sdp_offer_callback = sdp_offer_callback
         self.ice_candidate_callback = ice_candidate_callback
+        self.media = media or MediaPipeline(input_uri, bitrate)
 
-        self.pipeline_desc = (
-            "webrtcbin name=send bundle-policy=max-bundle "
-            f'uridecodebin uri="{input_uri}" name=bin '
-            f"bin. ! videoconvert ! vp8enc deadline=1 target-bitrate={bitrate} ! rtpvp8pay pt=97 ! send. "
-            "bin. ! audioconvert ! audioresample ! opusenc ! rtpopuspay pt=96 ! send."
-        )
+        # Outgoing signaling, queued from GStreamer threads and sent in order
+        self.signaling: List[Tuple[Callable, object]] = []
+        self.signaling_lock = threading.Lock()
+        self.signaling_task: Optional[asyncio.Task] = None
 
-        # If gstreamer debug level is undefined, show warnings and errors
-        if "GST_DEBUG" not in os.environ:
-            os.environ["GST_DEBUG"] = "2"
+    def queue_signaling(self, callback, arg) -> None:
+        """Queue a signaling message without waiting for it to be sent.
 
-        # Initialize GStreamer and check available plugins
-        Gst.init(None)
-        needed = [
-            "opus",
-            "vpx",
-            "nice",
-            "webrtc",
-            "dtls",
-            "srtp",
-            "rtp",
-            "rtpmanager",
-            "x264",
-        ]
-        missing = filter(lambda p: Gst.Registry.get().find_plugin(p) is None, needed)
-        missing_list = list(missing)
-        if len(missing_list):
-            log.error(f"Missing gstreamer plugins: {missing_list}")
-            sys.exit(1)
+        Can be called from any thread. Messages queued before the event loop
+        wakes up are sent in one batch, in order.
+
+        :param callback: coroutine function sending the message
+        :type callback: coroutine
+        :param arg: message argument
+        :type arg: object
+        """
+        assert self.event_loop is not None
+        with self.signaling_lock:
+            wake_up = not self.signaling
+            self.signaling.append((callback, arg))
+        if wake_up:
+            self.event_loop.call_soon_threadsafe(self.flush_signaling)
+
+    def flush_signaling(self) -> None:
+        """Start sending queued signaling messages, if not already sending."""
+        if self.signaling_task is None or self.signaling_task.done():
+            self.signaling_task = asyncio.ensure_future(self.send_signaling())
+
+    async def send_signaling(self) -> None:
+        """Send queued signaling messages until queue is empty."""
+        while True:
+            with self.signaling_lock:
+                batch, self.signaling = self.signaling, []
+            if not batch:
+                return
+            for callback, arg in batch:
+                try:
+                    await callback(arg)
+                except Exception:
+                    log.exception("Failed to send signaling message")
 
     def on_offer_created(self, promise, _, __) -> None:
         """``on-offer-created`` event handler.
@@ -86,11 +1313,10 @@ class WebRTCClient:
         :param promise: promise running this event
         :type promise: Gst.Promise
         """
-        assert self.event_loop is not None
-        assert self.webrtc is not None
+        if self.webrtc is None:
+            return  # output was closed meanwhile
 
-        # Get offer from the promise calling the event
-        promise.wait()
+        # Promise is already replied when its change function is called
         reply = promise.get_reply()
         offer = reply.get_value("offer")
 
@@ -100,12 +1326,8 @@ class WebRTCClient:
         self.webrtc.emit("set-local-description", offer, promise)
         promise.interrupt()
 
-        # Send local SDP offer to remote
-        offer = offer.sdp.as_text()
-        future = asyncio.run_coroutine_threadsafe(
-            self.sdp_offer_callback(offer), self.event_loop
-        )
-        future.result()  # wait
+        # Send local SDP offer to remote, before any ICE candidate
+        self.queue_signaling(self.sdp_offer_callback, offer.sdp.as_text())
 
     def on_negotiation_needed(self, element) -> None:
         """``on-negotiation-needed`` event handler.
@@ -131,13 +1353,23 @@ class WebRTCClient:
         :param candidate: an ICE candidate
         :type candidate: str
         """
-        assert self.event_loop is not None
-
         c = {"candidate": candidate, "sdpMLineIndex": mline_index}
-        future = asyncio.run_coroutine_threadsafe(
-            self.ice_candidate_callback(c), self.event_loop
-        )
-        future.result()  # wait
+        self.queue_signaling(self.ice_candidate_callback, c)
+
+    def on_ice_connection_state(self, element, _) -> None:
+        """Send a keyframe as soon as ICE is connected.
+
+        Earlier keyframes were dropped before the connection was established,
+        so receivers would wait for the next one. Later keyframe requests from
+        receivers (PLI) reach the encoder as upstream events.
+
+        :param element: the webrtcbin
+        :type element: object
+        """
+        state = element.get_property("ice-connection-state")
+        if state == GstWebRTC.WebRTCICEConnectionState.CONNECTED:
+            log.info("ICE connected, forcing keyframe")
+            self.media.force_keyframe()
 
     def set_remote_sdp(self, sdp: str) -> None:
         """Set remote session description.
@@ -148,6 +1380,9 @@ class WebRTCClient:
         assert self.webrtc is not None
 
         log.info("Setting remote session description")
+        codec = self.media.video_codec.name
+        if "video" in self.media.kinds and not sdp_accepts(sdp, "video", codec):
+            log.error(f"Remote did not accept {codec} video, try another codec")
         _, sdp_msg = GstSdp.SDPMessage.new()
         GstSdp.sdp_message_parse_buffer(bytes(sdp.encode()), sdp_msg)
         answer = GstWebRTC.WebRTCSessionDescription.new(
@@ -174,7 +1409,7 @@ class WebRTCClient:
         :return: statistics as text report
         :rtype: str
         """
-        assert self.pipe is not None
+        assert self.webrtc is not None
         fields = [
             "ssrc",
             "is-sender",
@@ -189,35 +1424,75 @@ class WebRTCClient:
             "recv-nack-count",
             "sr-ntptime",
         ]
-        rtpbin = self.pipe.get_by_name("rtpsession0")
         message = []
-        if rtpbin is None:
+        for source_stats in get_source_stats(self.webrtc):
+            message.append({f: source_stats.get_value(f) for f in fields})
+        if not message:
             return ""
+        report = pprint.pformat(message, sort_dicts=False)
+        for line in ingest_report(self.media.ingest_delays):
+            report += "\n" + line.capitalize()
+        if self.media.latency_tracer is not None:
+            report += "\n" + self.media.latency_tracer.report()
+        return report
 
-        # Get statistics for each SSRC
-        stats = rtpbin.get_property("stats")
-        sources_stats = stats.get_value("source-stats")
-        for source_stats in sources_stats:
-            if source_stats.get_value("ssrc") != 0:
-                message.append({f: source_stats.get_value(f) for f in fields})
-        return pprint.pformat(message, sort_dicts=False)
+    def get_metrics(self) -> List[Sample]:
+        """Get WebRTC, RTP and pipeline metrics.
 
-    def start_pipeline(
-        self, event_loop: asyncio.AbstractEventLoop, ice_servers: List[str]
-    ) -> None:
-        """Start gstreamer pipeline and connect WebRTC events.
+        :return: metrics samples
+        :rtype: list
+        """
+        if self.webrtc is None or self.output is None:
+            return []
+        state = self.webrtc.get_property("ice-connection-state").value_nick
+        samples: List[Sample] = [
+            ("galene_stream_ice_connection_state", {"state": state}, 1)
+        ]
 
-        :param event_loop: asyncio event loop
-        :type event_loop: EventLoop
-        :param ice_servers: list of ICE TURN servers
-        :type ice_servers: list of str
+        # RTP statistics of each sent SSRC
+        fields = {
+            "octets-sent": "galene_stream_rtp_octets_sent_total",
+            "packets-sent": "galene_stream_rtp_packets_sent_total",
+            "bitrate": "galene_stream_rtp_bitrate_bits",
+            "recv-nack-count": "galene_stream_rtp_nack_received_total",
+            "recv-pli-count": "galene_stream_rtp_pli_received_total",
+        }
+        for stats in get_source_stats(self.webrtc):
+            if not stats.get_value("is-sender"):
+                continue
+            kind = "video" if stats.get_value("clock-rate") == 90000 else "audio"
+            labels = {"kind": kind, "ssrc": str(stats.get_value("ssrc"))}
+            for field, name in fields.items():
+                samples.append((name, labels, stats.get_value(field)))
+            if stats.get_value("have-rb"):
+                lost = stats.get_value("rb-packetslost")
+                rtt = stats.get_value("rb-round-trip") / 65536
+                samples.append(("galene_stream_rtp_packets_lost", labels, lost))
+                samples.append(("galene_stream_rtp_round_trip_seconds", labels, rtt))
+
+        # Queue levels before payloaders
+        for kind in self.media.prefixes:
+            name = f"{kind}queue"
+            level = self.output.get_by_name(name).get_property("current-level-buffers")
+            samples.append(("galene_stream_queue_buffers", {"queue": name}, level))
+
+        return samples + self.media.get_metrics()
+
+    def prepare_output(self) -> None:
+        """Build WebRTC output and connect its events, if not already done.
+
+        This does not need the event loop, so that it can run in an executor
+        while connecting to the server.
         """
-        log.info("Starting pipeline")
-        self.event_loop = event_loop
-        self.pipe = Gst.parse_launch(self.pipeline_desc)
-        self.webrtc = self.pipe.get_by_name("send")
+        if self.output is not None:
+            return
+        output = self.media.create_output()
+        self.webrtc = output.get_by_name("send")
         self.webrtc.connect("on-negotiation-needed", self.on_negotiation_needed)
         self.webrtc.connect("on-ice-candidate", self.on_ice_candidate)
+        self.webrtc.connect(
+            "notify::ice-connection-state", self.on_ice_connection_state
+        )
 
         # Enable WebRTC negative acknowledgement and FEC
         transceiver_count = self.webrtc.emit("get-transceivers").len
@@ -226,6 +1501,21 @@ class WebRTCClient:
             transceiver.set_property("do-nack", True)
             # ULPFEC is not yet supported by Galène
             # transceiver.set_property("fec-type", GstWebRTC.WebRTCFECType.ULP_RED)
+        self.output = output
+
+    def start_pipeline(
+        self, event_loop: asyncio.AbstractEventLoop, ice_servers: List[str]
+    ) -> None:
+        """Start gstreamer pipeline and connect WebRTC events.
+
+        :param event_loop: asyncio event loop
+        :type event_loop: EventLoop
+        :param ice_servers: list of ICE TURN servers
+        :type ice_servers: list of str
+        """
+        self.event_loop = event_loop
+        self.prepare_output()
+        assert self.webrtc is not None
 
         # Add TURN servers
         try:
@@ -237,20 +1527,130 @@ class WebRTCClient:
                 "is too old. Skipping TURN servers configuration"
             )
 
-        # Start
-        self.pipe.set_state(Gst.State.PLAYING)
+        # Attach to encoders, this starts the pipeline if needed
+        self.media.add_output(self.output)
+        self.pipe = self.media.pipe
 
-    def close_pipeline(self) -> None:
-        """Stop gstreamer pipeline."""
-        log.info("Closing pipeline")
+    def close_pipeline(self, keep_media: bool = False) -> None:
+        """Detach from gstreamer pipeline, and stop it if no longer used.
 
-        # If pipeline is running, then export pipeline graph before closing
-        # To use this, set GST_DEBUG_DUMP_DOT_DIR environnement variable
-        if self.pipe is not None:
-            Gst.debug_bin_to_dot_file_with_ts(
-                self.pipe, Gst.DebugGraphDetails.ALL, "pipeline"
-            )
-            self.pipe.set_state(Gst.State.NULL)
+        :param keep_media: keep decoding and encoding input, e.g. to reconnect
+        :type keep_media: bool, optional
+        """
+        if self.output is not None:
+            self.media.remove_output(self.output, keep_media)
+        if not keep_media and not self.media.outputs and self.media.pipe is not None:
+            # e.g. prerolled before a connection which failed
+            self.media.close()
+
+        # Drop signaling of this session
+        with self.signaling_lock:
+            self.signaling = []
+        if self.signaling_task is not None:
+            self.signaling_task.cancel()
+            self.signaling_task = None
 
         self.pipe = None
+        self.output = None
         self.webrtc = None
+
+
+class LoopbackPeer:
+    """WebRTC peer answering offers and discarding received media.
+
+    It stands for Galène when load testing gateways offline.
+    """
+
+    def __init__(self, ice_candidate_callback: Callable[[dict], None]) -> None:
+        """Init LoopbackPeer.
+
+        :param ice_candidate_callback: function called with each local ICE
+            candidate, in event loop thread
+        :type ice_candidate_callback: callable
+        """
+        init_gstreamer()
+        self.ice_candidate_callback = ice_candidate_callback
+        self.event_loop = asyncio.get_event_loop()
+        self.answer_future: Optional[asyncio.Future] = None
+        self.pipe = Gst.parse_launch("webrtcbin name=recv bundle-policy=max-bundle")
+        self.webrtc = self.pipe.get_by_name("recv")
+        self.webrtc.connect("pad-added", self.on_pad_added)
+        self.webrtc.connect("on-ice-candidate", self.on_ice_candidate)
+        self.pipe.set_state(Gst.State.PLAYING)
+
+    def on_pad_added(self, _, pad: Gst.Pad) -> None:
+        """Discard received media.
+
+        :param pad: new source pad of webrtcbin
+        :type pad: Gst.Pad
+        """
+        if pad.get_direction() != Gst.PadDirection.SRC:
+            return
+        sink = Gst.ElementFactory.make("fakesink")
+        sink.set_property("async", False)
+        self.pipe.add(sink)
+        sink.sync_state_with_parent()
+        pad.link(sink.get_static_pad("sink"))
+
+    def on_ice_candidate(self, _, mline_index: int, candidate: str) -> None:
+        """``on-ice-candidate`` event handler.
+
+        :param mline_index: the index of the media description in the SDP
+        :type mline_index: int
+        :param candidate: an ICE candidate
+        :type candidate: str
+        """
+        c = {"candidate": candidate, "sdpMLineIndex": mline_index}
+        self.event_loop.call_soon_threadsafe(self.ice_candidate_callback, c)
+
+    async def answer(self, sdp: str) -> str:
+        """Answer a SDP offer.
+
+        :param sdp: session description of the offer
+        :type sdp: str
+        :return: session description of the answer
+        :rtype: str
+        """
+        self.answer_future = self.event_loop.create_future()
+        _, sdp_msg = GstSdp.SDPMessage.new()
+        GstSdp.sdp_message_parse_buffer(bytes(sdp.encode()), sdp_msg)
+        offer = GstWebRTC.WebRTCSessionDescription.new(
+            GstWebRTC.WebRTCSDPType.OFFER, sdp_msg
+        )
+        promise = Gst.Promise.new_with_change_func(self.on_remote_set, None, None)
+        self.webrtc.emit("set-remote-description", offer, promise)
+        return await self.answer_future
+
+    def on_remote_set(self, *_) -> None:
+        """Create answer once offer is set."""
+        promise = Gst.Promise.new_with_change_func(self.on_answer_created, None, None)
+        self.webrtc.emit("create-answer", None, promise)
+
+    def on_answer_created(self, promise: Gst.Promise, *_) -> None:
+        """Set local description and resolve answer.
+
+        :param promise: promise running this event
+        :type promise: Gst.Promise
+        """
+        answer = promise.get_reply().get_value("answer")
+        promise = Gst.Promise.new()
+        self.webrtc.emit("set-local-description", answer, promise)
+        promise.interrupt()
+        assert self.answer_future is not None
+        self.event_loop.call_soon_threadsafe(
+            self.answer_future.set_result, answer.sdp.as_text()
+        )
+
+    def add_ice_candidate(self, mline_index: int, candidate: str) -> None:
+        """Add remote ICE candidate.
+
+        :param mline_index: the index of the media description in the SDP
+        :type mline_index: int
+        :param candidate: an ICE candidate
+        :type candidate: str
+        """
+        self.webrtc.emit("add-ice-candidate", mline_index, candidate)
+
+    def close(self) -> None:
+        """Stop peer."""
+        self.pipe.set_state(Gst.State.NULL)
@@ -0,0 +1,142 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.admission.
+"""
+
+from galene_stream.admission import AdmissionController, CPUMonitor
+from galene_stream.codecs import VIDEO_CODECS
+
+
+class FakeMonitor(CPUMonitor):
+    """CPU monitor returning a fixed usage."""
+
+    def __init__(self, usage: float) -> None:
+        """Init FakeMonitor."""
+        self.usage = usage
+
+    def sample(self) -> float:
+        """Get fixed usage."""
+        return self.usage
+
+
+class FakeMedia:
+    """Media pipeline counting frames and recording load shedding."""
+
+    def __init__(self) -> None:
+        """Init FakeMedia."""
+        self.pipe = object()
+        self.kinds = ("video", "audio")
+        self.frames = {"video": 0}
+        self.input_frames = 0
+        self.dropped = {"vencq": 0}
+        self.max_bitrate = 1048576
+        self.temporal_layers = 1
+        self.video_codec = VIDEO_CODECS["vp8"]
+        self.bitrate_limit = None
+        self.video_enabled = True
+
+    def limit_bitrate(self, limit):
+        """Record bitrate limit."""
+        self.bitrate_limit = limit
+
+    def set_video_enabled(self, enabled):
+        """Record video state."""
+        self.video_enabled = enabled
+
+
+def test_cpu_monitor(tmp_path):
+    """Test CPU usage is computed between two samples."""
+    path = tmp_path / "stat"
+    path.write_text("cpu  100 0 100 700 100 0 0 0 0 0\n")
+    monitor = CPUMonitor(str(path))
+    path.write_text("cpu  200 0 200 1500 100 0 0 0 50 0\n")  # guest in user
+    assert monitor.sample() == 0.2
+    assert CPUMonitor(str(tmp_path / "missing")).sample() is None
+
+
+def test_refuse():
+    """Test bridges are refused while host is overloaded."""
+    monitor = FakeMonitor(0.95)
+    admission = AdmissionController("refuse", 0.9, monitor)
+    assert admission.admit("a")
+    assert admission.check()
+    assert not admission.admit("b")
+    assert not admission.admit("b")  # retried while pending
+    assert admission.get_metrics()[1] == ("galene_stream_refused_bridges_total", {}, 1)
+    monitor.usage = 0.5
+    assert not admission.check()
+    assert admission.admit("b")
+
+
+def test_lagging_encoder():
+    """Test host is overloaded when an encoder drops frames."""
+    admission = AdmissionController("refuse", 0.9, FakeMonitor(0.5))
+    media = FakeMedia()
+    admission.add("a", media)
+    media.input_frames, media.frames["video"] = 30, 30
+    assert not admission.check()
+    media.input_frames, media.frames["video"] = 60, 40
+    assert admission.check()
+
+
+def test_shed_lowest_priority_first():
+    """Test only the lowest priority stream is degraded, then restored."""
+    admission = AdmissionController("drop-video", 0.9, FakeMonitor(0.95))
+    low, high = FakeMedia(), FakeMedia()
+    admission.add("high", high, priority=1)
+    admission.add("low", low, priority=0)
+    admission.shed()
+    assert not low.video_enabled and high.video_enabled
+    admission.restore()
+    assert low.video_enabled
+
+
+def test_lower_bitrate():
+    """Test bitrate is halved down to minimum, and raised back."""
+    admission = AdmissionController("lower-bitrate", 0.9, FakeMonitor(0.95))
+    media = FakeMedia()
+    admission.add("a", media)
+    for _ in range(5):
+        admission.shed()
+    assert media.bitrate_limit == admission.min_bitrate
+    for _ in range(3):
+        admission.restore()
+    assert media.bitrate_limit is None
+
+
+def test_lower_bitrate_skips_temporal_layers():
+    """Test streams with temporal layers are not lowered."""
+    admission = AdmissionController("lower-bitrate", 0.9, FakeMonitor(0.95))
+    layered, media = FakeMedia(), FakeMedia()
+    layered.temporal_layers = 3
+    admission.add("layered", layered, priority=0)
+    admission.add("a", media, priority=1)
+    admission.shed()
+    assert layered.bitrate_limit is None and media.bitrate_limit is not None
+
+
+def test_lower_bitrate_skips_passthrough():
+    """Test streams without encoder are not lowered nor counted as shed."""
+    admission = AdmissionController("lower-bitrate", 0.9, FakeMonitor(0.95))
+    passthrough, media = FakeMedia(), FakeMedia()
+    passthrough.video_codec = VIDEO_CODECS["h264-passthrough"]
+    admission.add("passthrough", passthrough, priority=0)
+    admission.shed()
+    assert passthrough.bitrate_limit is None and admission.shed_steps == 0
+    admission.add("a", media, priority=1)
+    admission.shed()
+    assert media.bitrate_limit is not None and admission.shed_steps == 1
+
+
+def test_drop_passthrough_video():
+    """Test passthrough video can be dropped, and is restored."""
+    admission = AdmissionController("drop-video", 0.9, FakeMonitor(0.95))
+    media = FakeMedia()
+    media.video_codec = VIDEO_CODECS["h264-passthrough"]
+    admission.add("passthrough", media)
+    admission.shed()
+    assert not media.video_enabled
+    admission.restore()
+    assert media.video_enabled
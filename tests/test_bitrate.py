@@ -0,0 +1,23 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.bitrate.
+"""
+
+from galene_stream.bitrate import BitrateController
+
+
+def test_bitrate_controller():
+    """Test adapting bitrate to losses and round-trip time."""
+    controller = BitrateController(1000000, 200000, 1200000)
+    assert controller.update(0.0, 0.05) == 1050000
+    assert controller.update(0.0, 0.05) == 1102500
+    assert controller.update(0.0, 0.05) == 1157625
+    assert controller.update(0.0, 0.05) == 1200000  # ceiling
+    assert controller.update(0.05, 0.05) == 1200000  # hold
+    assert controller.update(0.0, 0.2) == 1020000  # delay growth
+    assert controller.update(0.5, 0.05) == 765000  # heavy loss
+    for _ in range(20):
+        controller.update(0.9)
+    assert controller.bitrate == 200000  # floor
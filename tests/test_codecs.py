@@ -0,0 +1,84 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.codecs.
+"""
+
+from galene_stream.codecs import (
+    VIDEO_CODECS,
+    encoder_desc,
+    opus_desc,
+    preprocess_desc,
+    queue_desc,
+    sdp_accepts,
+)
+
+ANSWER = (
+    "v=0\r\n"
+    "m=video 9 UDP/TLS/RTP/SAVPF 97\r\n"
+    "a=rtpmap:97 VP8/90000\r\n"
+    "m=audio 9 UDP/TLS/RTP/SAVPF 96\r\n"
+    "a=rtpmap:96 opus/48000/2\r\n"
+)
+
+
+def test_sdp_accepts():
+    """Test checking codecs accepted in SDP answer."""
+    assert sdp_accepts(ANSWER, "video", "VP8")
+    assert sdp_accepts(ANSWER, "audio", "OPUS")
+    assert not sdp_accepts(ANSWER, "video", "H264")
+    assert not sdp_accepts(ANSWER.replace("video 9", "video 0"), "video", "VP8")
+
+
+def test_encoder_desc():
+    """Test video encoder description."""
+    desc = encoder_desc(VIDEO_CODECS["vp8"], 1048576, "low-cpu", 4, 30)
+    assert desc.startswith("vp8enc name=venc deadline=1 target-bitrate=1048576 ")
+    assert "cpu-used=16" in desc
+    assert "threads=4 token-partitions=2" in desc
+    assert desc.endswith("keyframe-max-dist=30")
+
+    desc = encoder_desc(VIDEO_CODECS["h264"], 1048576, threads=2)
+    assert "bitrate=1048 threads=2 ! video/x-h264" in desc
+
+    desc = encoder_desc(VIDEO_CODECS["h264-passthrough"], 1048576, "quality", 4)
+    assert desc == "h264parse config-interval=-1"
+
+
+def test_temporal_layers():
+    """Test VP8 temporal layers description."""
+    desc = encoder_desc(VIDEO_CODECS["vp8"], 1000000, layers=3)
+    assert "temporal-scalability-number-layers=3" in desc
+    assert 'temporal-scalability-layer-id="<0,2,1,2>"' in desc
+    assert 'temporal-scalability-rate-decimator="<4,2,1>"' in desc
+    assert 'temporal-scalability-target-bitrate="<400000,600000,1000000>"' in desc
+
+    desc = encoder_desc(VIDEO_CODECS["h264"], 1000000, layers=3)
+    assert "temporal-scalability" not in desc
+
+
+def test_preprocess_desc():
+    """Test scaling and rate limiting description."""
+    assert preprocess_desc() == ""
+    desc = preprocess_desc(1280, None, 30)
+    assert desc.index("videorate") < desc.index("videoscale")
+    assert "video/x-raw,width=1280 ! " in desc
+    assert "max-rate=30" in desc
+    assert preprocess_desc(height=360).endswith("video/x-raw,height=360 ! ")
+
+
+def test_queue_desc():
+    """Test bounded queue description."""
+    assert "max-size-buffers=4" in queue_desc("vinq", 4)
+    assert queue_desc("vinq", 4).endswith("leaky=downstream")
+    assert queue_desc("vinq", 4, "block").endswith("leaky=no")
+
+
+def test_opus_desc():
+    """Test Opus encoder description."""
+    assert opus_desc() == ("opusenc name=aenc", "rtpopuspay pt=96")
+    encoder, payloader = opus_desc(32000, "60", 5, dtx=True, fec=True)
+    assert "bitrate=32000 frame-size=60 complexity=5 dtx=true" in encoder
+    assert "inband-fec=true" in encoder
+    assert payloader.endswith("dtx=true")
@@ -0,0 +1,47 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.config.
+"""
+
+import argparse
+
+from galene_stream.config import load_bridges
+
+
+def test_load_bridges(tmp_path):
+    """Test loading bridges from configuration file."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input")
+    parser.add_argument("--output", nargs="+")
+    parser.add_argument("--bitrate", default=1048576)
+    parser.add_argument("--insecure", action="store_true")
+    path = tmp_path / "gateway.ini"
+    path.write_text(
+        "[DEFAULT]\n"
+        "output = https://galene.example.org/group/public/\n"
+        "[camera1]\n"
+        "input = rtmp://localhost:1935/live/camera1\n"
+        "insecure = yes\n"
+        "[camera2]\n"
+        "input = rtmp://localhost:1935/live/camera2\n"
+        "bitrate = 524288\n"
+        "output =\n"
+        "    https://galene.example.org/group/public/\n"
+        "    https://galene.example.org/group/other/\n"
+        "insecure = no\n"
+    )
+
+    bridges = load_bridges(str(path), parser)
+    assert list(bridges) == ["camera1", "camera2"]
+    assert bridges["camera1"].output == ["https://galene.example.org/group/public/"]
+    assert bridges["camera1"].insecure
+    assert bridges["camera1"].bitrate == 1048576
+    assert bridges["camera2"].input == "rtmp://localhost:1935/live/camera2"
+    assert not bridges["camera2"].insecure
+    assert bridges["camera2"].output == [
+        "https://galene.example.org/group/public/",
+        "https://galene.example.org/group/other/",
+    ]
+    assert bridges["camera2"].bitrate == "524288"
@@ -0,0 +1,48 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.fake_server.
+"""
+
+import asyncio
+import json
+import urllib.request
+
+import websockets
+
+from galene_stream.fake_server import FakeGalene
+
+
+def test_fake_server_join():
+    """Test fetching status, handshaking and joining the fake server."""
+
+    async def run():
+        """Join group as GaleneClient does."""
+        server = FakeGalene(answer_media=False, ping_interval=0.05)
+        await server.start()
+        url = server.url + ".status.json"
+        status = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: json.load(urllib.request.urlopen(url))
+        )
+        assert status["name"] == "test"
+
+        async with websockets.connect(status["endpoint"]) as conn:
+            await conn.send(json.dumps({"type": "handshake", "id": "client"}))
+            assert json.loads(await conn.recv())["type"] == "handshake"
+            join = {"type": "join", "kind": "join", "group": "test"}
+            await conn.send(json.dumps(join))
+            assert json.loads(await conn.recv())["type"] == "user"
+            joined = json.loads(await conn.recv())
+            assert joined["type"] == "joined" and joined["kind"] == "join"
+            assert json.loads(await conn.recv())["type"] == "ping"
+            await conn.send(json.dumps({"type": "offer", "id": "a", "sdp": ""}))
+            await conn.send(json.dumps({"type": "pong"}))
+            await asyncio.sleep(0.01)
+
+        await server.close()
+        assert server.connections == 1
+        assert server.messages_received == 4
+        assert server.offers == 1
+
+    asyncio.run(run())
@@ -0,0 +1,139 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.galene.
+"""
+
+import asyncio
+import functools
+import types
+
+import pytest
+
+import galene_stream.galene
+from galene_stream.fake_server import FakeGalene
+from galene_stream.galene import GaleneClient
+
+
+class Stop(Exception):
+    """Raised by fake connections to end the client loop."""
+
+
+class FakeConnection:
+    """WebSocket connection which is already closed."""
+
+    def __aiter__(self):
+        """Iterate received messages.
+
+        :return: iterator
+        """
+        return self
+
+    async def __anext__(self):
+        """Get next received message.
+
+        :raises StopAsyncIteration: as connection is closed
+        """
+        raise StopAsyncIteration
+
+
+def test_reconnect_backoff(monkeypatch):
+    """Test backoff grows while connections fail, and resets once stable."""
+    clock = [0.0]
+    delays = []
+
+    async def sleep(delay):
+        """Record delay instead of sleeping."""
+        delays.append(delay)
+        clock[0] += delay
+
+    async def connect():
+        """Fail four times, then connect, then stop."""
+        if len(delays) == 5:
+            raise Stop
+        if len(delays) < 4:
+            raise OSError("connection refused")
+
+    async def loop(_):
+        """Stay connected longer than maximum backoff, then fail."""
+        clock[0] += 2 * client.max_backoff
+        raise OSError("connection lost")
+
+    monkeypatch.setattr(
+        galene_stream.galene, "asyncio", types.SimpleNamespace(sleep=sleep)
+    )
+    monkeypatch.setattr(
+        galene_stream.galene, "time", types.SimpleNamespace(monotonic=lambda: clock[0])
+    )
+    client = GaleneClient(
+        "test:", "http://localhost/group/test/", 1048576, "bot", reconnect=True
+    )
+    client.connect = connect
+    client.loop = loop
+    with pytest.raises(Stop):
+        asyncio.run(client.run(None))
+    assert delays == [0.1, 0.2, 0.4, 0.8, 0.1]
+    assert client.reconnects == 5
+
+
+def test_abort_one_stream():
+    """Test messages about an aborted stream are ignored, others keep going."""
+
+    async def run():
+        """Abort first stream, then send chat command and late candidate."""
+        server = FakeGalene(answer_media=False)
+        await server.start()
+        client = GaleneClient("test:", server.url, 1048576, "bot")
+        other = client.add_stream("test:", 1048576)
+        aborted = next(iter(client.streams))
+        task = asyncio.ensure_future(client.run(asyncio.get_event_loop()))
+        while not all(w.pipe is not None for w in client.streams.values()):
+            await asyncio.sleep(0.01)
+
+        candidate = {"candidate": "candidate:0 1 UDP 1 127.0.0.1 9 typ host"}
+        candidate["sdpMLineIndex"] = 0
+        await server.broadcast({"type": "abort", "id": aborted})
+        await server.broadcast({"type": "chat", "value": "!webrtc"})
+        await server.broadcast({"type": "ice", "id": aborted, "candidate": candidate})
+        await server.broadcast({"type": "renegotiate", "id": aborted})
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        assert client.aborted == {aborted}
+        assert client.streams[aborted].webrtc is None
+        assert client.streams[other].webrtc is not None
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await client.close()
+        await server.close()
+
+    asyncio.run(run())
+
+
+def test_aborted_stream_not_offered_again():
+    """Test reconnecting only offers streams which were not aborted."""
+    client = GaleneClient("test:", "http://localhost/group/test/", 1048576, "bot")
+    other = client.add_stream("test:", 1048576)
+    aborted = next(iter(client.streams))
+    started = []
+    for stream_id, webrtc in client.streams.items():
+        webrtc.start_pipeline = functools.partial(
+            lambda i, *_: started.append(i), stream_id
+        )
+
+    async def loop():
+        """Run client loop on a closed connection."""
+        client.conn = FakeConnection()
+        await client.loop(None)
+
+    client.aborted.add(aborted)
+    asyncio.run(loop())
+    assert started == [other]
+
+    # Once every stream was aborted, they are all offered on next session
+    client.aborted.add(other)
+    started.clear()
+    asyncio.run(loop())
+    assert sorted(started) == sorted(client.streams)
+    assert client.aborted == set()
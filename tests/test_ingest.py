@@ -0,0 +1,59 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.ingest.
+"""
+
+from galene_stream.ingest import (
+    INGEST_PROFILES,
+    IngestDelay,
+    ingest_report,
+    source_properties,
+)
+
+
+def test_source_properties():
+    """Test latency given in URI is not overridden."""
+    profile = INGEST_PROFILES["low-latency"]
+    assert source_properties("srt://host:9000", profile)["latency"] == 80
+    properties = source_properties("srt://host:9000?latency=200", profile)
+    assert "latency" not in properties
+    assert source_properties("rtmp://host/live", INGEST_PROFILES["default"]) == {}
+
+
+def test_delay_without_dropping():
+    """Test delay is measured from earliest buffer, nothing is dropped."""
+    delay = IngestDelay()
+    assert ingest_report({"video": delay}) == []
+    assert not delay.observe(0.5, 0.0)
+    assert not delay.observe(3.0, 1.0)
+    assert delay.delay == 2.5 and delay.lag == 3.0
+    assert delay.dropped == 0
+    assert ingest_report({"video": delay}) == [
+        "video ingest delay: 2500ms (lag 3000ms), 0 stale dropped"
+    ]
+
+
+def test_drop_stale_buffers():
+    """Test stale buffers are dropped until input catches up."""
+    delay = IngestDelay(max_lag=0.2)
+    assert not delay.observe(0.1, 0.0)
+    assert delay.observe(0.5, 0.1)
+    assert delay.observe(0.4, 0.2)
+    assert not delay.observe(0.2, 0.3)
+    assert delay.dropped == 2
+
+
+def test_rebase_lagging_input():
+    """Test input which never catches up is no longer dropped."""
+    delay = IngestDelay(max_lag=0.2)
+    delay.observe(0.0, 0.0)
+    assert delay.observe(1.0, 1.0)
+    assert delay.observe(1.0, 2.0)
+    assert not delay.observe(1.0, 3.5)
+    assert not delay.observe(1.1, 3.6)
+    assert abs(delay.delay - 0.1) < 1e-9
+    delay.reset()
+    assert not delay.observe(5.0, 4.0)
+    assert delay.delay == 0.0
@@ -0,0 +1,70 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.latency.
+"""
+
+import threading
+
+from galene_stream.latency import Histogram, LatencyTracer
+
+
+def test_histogram():
+    """Test latency histogram."""
+    histogram = Histogram([0.01, 0.1])
+    for value in [0.005, 0.05, 0.05, 0.5]:
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.max == 0.5
+    samples = histogram.get_samples("latency", {})
+    assert samples[2] == ("latency_bucket", {"le": "+Inf"}, 4)
+    assert samples[-1] == ("latency_count", {}, 4)
+
+
+def test_latency_tracer():
+    """Test matching buffers between stages."""
+    tracer = LatencyTracer()
+    tracer.record("audio", "decoded", None, 0)
+    tracer.record("audio", "decoded", None, 10)
+    tracer.record("audio", "decoded", None, 20)
+    tracer.record("audio", "encoded", "decoded", 15)  # merged buffers
+    tracer.record("audio", "payloaded", "encoded", 15, key=1)
+    tracer.record("audio", "payloaded", "encoded", 15, key=1)  # same frame
+    tracer.record("audio", "payloaded", "encoded", 15, key=2)  # other output
+    assert tracer.histograms[("audio", "encoded")].count == 1
+    assert tracer.histograms[("audio", "payloaded")].count == 2
+    assert "audio encoded: mean=" in tracer.report()
+
+
+def test_latency_tracer_forget():
+    """Test stage times of a detached output are forgotten."""
+    tracer = LatencyTracer()
+    tracer.record("audio", "encoded", None, 0)
+    tracer.record("audio", "payloaded", "encoded", 0, key=1)
+    tracer.record("audio", "payloaded", "encoded", 0, key=2)
+    tracer.forget(1)
+    assert set(tracer.stages) == {
+        ("audio", "encoded", None),
+        ("audio", "payloaded", 2),
+    }
+    assert tracer.histograms[("audio", "payloaded")].count == 2
+
+
+def test_latency_tracer_threads():
+    """Test stages recorded from many streaming threads are all counted."""
+    tracer = LatencyTracer()
+
+    def record(kind):
+        """Record buffers of one media kind."""
+        for pts in range(1000):
+            tracer.record(kind, "decoded", None, pts)
+            tracer.record(kind, "encoded", "decoded", pts)
+
+    threads = [threading.Thread(target=record, args=(k,)) for k in "abcd"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(tracer.histograms[(k, "encoded")].count == 1000 for k in "abcd")
@@ -0,0 +1,49 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.metrics.
+"""
+
+import asyncio
+
+from galene_stream.metrics import MetricsExporter, render
+
+SAMPLES = [
+    ("galene_stream_rtp_packets_sent_total", {"stream": 'cam"1', "kind": "video"}, 42),
+    ("galene_stream_signaling_connects_total", {"stream": "cam1"}, 1),
+]
+
+
+def test_render():
+    """Test rendering samples in text exposition format."""
+    text = render(SAMPLES)
+    assert text.splitlines() == [
+        "# HELP galene_stream_signaling_connects_total WebSocket connections to Galène.",
+        "# TYPE galene_stream_signaling_connects_total counter",
+        'galene_stream_signaling_connects_total{stream="cam1"} 1',
+        "# HELP galene_stream_rtp_packets_sent_total RTP packets sent.",
+        "# TYPE galene_stream_rtp_packets_sent_total counter",
+        'galene_stream_rtp_packets_sent_total{stream="cam\\"1",kind="video"} 42',
+    ]
+
+
+def test_exporter():
+    """Test serving metrics over HTTP."""
+
+    async def scrape():
+        """Start exporter and scrape it once."""
+        exporter = MetricsExporter(lambda: SAMPLES)
+        await exporter.start("127.0.0.1", 0)
+        port = exporter.http.server.sockets[0].getsockname()[1]
+        await asyncio.sleep(0)  # let exporter sample metrics
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        await exporter.close()
+        return response
+
+    response = asyncio.run(scrape())
+    assert response.startswith(b"HTTP/1.0 200 OK\r\n")
+    assert response.endswith(render(SAMPLES).encode())
@@ -0,0 +1,60 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.profiler.
+"""
+
+import threading
+
+from galene_stream.profiler import Profiler, element_key
+
+
+def test_profiler_ranking():
+    """Test elements are ranked by processing time."""
+    profiler = Profiler()
+    for element, count in [("venc", 3), ("vconv", 1)]:
+        for _ in range(count):
+            profiler.enter(element)
+            profiler.leave(element)
+    profiler.leave("venc")  # later pushes of the same buffer are not counted
+    _, ranking = profiler.ranked()
+    assert [name for name, _ in ranking] == ["venc", "vconv"]
+    assert ranking[0][1].count == 3
+
+    # Windows only count elements since previous window
+    profiler.ranked(window=True)
+    profiler.enter("vconv")
+    profiler.leave("vconv")
+    _, ranking = profiler.ranked(window=True)
+    assert [(name, t.count) for name, t in ranking] == [("vconv", 1)]
+
+
+def test_profiler_threads():
+    """Test buffers leaving from another thread are not counted."""
+    profiler = Profiler()
+    profiler.enter("venc")
+    thread = threading.Thread(target=profiler.leave, args=("venc",))
+    thread.start()
+    thread.join()
+    assert profiler.ranked()[1] == []
+
+
+def test_profiler_report():
+    """Test report of queues and signaling handlers."""
+    profiler = Profiler()
+    assert profiler.report() == ""
+    profiler.record_queue("vencq", 2)
+    profiler.record_handler("answer", 0.002)
+    report = profiler.report()
+    assert "queue vencq: mean=2.0 max=2" in report
+    assert "signaling answer: mean=2.00ms" in report
+    assert profiler.get_metrics() == [
+        ("galene_stream_signaling_handler_seconds_total", {"type": "answer"}, 0.002)
+    ]
+
+
+def test_element_key():
+    """Test elements with generated names are grouped by factory."""
+    assert element_key("venc", "vp8enc") == "venc"
+    assert element_key("srtpenc0", "srtpenc") == "srtpenc"
@@ -0,0 +1,56 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.protocol.
+"""
+
+import asyncio
+
+import pytest
+
+from galene_stream.protocol import Dispatcher, get_codec, peek_type
+
+
+def test_peek_type():
+    """Test reading message type without decoding."""
+    assert peek_type('{"type":"user","id":"a"}') == "user"
+    assert peek_type('{"id":"a","type":"user"}') is None
+    assert peek_type('{"type":"us') is None
+    assert peek_type(b'{"type":"user"}') is None
+
+
+def test_codecs():
+    """Test codecs encode and decode messages."""
+    for name in [None, "json"]:
+        codec = get_codec(name)
+        encoded = codec.dumps({"type": "ping", "value": "é"})
+        assert isinstance(encoded, str)
+        assert codec.loads(encoded) == {"type": "ping", "value": "é"}
+    with pytest.raises(ValueError):
+        get_codec("unknown")
+
+
+def test_dispatch():
+    """Test messages are routed to their handler or ignored."""
+    received = []
+
+    async def on_ping(message):
+        """Record message."""
+        received.append(message)
+
+    async def on_abort(message):
+        """End session."""
+        return True
+
+    dispatcher = Dispatcher(get_codec("json"))
+    dispatcher.register("ping", on_ping)
+    dispatcher.register("abort", on_abort)
+    dispatcher.ignore("user")
+
+    assert dispatcher.decode('{"type":"user","id":"a"}') is None
+    assert dispatcher.decode('{"id":"a","type":"user"}') is None
+    assert not asyncio.run(dispatcher.dispatch('{"type":"ping"}'))
+    assert not asyncio.run(dispatcher.dispatch('{"type":"unknown"}'))
+    assert asyncio.run(dispatcher.dispatch('{"type":"abort"}'))
+    assert received == [{"type": "ping"}]
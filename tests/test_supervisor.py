@@ -0,0 +1,98 @@
+# Copyright (C) 2024 A. Iooss
+# SPDX-License-Identifier: MIT
+
+"""
+Test module for galene_stream.supervisor.
+"""
+
+import argparse
+import asyncio
+import time
+
+import pytest
+
+from galene_stream.supervisor import Supervisor, Worker, shard, split_cpus
+
+
+def fake_worker(name, bridges, cpus, conn, debug=False):
+    """Answer metrics requests, hang if asked to, exit on any other request.
+
+    :param name: worker name
+    :type name: str
+    :param bridges: options of each bridge, indexed by bridge name
+    :type bridges: dict
+    :param cpus: CPU cores, ignored
+    :type cpus: list of int
+    :param conn: pipe end receiving requests
+    :type conn: multiprocessing.connection.Connection
+    :param debug: ignored
+    :type debug: bool, optional
+    """
+    while True:
+        if conn.recv() != "metrics":
+            raise SystemExit(1)
+        if "hung" not in bridges:
+            conn.send([("galene_stream_encoded_frames_total", {"kind": "video"}, 1)])
+
+
+def test_shard():
+    """Test bridges are spread evenly across workers."""
+    assert shard(["a", "b", "c"], 2) == [["a", "c"], ["b"]]
+    assert shard(["a"], 4) == [["a"]]
+
+
+def test_split_cpus():
+    """Test CPU cores are split in contiguous sets."""
+    assert split_cpus([3, 2, 1, 0], 2) == [[0, 1], [2, 3]]
+    assert split_cpus(list(range(5)), 2) == [[0, 1, 2], [3, 4]]
+    assert split_cpus([0, 1], 3) == [[0], [1], [0]]
+
+
+def test_restart_releases_crashed_process():
+    """Test restarting a crashed worker closes its pipe and process."""
+    worker = Worker(0, {"cam": argparse.Namespace()}, [0], target=fake_worker)
+    worker.start()
+    conn, process = worker.conn, worker.process
+    conn.send("crash")
+    process.join()
+    worker.start()
+    assert conn.closed and worker.conn is not conn and worker.is_alive()
+    with pytest.raises(ValueError):
+        process.is_alive()  # process object was closed
+    worker.stop(1)
+    assert worker.conn is None and not worker.is_alive()
+
+
+def test_restart_and_metrics():
+    """Test metrics of workers are collected and crashed workers restarted."""
+    bridges = {"cam": argparse.Namespace(), "hung": argparse.Namespace()}
+    supervisor = Supervisor(bridges, 2)
+    supervisor.stats_timeout = 1.0
+    for worker in supervisor.workers:
+        worker.target = fake_worker
+        worker.backoff = 0.0
+
+    async def run():
+        """Collect metrics, crash first worker and collect again."""
+        for worker in supervisor.workers:
+            worker.start()
+        start = time.monotonic()
+        samples = await supervisor.collect_metrics()
+        assert time.monotonic() - start < 2 * supervisor.stats_timeout
+        labels = {"worker": "worker0", "kind": "video"}
+        assert ("galene_stream_encoded_frames_total", labels, 1) in samples
+        assert ("galene_stream_worker_up", {"worker": "worker1"}, 1) in samples
+
+        worker = supervisor.workers[0]
+        worker.conn.send("crash")
+        worker.process.join()
+        supervisor.check_workers()  # schedules restart
+        supervisor.check_workers()
+        assert worker.restarts == 1 and worker.is_alive()
+        samples = await supervisor.collect_metrics()
+        assert ("galene_stream_encoded_frames_total", labels, 1) in samples
+        labels = {"worker": "worker0"}
+        assert ("galene_stream_worker_restarts_total", labels, 1) in samples
+        await supervisor.close()
+
+    asyncio.run(run())
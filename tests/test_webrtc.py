@@ -6,8 +6,22 @@ Test module for galene_stream.webrtc.
 """
 
 import asyncio
+import re
+import threading
+import time
+from unittest import mock
 
-from galene_stream.webrtc import WebRTCClient
+from gi.repository import Gst
+
+from galene_stream.latency import LatencyTracer
+from galene_stream.profiler import Profiler
+from galene_stream.webrtc import (
+    MediaPipeline,
+    WebRTCClient,
+    get_source_stats,
+    local_source_desc,
+    pattern_source_desc,
+)
 
 
 def test_init_webrtc():
@@ -16,3 +30,255 @@ def test_init_webrtc():
     client = WebRTCClient("rtmp://localhost:1935/live/test", 1048576, None, None)
     client.start_pipeline(event_loop, [])
     client.close_pipeline()
+
+
+def test_close_prerolled_pipeline():
+    """Test pipeline started before its output was attached is closed."""
+
+    async def run():
+        """Preroll pipeline, then close client without output."""
+        client.media.start()
+        client.close_pipeline(keep_media=True)
+        assert client.media.pipe is not None
+        client.close_pipeline()
+
+    client = WebRTCClient("test:", 1048576, None, None)
+    asyncio.run(run())
+    assert client.media.pipe is None
+
+
+def answer_offer(send: Gst.Element) -> Gst.Pipeline:
+    """Negotiate a webrtcbin with a local receiver, so that it sends media.
+
+    :param send: sending webrtcbin
+    :type send: Gst.Element
+    :return: receiving pipeline
+    :rtype: Gst.Pipeline
+    """
+
+    def on_pad_added(_, pad):
+        """Discard received media."""
+        sink = Gst.ElementFactory.make("fakesink")
+        receiver.add(sink)
+        sink.sync_state_with_parent()
+        pad.link(sink.get_static_pad("sink"))
+
+    def create(element, action):
+        """Create offer or answer."""
+        promise = Gst.Promise.new()
+        element.emit(f"create-{action}", None, promise)
+        promise.wait()
+        return promise.get_reply().get_value(action)
+
+    receiver = Gst.parse_launch("webrtcbin name=recv")
+    recv = receiver.get_by_name("recv")
+    recv.connect("pad-added", on_pad_added)
+    receiver.set_state(Gst.State.PLAYING)
+    offer = create(send, "offer")
+    send.emit("set-local-description", offer, None)
+    recv.emit("set-remote-description", offer, None)
+    answer = create(recv, "answer")
+    recv.emit("set-local-description", answer, None)
+    send.emit("set-remote-description", answer, None)
+    return receiver
+
+
+def test_source_stats_of_each_pipeline():
+    """Test statistics are found for every webrtcbin, not only the first."""
+
+    async def run():
+        """Send from two pipelines, and wait for stats of the second one."""
+        pipelines, receivers = [], []
+        for _ in range(2):
+            media = MediaPipeline("test:?audio=0", 1048576, kinds=("video",))
+            output = media.create_output()
+            media.add_output(output)
+            pipelines.append(media)
+            receivers.append(answer_offer(output.get_by_name("send")))
+        send = pipelines[1].outputs[0].get_by_name("send")
+        deadline = time.monotonic() + 5
+        while not get_source_stats(send) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        stats = get_source_stats(send)
+        for media, receiver in zip(pipelines, receivers):
+            media.close()
+            receiver.set_state(Gst.State.NULL)
+        return stats
+
+    assert asyncio.run(run())
+
+
+def test_signaling_order():
+    """Test queued signaling messages are sent in order without blocking."""
+    sent = []
+
+    async def send(message):
+        """Record sent message."""
+        sent.append(message)
+
+    async def run():
+        """Queue messages from another thread."""
+        client.event_loop = asyncio.get_event_loop()
+        await client.event_loop.run_in_executor(
+            None, lambda: [client.queue_signaling(send, i) for i in range(10)]
+        )
+        await asyncio.sleep(0.1)
+
+    client = WebRTCClient("rtmp://localhost:1935/live/test", 1048576, None, None)
+    asyncio.run(run())
+    assert sent == list(range(10))
+
+
+def test_pattern_source():
+    """Test description of test sources."""
+    desc = pattern_source_desc("test:")
+    assert "width=1280,height=720,framerate=30/1" in desc
+    assert "audiotestsrc" in desc
+    desc = pattern_source_desc("test:?width=1920&height=1080&audio=0")
+    assert "width=1920,height=1080" in desc
+    assert "audiotestsrc" not in desc
+    desc = pattern_source_desc("test:", ("audio",))
+    assert desc == "audiotestsrc is-live=true wave=ticks"
+
+
+def test_local_source():
+    """Test description of local ingest sources."""
+    desc = local_source_desc("shm:///tmp/video?audio=/tmp/audio")
+    assert desc.startswith("shmsrc socket-path=/tmp/video ")
+    assert "socket-path=/tmp/audio" in desc and "name=dec1" in desc
+    desc = local_source_desc("fd://3", "video/x-h264")
+    assert desc == 'fdsrc fd=3 ! decodebin caps="video/x-h264" name=dec0'
+
+
+def test_restart_source():
+    """Test lost input is restarted, unless it cannot be reopened."""
+    for uri, restarted in [("rtmp://localhost/live/test", True), ("fd://3", False)]:
+        media = MediaPipeline(uri, 1048576)
+        media.pipe, media.event_loop = mock.Mock(), mock.Mock()
+        source = media.source = mock.Mock()
+        media.restart_source(source)
+        media.restart_source(source)  # already restarted
+        assert media.source is None
+        media.pipe.remove.assert_called_once_with(source)
+        assert media.event_loop.call_later.called == restarted
+        assert media.event_loop.call_later.call_count <= 1
+
+
+def test_passthrough_stages():
+    """Test encoding latency is not measured without encoder."""
+    media = MediaPipeline("test:", 1048576)
+    assert ("video", "encoded", "converted", "vtee", "sink") in media.pipeline_stages()
+    media = MediaPipeline("test:", 1048576, codec="h264-passthrough")
+    stages = media.pipeline_stages()
+    assert ("video", "encoded", None, "vtee", "sink") in stages
+    assert ("audio", "encoded", "converted", "atee", "sink") in stages
+
+
+def test_passthrough_queues():
+    """Test encoded video is never dropped by queues between stages."""
+    media = MediaPipeline("rtmp://localhost/live/test", 1048576)
+    leaky = dict(re.findall(r"queue name=(\w+) [^!]*leaky=(\w+)", media.pipeline_desc))
+    assert leaky == {"vinq": "downstream", "vencq": "downstream", "ainq": "downstream"}
+    media = MediaPipeline(
+        "rtmp://localhost/live/test", 1048576, codec="h264-passthrough"
+    )
+    leaky = dict(re.findall(r"queue name=(\w+) [^!]*leaky=(\w+)", media.pipeline_desc))
+    assert leaky == {"vinq": "no", "vencq": "no", "ainq": "downstream"}
+    assert list(media.dropped) == ["ainq"]
+
+
+def test_profile_element_once():
+    """Test element walked and announced as added is only probed once."""
+    media = MediaPipeline("test:", 1048576, profiler=Profiler())
+    element = mock.Mock()
+    element.get_name.return_value = "venc"
+    element.get_factory.return_value.get_name.return_value = "vp8enc"
+    pad = mock.Mock()
+    pad.get_direction.return_value = Gst.PadDirection.SRC
+    element.iterate_pads.return_value = [pad]
+    media.profile_element(element)
+    media.on_element_added(None, None, element)
+    element.connect.assert_called_once()
+    pad.add_probe.assert_called_once()
+    media.close()
+    media.profile_element(element)
+    assert element.connect.call_count == 2
+
+
+def test_resume_passthrough_video():
+    """Test passthrough video resumes at a keyframe asked to the input."""
+    media = MediaPipeline("rtsp://localhost/camera", 1048576, codec="h264-passthrough")
+    elements = {"vvalve": mock.Mock()}
+    media.pipe = mock.Mock()
+    media.pipe.get_by_name.side_effect = elements.get
+    valve = elements["vvalve"]
+    media.set_video_enabled(False)
+    valve.set_property.assert_called_once_with("drop", True)
+    valve.get_static_pad("sink").send_event.assert_not_called()
+
+    media.set_video_enabled(True)
+    valve.set_property.assert_called_with("drop", False)
+    valve.get_static_pad("sink").send_event.assert_called_once()
+    valve.get_static_pad("src").add_probe.assert_called_once_with(
+        Gst.PadProbeType.BUFFER, media.on_resumed_video
+    )
+
+    info = mock.Mock()
+    info.get_buffer.return_value.has_flags.return_value = True
+    assert media.on_resumed_video(None, info) == Gst.PadProbeReturn.DROP
+    info.get_buffer.return_value.has_flags.return_value = False
+    assert media.on_resumed_video(None, info) == Gst.PadProbeReturn.REMOVE
+
+
+def test_ingest_delay_measured():
+    """Test input buffers are only probed when dropping or reporting delay."""
+    uri = "srt://localhost:9000"
+    assert MediaPipeline(uri, 1048576).ingest_delays == {}
+    media = MediaPipeline(uri, 1048576, ingest_profile="low-latency")
+    assert {k: d.max_lag for k, d in media.ingest_delays.items()} == {
+        "video": 0.2,
+        "audio": 0.2,
+    }
+    media = MediaPipeline(
+        uri, 1048576, codec="h264-passthrough", ingest_profile="low-latency"
+    )
+    assert list(media.ingest_delays) == ["audio"]
+    media = MediaPipeline(
+        uri,
+        1048576,
+        codec="h264-passthrough",
+        latency_tracer=LatencyTracer(),
+        ingest_profile="low-latency",
+    )
+    assert media.ingest_delays["video"].max_lag is None
+
+
+def test_recorder_desc():
+    """Test recorder records each published media kind."""
+    media = MediaPipeline("test:", 1048576, kinds=("audio",), record_dir="/tmp")
+    desc = media.recorder_desc("/tmp/rec-%05d.webm")
+    assert desc.startswith("splitmuxsink name=rec muxer-factory=webmmux ")
+    assert 'location="/tmp/rec-%05d.webm"' in desc
+    assert "name=raqueue ! rec.audio_%u" in desc and "rvqueue" not in desc
+
+
+def test_stop_recorder():
+    """Test pipeline is stopped once last segment is written, or on timeout."""
+    media = MediaPipeline("test:", 1048576, record_dir="/tmp")
+    assert media.stop_recorder() is None
+    recorder = media.recorder = mock.Mock()
+    closed = media.stop_recorder()
+    assert media.recorder is None and not closed.is_set()
+    assert recorder.get_static_pad.return_value.send_event.call_count == 2
+    assert media.record_closing == {recorder.get_by_name.return_value: closed}
+
+    pipe = mock.Mock()
+    closed.set()
+    media.finalize_recording(pipe, closed)
+    pipe.set_state.assert_called_once()
+    assert media.record_closing == {}
+
+    media.record_finalize_timeout = 0.01
+    pipe = mock.Mock()
+    media.finalize_recording(pipe, threading.Event())
+    pipe.set_state.assert_called_once()